@@ -5,13 +5,32 @@ import hashlib
 import datetime
 import time
 import hmac
-from typing import Optional, List, Literal, Dict
-from fastapi import FastAPI, HTTPException, Header
+import html
+import pathlib
+import threading
+import queue
+import concurrent.futures
+import multiprocessing
+import asyncio
+import bisect
+from collections import OrderedDict
+import random
+import re
+import logging
+import functools
+import itertools
+import mmap
+import struct
+import zlib
+from contextlib import contextmanager
+from typing import Optional, List, Literal, Dict, Tuple
+from fastapi import FastAPI, HTTPException, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
+from starlette.concurrency import run_in_threadpool
 import sqlite3
 import jwt
 import io
@@ -23,7 +42,43 @@ except Exception:
 
 JWT_ALG = "HS256"
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
+JWT_TTL_S = int(os.getenv("JWT_TTL_S", str(12 * 3600)))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "300"))
 DB_PATH = os.getenv("DB_PATH", "rewards.db")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # NORMAL is durable across app crashes in WAL mode
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_KIB = int(os.getenv("DB_CACHE_KIB", "65536"))
+DB_MMAP_BYTES = int(os.getenv("DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+LEDGER_MAX_BATCH = int(os.getenv("LEDGER_MAX_BATCH", "64"))
+LEDGER_MAX_LINGER_MS = float(os.getenv("LEDGER_MAX_LINGER_MS", "2"))
+TX_BATCH_MAX_OPS = int(os.getenv("TX_BATCH_MAX_OPS", "5000"))
+TX_PAGE_MAX = int(os.getenv("TX_PAGE_MAX", "1000"))
+TX_STREAM_BATCH = int(os.getenv("TX_STREAM_BATCH", "1000"))
+VERIFY_CHUNK_SIZE = int(os.getenv("VERIFY_CHUNK_SIZE", "20000"))
+VERIFY_WORKERS = int(os.getenv("VERIFY_WORKERS", str(min(4, os.cpu_count() or 1))))
+METRICS_SQL = os.getenv("METRICS_SQL", "1") != "0"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+BALANCE_SNAPSHOT_EVERY = int(os.getenv("BALANCE_SNAPSHOT_EVERY", "100000"))  # ledger rows between snapshots, 0 = off
+BALANCE_SNAPSHOT_KEEP = int(os.getenv("BALANCE_SNAPSHOT_KEEP", "3"))
+BALANCE_CHECK_ON_STARTUP = os.getenv("BALANCE_CHECK_ON_STARTUP", "warn")  # off | warn | repair | fail
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")  # default: "<DB_PATH without extension>-archive"
+ARCHIVE_MIN_AGE_DAYS = int(os.getenv("ARCHIVE_MIN_AGE_DAYS", "2"))
+ARCHIVE_BLOCK_ROWS = int(os.getenv("ARCHIVE_BLOCK_ROWS", "1024"))
+ALERT_FLUSH_MS = float(os.getenv("ALERT_FLUSH_MS", "1000"))
+ALERT_DEDUP_WINDOW_S = float(os.getenv("ALERT_DEDUP_WINDOW_S", "60"))
+ALERT_MAX_PENDING = int(os.getenv("ALERT_MAX_PENDING", "10000"))
+EVENTS_QUEUE_MAX = int(os.getenv("EVENTS_QUEUE_MAX", "1000"))
+EVENTS_RESUME_MAX = int(os.getenv("EVENTS_RESUME_MAX", "1000"))
+EVENTS_PING_S = float(os.getenv("EVENTS_PING_S", "15"))
+EVENTS_POLL_MS = float(os.getenv("EVENTS_POLL_MS", "1000"))  # 0 = only this process's own commits
+QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "1024"))
+QR_SHEET_MAX = int(os.getenv("QR_SHEET_MAX", "500"))
+QR_TTL_MAX_S = int(os.getenv("QR_TTL_MAX_S", str(30 * 86400)))
+EXPIRY_CHUNK_SIZE = int(os.getenv("EXPIRY_CHUNK_SIZE", "500"))
+EXPIRY_WORKERS = int(os.getenv("EXPIRY_WORKERS", "4"))
 
 app = FastAPI(title="Township Rewards (Starter Kit)", version="0.3.0 (easy wins)")
 
@@ -35,18 +90,378 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-templates = Jinja2Templates(directory="backend/templates")
-app.mount("/static", StaticFiles(directory="backend/static"), name="static")
+# ---------- Metrics ----------
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
-def db():
-    return sqlite3.connect(DB_PATH)
+class Metrics:
+    # Process-local counters and cumulative histograms, rendered in Prometheus text format.
+    # Series are keyed by (name, labels) with labels a tuple of (key, value) pairs.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        self._hists: Dict[tuple, list] = {}  # -> [bucket counts..., sum, count]
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def describe(self, name: str, mtype: str, help_text: str):
+        self._help[name] = (mtype, help_text)
+
+    def inc(self, name: str, labels: tuple = (), n: float = 1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + n
+
+    def observe(self, name: str, seconds: float, labels: tuple = ()):
+        self.observe_many(name, [(labels, seconds)])
+
+    def observe_many(self, name: str, samples: List[Tuple[tuple, float]]):
+        with self._lock:
+            for labels, seconds in samples:
+                h = self._hists.get((name, labels))
+                if h is None:
+                    h = self._hists[(name, labels)] = [0] * (len(LATENCY_BUCKETS) + 2)
+                i = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+                if i < len(LATENCY_BUCKETS):
+                    h[i] += 1
+                h[-2] += seconds
+                h[-1] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters, self._hists = {}, {}
+
+    def render(self, gauges: Dict[str, Dict[tuple, float]]) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            hists = {k: list(v) for k, v in self._hists.items()}
+        out, seen = [], set()
+        def header(name, mtype):
+            if name not in seen:
+                seen.add(name)
+                out.append(f"# HELP {name} {self._help.get(name, (mtype, name))[1]}")
+                out.append(f"# TYPE {name} {mtype}")
+        for (name, labels), v in sorted(counters.items()):
+            header(name, "counter")
+            out.append(f"{name}{_prom_labels(labels)} {v}")
+        for (name, labels), h in sorted(hists.items()):
+            header(name, "histogram")
+            running = 0
+            for le, n in zip(LATENCY_BUCKETS, h):
+                running += n
+                out.append(f"{name}_bucket{_prom_labels(labels + (('le', repr(le)),))} {running}")
+            out.append(f"{name}_bucket{_prom_labels(labels + (('le', '+Inf'),))} {h[-1]}")
+            out.append(f"{name}_sum{_prom_labels(labels)} {h[-2]}")
+            out.append(f"{name}_count{_prom_labels(labels)} {h[-1]}")
+        for name, series in sorted(gauges.items()):
+            header(name, "gauge")
+            for labels, v in sorted(series.items()):
+                out.append(f"{name}{_prom_labels(labels)} {v}")
+        return "\n".join(out) + "\n"
+
+def _prom_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+METRICS = Metrics()
+METRICS.describe("boro_http_request_seconds", "histogram", "Request latency by route template, until the last body chunk is sent")
+METRICS.describe("boro_sql_seconds", "histogram", "Statement execute() time by normalized SQL (excludes fetching)")
+METRICS.describe("boro_apply_tx_phase_seconds", "histogram", "apply_tx time per phase")
+METRICS.describe("boro_rate_limited_total", "counter", "Operations rejected with 429 by the rate limit or a daily cap")
+METRICS.describe("boro_alerts_total", "counter", "Alerts raised by type (including ones in transactions that later rolled back)")
+METRICS.describe("boro_sqlite_busy_total", "counter", "Statements that failed with SQLITE_BUSY/locked")
+METRICS.describe("boro_sqlite_busy_retries_total", "counter", "BEGIN IMMEDIATE retries after SQLITE_BUSY")
+SLOW_LOG = logging.getLogger("boro.slow_query")
+
+@functools.lru_cache(maxsize=2048)
+def normalize_sql(sql: str) -> str:
+    # One label per statement shape: collapse whitespace and variable-length "?,?,?" lists.
+    return re.sub(r"\?(\s*,\s*\?)+", "?,...", " ".join(sql.split()))
+
+def _is_busy(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        except sqlite3.OperationalError as e:
+            if _is_busy(e):
+                METRICS.inc("boro_sqlite_busy_total")
+            raise
+        finally:
+            self._timed(sql, params, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        except sqlite3.OperationalError as e:
+            if _is_busy(e):
+                METRICS.inc("boro_sqlite_busy_total")
+            raise
+        finally:
+            self._timed(sql, None, time.perf_counter() - t0)
+
+    @staticmethod
+    def _timed(sql: str, params, elapsed: float):
+        stmt = normalize_sql(sql)
+        METRICS.observe("boro_sql_seconds", elapsed, (("stmt", stmt),))
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            SLOW_LOG.warning("slow query %.1f ms: %s params=%r", elapsed * 1000, stmt, params)
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (no per-request task like BaseHTTPMiddleware). The route label is the
+    # matched path template, so /balance/{account_id} is one series however many ids are polled.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        status = [500]
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                self._record(scope, status[0], time.perf_counter() - t0)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            self._record(scope, 500, time.perf_counter() - t0)
+            raise
+
+    @staticmethod
+    def _record(scope, status: int, elapsed: float):
+        route = scope.get("route")
+        path = getattr(route, "path", None) or ("/static" if scope["path"].startswith("/static/") else "<unmatched>")
+        METRICS.observe("boro_http_request_seconds", elapsed,
+                        (("method", scope["method"]), ("route", path), ("status", str(status))))
+
+app.add_middleware(MetricsMiddleware)
+
+BASE_DIR = pathlib.Path(__file__).resolve().parent  # works from the repo root and from backend/ (scripts/run.sh)
+templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
+
+def db(readonly: bool = False):
+    # Autocommit connections: write transactions are opened explicitly with BEGIN IMMEDIATE.
+    factory = TimedConnection if METRICS_SQL else sqlite3.Connection
+    if readonly:
+        uri = pathlib.Path(DB_PATH).absolute().as_uri() + "?mode=ro"
+        con = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False, factory=factory)
+    else:
+        con = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, factory=factory)
+        con.execute("PRAGMA journal_mode=WAL")
+    con.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    con.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    con.execute(f"PRAGMA cache_size=-{DB_CACHE_KIB}")
+    con.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES}")
+    return con
+
+class ConnectionPool:
+    # One long-lived read-only connection per thread, plus a single shared write connection
+    # serialised by a lock. WAL lets the readers run while the writer holds its transaction.
+    def __init__(self):
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._readers = []
+        self._stats_lock = threading.Lock()
+        self._undo = []
+        self._after_commit = []
+        self._data_version = None
+        self._external_change_listeners = []
+        self._stream_free = []
+        self._stats = {"read_checkouts": 0, "read_connections": 0, "stream_checkouts": 0, "write_checkouts": 0,
+                       "write_wait_s": 0.0, "write_wait_max_s": 0.0, "write_hold_s": 0.0}
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for k, v in deltas.items():
+                self._stats[k] += v
+
+    @contextmanager
+    def read(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = db(readonly=True)
+            self._local.con = con
+            with self._stats_lock:
+                self._readers.append(con)
+                self._stats["read_connections"] += 1
+        self._count(read_checkouts=1)
+        cur = con.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    @contextmanager
+    def stream(self):
+        # Dedicated read-only connection for a streaming response: a generator can resume on any
+        # threadpool thread, so it must not share the per-thread connection of whoever created it.
+        with self._stats_lock:
+            con = self._stream_free.pop() if self._stream_free else None
+            self._stats["stream_checkouts"] += 1
+        if con is None:
+            con = db(readonly=True)
+            self._count(read_connections=1)
+        cur = con.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+            with self._stats_lock:
+                if len(self._stream_free) < 8:
+                    self._stream_free.append(con)
+                    con = None
+            if con is not None:
+                con.close()
+
+    @contextmanager
+    def write(self):
+        t0 = time.perf_counter()
+        with self._write_lock:
+            waited = time.perf_counter() - t0
+            with self._stats_lock:
+                self._stats["write_checkouts"] += 1
+                self._stats["write_wait_s"] += waited
+                self._stats["write_wait_max_s"] = max(self._stats["write_wait_max_s"], waited)
+            if self._writer is None:
+                self._writer = db()
+            cur = self._writer.cursor()
+            t1 = time.perf_counter()
+            self._begin(cur)
+            self._undo, self._after_commit = [], []
+            try:
+                self._sync_external_changes(cur)
+                yield cur
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                for fn in reversed(self._undo):
+                    fn()
+                raise
+            else:
+                for fn in self._after_commit:
+                    fn()
+            finally:
+                self._undo, self._after_commit = [], []
+                cur.close()
+                self._count(write_hold_s=time.perf_counter() - t1)
+
+    BEGIN_RETRIES = 3
+
+    def _begin(self, cur):
+        # busy_timeout already waits inside SQLite; this only covers another process holding the
+        # write lock past it (e.g. a long CLI maintenance job).
+        for attempt in range(self.BEGIN_RETRIES + 1):
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == self.BEGIN_RETRIES:
+                    raise
+                METRICS.inc("boro_sqlite_busy_retries_total")
+                time.sleep(0.05 * 2 ** attempt)
+
+    # The hooks below are only valid inside a POOL.write() block (i.e. with the write lock held).
+    def on_rollback(self, fn):
+        self._undo.append(fn)
+
+    def on_commit(self, fn):
+        self._after_commit.append(fn)
+
+    @contextmanager
+    def savepoint(self, cur, name: str = "item"):
+        # Nested unit inside a POOL.write() block: on error only its own rows and hooks are undone.
+        undo_mark, commit_mark = len(self._undo), len(self._after_commit)
+        cur.execute(f"SAVEPOINT {name}")
+        try:
+            yield cur
+        except BaseException:
+            cur.execute(f"ROLLBACK TO {name}")
+            cur.execute(f"RELEASE {name}")
+            for fn in reversed(self._undo[undo_mark:]):
+                fn()
+            del self._undo[undo_mark:]
+            del self._after_commit[commit_mark:]
+            raise
+        else:
+            cur.execute(f"RELEASE {name}")
+
+    def on_external_change(self, fn):
+        # fn(cur) runs inside the next write transaction after another process commits to the DB,
+        # so in-process state derived from the ledger can be reloaded before it is relied on.
+        self._external_change_listeners.append(fn)
+
+    def _sync_external_changes(self, cur):
+        # data_version only moves when a *different* connection commits; our own writes never bump it.
+        version = cur.execute("PRAGMA data_version").fetchone()[0]
+        if self._data_version is not None and version != self._data_version:
+            for fn in self._external_change_listeners:
+                fn(cur)
+        self._data_version = version
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            out = dict(self._stats)
+        n = out["write_checkouts"]
+        out["write_wait_avg_s"] = out["write_wait_s"] / n if n else 0.0
+        return out
+
+    def close_all(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._stats_lock:
+            readers, self._readers = self._readers, []
+            readers += self._stream_free
+            self._stream_free = []
+        for con in readers:
+            try:
+                con.close()
+            except sqlite3.ProgrammingError:
+                pass  # owned by another thread that already closed it
+        self._local = threading.local()
+
+POOL = ConnectionPool()
 
 def canonical(obj) -> str:
     return json.dumps(obj, sort_keys=True, separators=(",",":"))
 
-def init_db():
-    con = db()
-    cur = con.cursor()
+# ts is stored as an ISO string, so a calendar day is the half-open range [ymd, next ymd).
+# Comparing ts directly (instead of DATE(ts)) lets SQLite use the ts indexes.
+def day_bounds(ymd: str) -> Tuple[str, str]:
+    try:
+        d = datetime.date.fromisoformat(ymd)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    return d.isoformat(), (d + datetime.timedelta(days=1)).isoformat()
+
+def span_bounds(date_from: str, date_to: str) -> Tuple[str, str]:
+    return day_bounds(date_from)[0], day_bounds(date_to)[1]
+
+def process_pool(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    # Spawned, never forked: a fork of this multithreaded process (writer, flusher and pool
+    # threads) can leave the child blocked on a lock another thread held at fork time. Worker
+    # functions are plain module functions that touch no pool, cache or thread state.
+    return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+# ---------- Schema & migrations ----------
+def _mig_base_tables(cur):
     cur.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id TEXT PRIMARY KEY,
@@ -103,26 +518,254 @@ def init_db():
         value TEXT NOT NULL
     );
     """)
-    # Add merchant caps columns if missing
+    cur.execute("INSERT OR IGNORE INTO settings(key,value) VALUES('expiry_days','0')")
+
+def _mig_merchant_caps(cur):
+    have = {r[1] for r in cur.execute("PRAGMA table_info(merchants)").fetchall()}
     for col, default in [
         ("rate_limit_per_minute", 60),
         ("daily_earn_cap", 100000),
         ("daily_redeem_cap", 100000),
     ]:
-        try:
+        if col not in have:
             cur.execute(f"ALTER TABLE merchants ADD COLUMN {col} INTEGER DEFAULT {default}")
+
+def _mig_tx_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tx_merchant_ts ON transactions(merchant_id, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tx_user_type_ts ON transactions(user_id, ttype, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tx_type_ts ON transactions(ttype, ts)")
+    # chain head lookup and whole-day scans (anchors) order by ts alone
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tx_ts ON transactions(ts)")
+
+def _mig_tx_seq(cur):
+    # Explicit chain order; existing rows are numbered in the old (ts, ROWID) order.
+    cur.execute("ALTER TABLE transactions ADD COLUMN seq INTEGER")
+    rowids = cur.execute("SELECT ROWID FROM transactions ORDER BY ts ASC, ROWID ASC").fetchall()
+    cur.executemany("UPDATE transactions SET seq = ? WHERE ROWID = ?",
+                    ((n, rowid) for n, (rowid,) in enumerate(rowids, start=1)))
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tx_seq ON transactions(seq)")
+
+def _mig_idempotency_keys(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        scope TEXT NOT NULL,   -- caller identity (merchant id or admin)
+        key TEXT NOT NULL,
+        tx_id TEXT NOT NULL,
+        result TEXT NOT NULL,  -- JSON of the tx returned on first apply
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (scope, key)
+    ) WITHOUT ROWID;
+    """)
+
+def _mig_merkle_frontier(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS merkle_frontier (
+        ymd TEXT PRIMARY KEY,
+        leaf_count INTEGER NOT NULL,
+        frontier TEXT NOT NULL  -- JSON list, one hex subtree root (or null) per level
+    );
+    """)
+    days: Dict[str, MerkleAccumulator] = {}
+    for ts, thash in cur.execute("SELECT ts, thash FROM transactions ORDER BY seq").fetchall():
+        days.setdefault(ts[:10], MerkleAccumulator()).append(bytes.fromhex(thash))
+    cur.executemany("INSERT OR REPLACE INTO merkle_frontier(ymd, leaf_count, frontier) VALUES(?,?,?)",
+                    [(ymd, acc.count, acc.dumps()) for ymd, acc in days.items()])
+
+def _mig_lots(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS lots (
+        seq INTEGER PRIMARY KEY,  -- seq of the EARN/ISSUE transaction that opened the lot
+        user_id TEXT NOT NULL,
+        ts TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        remaining INTEGER NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_lots_open_user ON lots(user_id, seq) WHERE remaining > 0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_lots_open_ts ON lots(ts, user_id) WHERE remaining > 0")
+    rebuild_lots(cur)
+
+def _mig_expiry_jobs(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS expiry_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        status TEXT NOT NULL,  -- running, done, failed
+        days INTEGER NOT NULL,
+        cutoff TEXT NOT NULL,
+        last_user_id TEXT,     -- keyset checkpoint: every user <= this has been processed
+        users_total INTEGER NOT NULL,
+        users_scanned INTEGER NOT NULL DEFAULT 0,
+        users_expired INTEGER NOT NULL DEFAULT 0,
+        points_expired INTEGER NOT NULL DEFAULT 0,
+        started_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        finished_at TEXT,
+        error TEXT
+    );
+    """)
+
+def _mig_merchant_rollup(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS merchant_daily_rollup (
+        merchant_id TEXT NOT NULL,
+        ymd TEXT NOT NULL,
+        earn_total INTEGER NOT NULL DEFAULT 0,
+        earn_count INTEGER NOT NULL DEFAULT 0,
+        redeem_total INTEGER NOT NULL DEFAULT 0,
+        redeem_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (merchant_id, ymd)
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rollup_ymd ON merchant_daily_rollup(ymd)")
+    rebuild_rollups(cur)
+
+def _mig_tx_history_indexes(cur):
+    # keyset pages of one user's / one merchant's history walk these in seq order
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tx_user_seq ON transactions(user_id, seq)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tx_merchant_seq ON transactions(merchant_id, seq)")
+
+def _mig_verify_checkpoints(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS verify_checkpoints (
+        seq INTEGER PRIMARY KEY,  -- every row up to and including this seq has been verified
+        thash TEXT NOT NULL,
+        verified_at TEXT NOT NULL,
+        rows INTEGER NOT NULL,
+        elapsed_s REAL NOT NULL
+    );
+    """)
+
+def _mig_archive_segments(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS archive_segments (
+        ymd TEXT PRIMARY KEY,
+        file TEXT NOT NULL,         -- relative to the archive directory
+        first_seq INTEGER NOT NULL,
+        last_seq INTEGER NOT NULL,
+        tx_count INTEGER NOT NULL,
+        merkle_root TEXT NOT NULL,
+        last_thash TEXT NOT NULL,
+        bytes INTEGER NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    """)
+
+def _mig_balance_snapshots(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        seq INTEGER NOT NULL,       -- balances after applying every row up to this seq
+        thash TEXT,                 -- thash of that row; the snapshot is ignored if it no longer matches
+        accounts INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        elapsed_s REAL NOT NULL
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS balance_snapshot_rows (
+        snapshot_id INTEGER NOT NULL,
+        account_id TEXT NOT NULL,
+        balance INTEGER NOT NULL,   -- only non-zero balances are stored
+        PRIMARY KEY(snapshot_id, account_id)
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_balance_snapshots_seq ON balance_snapshots(seq)")
+
+def _mig_config_version(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS config_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL  -- bumped by every admin write to merchant limits or settings
+    );
+    """)
+    cur.execute("INSERT OR IGNORE INTO config_version(id, version) VALUES(1, 1)")
+
+def _mig_alert_dedup(cur):
+    have = {r[1] for r in cur.execute("PRAGMA table_info(alerts)").fetchall()}
+    if "count" not in have:
+        cur.execute("ALTER TABLE alerts ADD COLUMN count INTEGER NOT NULL DEFAULT 1")
+    if "last_ts" not in have:
+        cur.execute("ALTER TABLE alerts ADD COLUMN last_ts TEXT")  # newest occurrence folded into this row
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts(ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_alerts_type_ts ON alerts(atype, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_alerts_merchant_ts ON alerts(merchant_id, ts)")
+
+def _mig_balance_version(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS balance_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL  -- bumped by balance rewrites that add no ledger row (repair)
+    );
+    """)
+    cur.execute("INSERT OR IGNORE INTO balance_version(id, version) VALUES(1, 1)")
+
+# (version, name, fn) -- append only; never renumber or edit an applied migration
+MIGRATIONS = [
+    (1, "base tables", _mig_base_tables),
+    (2, "merchant caps columns", _mig_merchant_caps),
+    (3, "transaction indexes", _mig_tx_indexes),
+    (4, "transaction seq column", _mig_tx_seq),
+    (5, "idempotency keys", _mig_idempotency_keys),
+    (6, "daily merkle frontiers", _mig_merkle_frontier),
+    (7, "fifo lots", _mig_lots),
+    (8, "expiry jobs", _mig_expiry_jobs),
+    (9, "merchant daily rollup", _mig_merchant_rollup),
+    (10, "transaction history indexes", _mig_tx_history_indexes),
+    (11, "verify checkpoints", _mig_verify_checkpoints),
+    (12, "archive segments", _mig_archive_segments),
+    (13, "balance snapshots", _mig_balance_snapshots),
+    (14, "config version", _mig_config_version),
+    (15, "alert dedup columns and indexes", _mig_alert_dedup),
+    (16, "balance version", _mig_balance_version),
+]
+
+def schema_version(cur) -> int:
+    return cur.execute("SELECT COALESCE(MAX(version),0) FROM schema_migrations").fetchone()[0]
+
+def migrate(con) -> List[int]:
+    cur = con.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    );
+    """)
+    current = schema_version(cur)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            fn(cur)
+            cur.execute("INSERT INTO schema_migrations(version, name, applied_at) VALUES(?,?,?)",
+                        (version, name, datetime.datetime.utcnow().isoformat()))
+            cur.execute("COMMIT")
         except Exception:
-            pass
-    # Default settings
-    if not cur.execute("SELECT 1 FROM settings WHERE key='expiry_days'").fetchone():
-        cur.execute("INSERT INTO settings(key,value) VALUES('expiry_days','0')")
-    con.commit()
+            cur.execute("ROLLBACK")
+            raise
+        applied.append(version)
+    return applied
+
+def init_db():
+    con = db()
+    migrate(con)
     con.close()
+    with POOL.write() as cur:
+        CHAIN.load(cur)
+        LIMITER.rebuild(cur)
+        BALANCES.load(cur)
+        ARCHIVE.load(cur)
+        SNAPSHOTS.load(cur)
+        CONFIG.sync(cur)
 
 def seed_demo():
-    con = db(); cur = con.cursor()
-    existing = cur.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-    if existing == 0:
+    with POOL.write() as cur:
+        existing = cur.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        if existing != 0:
+            return
         users = [
             ("admin", "admin", "Program Admin"),
             ("user1", "user", "Alex Johnson"),
@@ -139,13 +782,36 @@ def seed_demo():
         cur.executemany("INSERT INTO accounts(id, kind, balance) VALUES(?, 'merchant', 0)",
                         [(m[0],) for m in merchants])
         cur.execute("INSERT OR IGNORE INTO accounts(id, kind, balance) VALUES('system', 'system', 0)")
-        con.commit()
-    con.close()
+        BALANCES.open_accounts([(u[0], "user") for u in users if u[1]=="user"] +
+                               [(m[0], "merchant") for m in merchants] + [("system", "system")])
 
 def hash_tx(payload: dict, prev_hash: Optional[str]) -> str:
+    # Reference definition of the ledger hash; tx_hash is the fast equivalent used on hot paths.
     body = {"payload": payload, "prev_hash": prev_hash or ""}
     return hashlib.sha256(canonical(body).encode("utf-8")).hexdigest()
 
+# canonical({"payload": {...}, "prev_hash": ...}) with the keys already in sort_keys order.
+# Strings go through the same C escaper json.dumps uses, so for str/int/None fields the bytes
+# (and hash) are identical to hash_tx; any other type falls back to canonical() for that field.
+_TX_HASH_BODY = '{"payload":{"amount":%s,"merchant_id":%s,"note":%s,"ts":%s,"ttype":%s,"user_id":%s},"prev_hash":%s}'
+_json_str = json.encoder.encode_basestring_ascii
+
+def _json_field(v) -> str:
+    t = type(v)
+    if t is str:
+        return _json_str(v)
+    if v is None:
+        return "null"
+    if t is int:
+        return int.__repr__(v)
+    return canonical(v)
+
+def tx_hash(ts: str, ttype: str, user_id: Optional[str], merchant_id: Optional[str], amount: int,
+            note: Optional[str], prev_hash: Optional[str]) -> str:
+    body = _TX_HASH_BODY % (_json_field(amount), _json_field(merchant_id), _json_field(note), _json_field(ts),
+                            _json_field(ttype), _json_field(user_id), _json_str(prev_hash or ""))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
 def merkle_root(hashes: List[str]) -> str:
     if not hashes:
         return ""
@@ -160,18 +826,417 @@ def merkle_root(hashes: List[str]) -> str:
         layer = nxt
     return layer[0].hex()
 
-def get_last_tx_hash(cur) -> Optional[str]:
-    r = cur.execute("SELECT thash FROM transactions ORDER BY ts DESC, ROWID DESC LIMIT 1").fetchone()
-    return r[0] if r else None
+def merkle_proof(hashes: List[str], index: int) -> List[Dict[str,str]]:
+    # Sibling path for hashes[index] under the same odd-node duplication rule as merkle_root.
+    path = []
+    layer = [bytes.fromhex(h) for h in hashes]
+    while len(layer) > 1:
+        sib = index ^ 1
+        sibling = layer[sib] if sib < len(layer) else layer[index]
+        path.append({"hash": sibling.hex(), "side": "left" if index & 1 else "right"})
+        layer = [hashlib.sha256(layer[i] + (layer[i+1] if i+1 < len(layer) else layer[i])).digest()
+                 for i in range(0, len(layer), 2)]
+        index //= 2
+    return path
+
+def verify_merkle_proof(leaf: str, path: List[Dict[str,str]], root: str) -> bool:
+    try:
+        h = bytes.fromhex(leaf)
+        for step in path:
+            sib = bytes.fromhex(step["hash"])
+            h = hashlib.sha256(sib + h if step["side"] == "left" else h + sib).digest()
+        return hmac.compare_digest(h.hex(), root)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+class MerkleAccumulator:
+    # Append-only Merkle frontier: frontier[i] is the root of a complete 2**i-leaf subtree still
+    # waiting for its right sibling. root() closes the open right edge with merkle_root's
+    # "duplicate the odd node" rule, so it equals merkle_root(all leaves) in O(log n).
+    __slots__ = ("count", "frontier")
+
+    def __init__(self, count: int = 0, frontier: Optional[List[Optional[bytes]]] = None):
+        self.count = count
+        self.frontier = frontier or []
+
+    def append(self, leaf: bytes):
+        carry, i = leaf, 0
+        while i < len(self.frontier) and self.frontier[i] is not None:
+            carry = hashlib.sha256(self.frontier[i] + carry).digest()
+            self.frontier[i] = None
+            i += 1
+        if i == len(self.frontier):
+            self.frontier.append(None)
+        self.frontier[i] = carry
+        self.count += 1
+
+    def root(self) -> str:
+        node = None
+        top = len(self.frontier) - 1
+        for i, left in enumerate(self.frontier):
+            if left is not None and node is None:
+                if i == top:
+                    return left.hex()
+                node = hashlib.sha256(left + left).digest()
+            elif left is not None:
+                node = hashlib.sha256(left + node).digest()
+            elif node is not None:
+                node = hashlib.sha256(node + node).digest()
+        return node.hex() if node is not None else ""
+
+    def dumps(self) -> str:
+        return json.dumps([f.hex() if f is not None else None for f in self.frontier])
+
+    @classmethod
+    def loads(cls, count: int, data: str) -> "MerkleAccumulator":
+        return cls(count, [bytes.fromhex(f) if f is not None else None for f in json.loads(data)])
+
+class DailyMerkle:
+    # One accumulator per UTC day, persisted to merkle_frontier in the same transaction as the rows
+    # it covers. Only recent days stay cached; anything else is reloaded from its row on demand.
+    CACHE_DAYS = 8
+
+    def __init__(self):
+        self._days: Dict[str, MerkleAccumulator] = {}
+
+    def clear(self):
+        self._days = {}
+
+    def get(self, cur, ymd: str) -> MerkleAccumulator:
+        acc = self._days.get(ymd)
+        if acc is None:
+            r = cur.execute("SELECT leaf_count, frontier FROM merkle_frontier WHERE ymd=?", (ymd,)).fetchone()
+            acc = MerkleAccumulator.loads(r[0], r[1]) if r else MerkleAccumulator()
+            self._days[ymd] = acc
+            for old in sorted(self._days)[:-self.CACHE_DAYS]:
+                del self._days[old]
+        return acc
+
+    def append_rows(self, cur, rows: List[tuple]):
+        by_day: Dict[str, List[bytes]] = {}
+        for r in rows:
+            by_day.setdefault(r[2][:10], []).append(bytes.fromhex(r[8]))
+        for ymd, leaves in by_day.items():
+            acc = self.get(cur, ymd)
+            snapshot = (acc.count, list(acc.frontier))
+            POOL.on_rollback(lambda acc=acc, snap=snapshot: self._restore(acc, snap))
+            for leaf in leaves:
+                acc.append(leaf)
+            cur.execute("""INSERT INTO merkle_frontier(ymd, leaf_count, frontier) VALUES(?,?,?)
+                           ON CONFLICT(ymd) DO UPDATE SET leaf_count=excluded.leaf_count, frontier=excluded.frontier""",
+                        (ymd, acc.count, acc.dumps()))
+
+    @staticmethod
+    def _restore(acc: MerkleAccumulator, snapshot):
+        acc.count, acc.frontier = snapshot[0], snapshot[1]
+
+MERKLE = DailyMerkle()
+POOL.on_external_change(lambda cur: MERKLE.clear())
+
+SQL_CHAIN_HEAD = "SELECT seq, thash FROM transactions ORDER BY seq DESC LIMIT 1"
+SQL_ARCHIVE_HEAD = "SELECT last_seq, last_thash FROM archive_segments ORDER BY last_seq DESC LIMIT 1"  # every row archived
+
+class ChainHead:
+    # Last (seq, thash) of the ledger, loaded once and then advanced by apply_tx under the write
+    # lock. A rolled-back write restores the previous head, so it always matches committed rows.
+    def __init__(self):
+        self.seq = 0
+        self.thash = None
+
+    def load(self, cur):
+        r = cur.execute(SQL_CHAIN_HEAD).fetchone() or cur.execute(SQL_ARCHIVE_HEAD).fetchone()
+        self.seq, self.thash = (r[0], r[1]) if r else (0, None)
+
+    def advance(self, seq: int, thash: str):
+        prev = (self.seq, self.thash)
+        self.seq, self.thash = seq, thash
+        POOL.on_rollback(lambda: self._restore(prev))
+
+    def _restore(self, head):
+        self.seq, self.thash = head
+
+CHAIN = ChainHead()
+POOL.on_external_change(CHAIN.load)
+
+# (ledger head seq, balance_version): every committed balance change moves one of the two.
+SQL_BALANCE_VERSION = """
+SELECT COALESCE((SELECT seq FROM transactions ORDER BY seq DESC LIMIT 1),
+                (SELECT last_seq FROM archive_segments ORDER BY last_seq DESC LIMIT 1), 0),
+       (SELECT version FROM balance_version WHERE id = 1)"""
+SQL_ACCOUNTS_AFTER = "SELECT rowid, id, kind, balance FROM accounts WHERE rowid > ?"
+
+class BalanceCache:
+    # (kind, balance) of every account, loaded once so balance reads never scan `accounts`.
+    # record_tx_rows stages its deltas as pending (undone on rollback, including a savepoint's)
+    # and they are folded into the committed view only after COMMIT, so readers never see a
+    # balance that could still roll back. The write path reads committed + pending, which is
+    # what its open transaction sees in `accounts`. The committed view is tagged with the
+    # version it describes; commits by another process are picked up at this process's next
+    # write (on_external_change) and, on read paths, by one version probe (sync).
+    def __init__(self):
+        self._committed: Dict[str, Tuple[str, int]] = {}
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.version: Tuple[int, int] = (0, 0)
+        self.rowid = 0  # highest accounts rowid seen; accounts are never deleted
+        self.loaded = False
+        self.hits = self.misses = self.reloads = self.catch_ups = 0
+
+    def load(self, cur):
+        # init_db, inside a POOL.write() block: nothing is staged yet
+        version = tuple(cur.execute(SQL_BALANCE_VERSION).fetchone())
+        rows = cur.execute(SQL_ACCOUNTS_AFTER, (0,)).fetchall()
+        with self._lock:
+            self._install(rows, version)
+            self._pending = {}
+            self.loaded = True
+
+    def catch_up(self, cur):
+        # on_external_change: inside the write that noticed another process's commit, before
+        # anything is staged
+        self._catch_up(cur)
+
+    def sync(self):
+        # Read path. Pending deltas are left to their writer, whose _commit drops them if the
+        # catch-up already holds them.
+        with POOL.read() as cur:
+            if not self._newer(tuple(cur.execute(SQL_BALANCE_VERSION).fetchone())):
+                return
+            cur.execute("BEGIN")
+            try:
+                self._catch_up(cur)
+            finally:
+                cur.execute("COMMIT")
+
+    def _catch_up(self, cur):
+        # Ledger rows after the cached seq are applied as balance deltas and accounts inserted
+        # since are read as they stand, all from one snapshot. The whole table is read only
+        # when balance_version moved (repair, rebuild) or the tail is no longer all live rows
+        # (archived meanwhile). A commit in this process while we read moves self.version;
+        # the work is then redone from there.
+        while True:
+            with self._lock:
+                base, rowid = self.version, self.rowid
+            version = tuple(cur.execute(SQL_BALANCE_VERSION).fetchone())
+            if not self._newer(version):
+                return
+            tail = self._read_tail(cur, base[0], version[0], rowid) if version[1] == base[1] else None
+            rows = None if tail else cur.execute(SQL_ACCOUNTS_AFTER, (0,)).fetchall()
+            with self._lock:
+                if self.version != base:
+                    continue
+                if tail:
+                    self._apply_tail(*tail)
+                    self.catch_ups += 1
+                else:
+                    self._install(rows, version)
+                    self.reloads += 1
+                self.version = version
+                return
+
+    @staticmethod
+    def _read_tail(cur, after: int, head: int, rowid: int):
+        deltas, n = {}, 0
+        cur.execute(SQL_LEDGER_AFTER, (after,))
+        for rows in iter(lambda: cur.fetchmany(TX_STREAM_BATCH), []):
+            n += len(rows)
+            balance_deltas(rows, deltas)
+        if n != head - after:
+            return None
+        return deltas, cur.execute(SQL_ACCOUNTS_AFTER, (rowid,)).fetchall()
+
+    def _apply_tail(self, deltas: Dict[str, int], opened: list):
+        # opened rows already include every delta up to the snapshot; also covers this
+        # process's own open_accounts, whose rowids were never recorded
+        for rid, acc, kind, bal in opened:
+            self._committed[acc] = (kind, bal)
+            self.rowid = max(self.rowid, rid)
+        fresh = {r[1] for r in opened}
+        for acc, d in deltas.items():
+            hit = self._committed.get(acc)
+            if hit and d and acc not in fresh:
+                self._committed[acc] = (hit[0], hit[1] + d)
+
+    def _install(self, rows: list, version: Tuple[int, int]):
+        self._committed = {acc: (kind, bal) for _, acc, kind, bal in rows}
+        self.rowid = max((r[0] for r in rows), default=0)
+        self.version = version
+
+    def _newer(self, version: Tuple[int, int]) -> bool:
+        return version != self.version and version[0] >= self.version[0] and version[1] >= self.version[1]
+
+    def bump(self, cur):
+        # inside a write that rewrites balances without adding ledger rows
+        cur.execute("UPDATE balance_version SET version = version + 1 WHERE id = 1")
+        bumped = cur.execute("SELECT version FROM balance_version WHERE id = 1").fetchone()[0]
+        POOL.on_commit(lambda: self._set_version((CHAIN.seq, bumped)))
+
+    # -- write side: only inside a POOL.write() block --
+    def peek(self, acc: str) -> Optional[Tuple[str, int]]:
+        hit = self._committed.get(acc)
+        return (hit[0], hit[1] + self._pending.get(acc, 0)) if hit else None
+
+    def open_accounts(self, accounts: List[Tuple[str, str]]):
+        POOL.on_commit(lambda: self._open(accounts))
+
+    def stage(self, deltas: Dict[str, int]):
+        for acc, d in deltas.items():
+            self._pending[acc] = self._pending.get(acc, 0) + d
+        POOL.on_rollback(lambda: self._unstage(deltas))
+        POOL.on_commit(self._commit)
+
+    def _unstage(self, deltas: Dict[str, int]):
+        for acc, d in deltas.items():
+            self._pending[acc] -= d
+
+    def overwrite(self, balances: Dict[str, int]):
+        POOL.on_commit(lambda: self._overwrite(balances))
+
+    def _set_version(self, version: Tuple[int, int]):
+        with self._lock:
+            if self._newer(version):
+                self.version = version
+
+    def _overwrite(self, balances):
+        with self._lock:
+            for acc, b in balances.items():
+                hit = self._committed.get(acc)
+                if hit:
+                    self._committed[acc] = (hit[0], b)
+
+    def _open(self, accounts):
+        with self._lock:
+            for acc, kind in accounts:
+                self._committed.setdefault(acc, (kind, 0))
+
+    def _commit(self):
+        if not self._pending:
+            return
+        with self._lock:
+            # a read-path reload after our COMMIT already holds these deltas
+            if self.version[0] < CHAIN.seq:
+                for acc, d in self._pending.items():
+                    hit = self._committed.get(acc)
+                    if hit and d:
+                        self._committed[acc] = (hit[0], hit[1] + d)
+                self.version = (CHAIN.seq, self.version[1])
+            self._pending = {}
+
+    # -- read side --
+    def get_many(self, ids: List[str]) -> Dict[str, int]:
+        with self._lock:
+            out = {i: self._committed[i][1] for i in ids if i in self._committed}
+            self.hits += len(out)
+            self.misses += len(ids) - len(out)
+        return out
+
+    def snapshot(self) -> Dict[str, Tuple[str, int]]:
+        with self._lock:
+            return dict(self._committed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"accounts": len(self._committed), "seq": self.version[0], "hits": self.hits,
+                    "misses": self.misses, "reloads": self.reloads, "catch_ups": self.catch_ups}
+
+BALANCES = BalanceCache()
+POOL.on_external_change(BALANCES.catch_up)
+
+def read_balances(ids: List[str]) -> Dict[str, int]:
+    # Served from BALANCES after a version probe; ids it does not know (e.g. an account another
+    # process opened with no ledger rows yet) fall back to one query.
+    BALANCES.sync()
+    out = BALANCES.get_many(ids)
+    missing = [i for i in ids if i not in out]
+    if missing:
+        with POOL.read() as cur:
+            for i in range(0, len(missing), 500):
+                chunk = missing[i:i+500]
+                out.update(cur.execute(f"SELECT id, balance FROM accounts WHERE id IN ({','.join('?'*len(chunk))})",
+                                       chunk).fetchall())
+    return out
+
+# ---------- Auth ----------
+class TokenCache:
+    # Bounded LRU of verified token payloads keyed by sha256(token). An entry lives until the
+    # token's exp or AUTH_CACHE_TTL_S, whichever is sooner. Only successful verifications are
+    # cached, and the whole cache is dropped when JWT_SECRET changes.
+    def __init__(self, size: int = AUTH_CACHE_SIZE, ttl_s: float = AUTH_CACHE_TTL_S):
+        self.size = size
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = JWT_SECRET
+        self.hits = self.misses = self.expired = self.evictions = self.invalidations = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            if self._secret is not JWT_SECRET:
+                self._entries.clear()
+                self._secret = JWT_SECRET
+                self.invalidations += 1
+            hit = self._entries.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return hit[1]
+                del self._entries[key]
+                self.expired += 1
+            self.misses += 1
+        return None
+
+    def put(self, token: str, payload: dict):
+        if self.size <= 0:
+            return
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        until = time.time() + self.ttl_s
+        if isinstance(payload.get("exp"), (int, float)):
+            until = min(until, payload["exp"])
+        with self._lock:
+            if self._secret is not JWT_SECRET:
+                return  # verified against a secret that has since rotated
+            self._entries[key] = (until, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            looked = self.hits + self.misses
+            return {"entries": len(self._entries), "size": self.size, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / looked if looked else None, "expired": self.expired,
+                    "evictions": self.evictions, "invalidations": self.invalidations}
+
+TOKENS = TokenCache()
+
+def issue_token(identity: str, role: str, name: str) -> str:
+    now = int(time.time())
+    return jwt.encode({"sub": identity, "role": role, "name": name, "iat": now, "exp": now + JWT_TTL_S},
+                      JWT_SECRET, algorithm=JWT_ALG)
+
+def verify_token(token: str) -> dict:
+    payload = TOKENS.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        except Exception:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        TOKENS.put(token, payload)
+    return payload
 
 def require_auth(authorization: Optional[str], roles: Optional[List[str]]=None):
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-    token = authorization.split(" ",1)[1].strip()
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    payload = verify_token(authorization.split(" ",1)[1].strip())
     if roles and payload.get("role") not in roles:
         raise HTTPException(status_code=403, detail="Insufficient role")
     return payload
@@ -180,27 +1245,39 @@ def require_auth(authorization: Optional[str], roles: Optional[List[str]]=None):
 def _startup():
     init_db()
     seed_demo()
+    startup_balance_check()
+    LEDGER.start()
+    EXPIRY.resume()
+
+@app.on_event("shutdown")
+def _shutdown():
+    EXPIRY.stop()
+    LEDGER.stop()
+    ALERTS.stop()
+    QR.close()
+    POOL.close_all()
 
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+# One round trip, two primary-key probes; a users row wins over a merchant with the same id.
+SQL_LOGIN_IDENTITY = """
+    SELECT role, display_name FROM users WHERE id = ?
+    UNION ALL
+    SELECT 'merchant', display_name FROM merchants WHERE id = ?
+    LIMIT 1
+"""
+
 @app.post("/auth/login")
 def login(body: dict):
     identity = body.get("identity")
-    con = db(); cur = con.cursor()
-    role = None; display_name = None
-    r = cur.execute("SELECT id, role, display_name FROM users WHERE id = ?", (identity,)).fetchone()
-    if r:
-        role = r[1]; display_name = r[2]
-    else:
-        r2 = cur.execute("SELECT id, display_name FROM merchants WHERE id = ?", (identity,)).fetchone()
-        if r2: role = "merchant"; display_name = r2[1]
-    con.close()
-    if not role:
+    with POOL.read() as cur:
+        r = cur.execute(SQL_LOGIN_IDENTITY, (identity, identity)).fetchone()
+    if not r:
         raise HTTPException(status_code=404, detail="Unknown identity")
-    token = jwt.encode({"sub": identity, "role": role, "name": display_name}, JWT_SECRET, algorithm=JWT_ALG)
-    return {"token": token, "role": role, "name": display_name}
+    role, display_name = r
+    return {"token": issue_token(identity, role, display_name), "role": role, "name": display_name}
 
 @app.get("/me")
 def me(authorization: Optional[str] = Header(None)):
@@ -210,84 +1287,709 @@ def me(authorization: Optional[str] = Header(None)):
 @app.get("/balance/{account_id}")
 def get_balance(account_id: str, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=None)
-    con = db(); cur = con.cursor()
-    r = cur.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,)).fetchone()
-    con.close()
-    if not r: raise HTTPException(status_code=404, detail="Unknown account")
-    return {"account_id": account_id, "balance": r[0]}
+    bal = read_balances([account_id]).get(account_id)
+    if bal is None: raise HTTPException(status_code=404, detail="Unknown account")
+    return {"account_id": account_id, "balance": bal}
+
+BALANCES_MAX_IDS = 500
+
+@app.get("/balances")
+def get_balances(ids: str, authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=None)
+    wanted = list(dict.fromkeys(i for i in ids.split(",") if i))
+    if len(wanted) > BALANCES_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BALANCES_MAX_IDS} ids")
+    found = read_balances(wanted)
+    return {"balances": found, "unknown": [i for i in wanted if i not in found]}
+
+TX_FIELDS = ("id", "seq", "ts", "ttype", "user_id", "merchant_id", "amount", "prev_hash", "thash", "note")
+
+def tx_dict(row) -> dict:
+    return dict(zip(TX_FIELDS, row))
+
+def tx_history_query(user_id: Optional[str], merchant_id: Optional[str], ttype: Optional[str],
+                     since: Optional[str], until: Optional[str], cursor: Optional[int], order: str,
+                     limit: Optional[int]) -> Tuple[str, list]:
+    # Keyset pagination: seq is unique and monotonic, so "seq < cursor" (or > for ascending order)
+    # resumes exactly after the last row of the previous page with an index seek, at any depth.
+    # order is "asc" or "desc", checked by the caller (it is interpolated into the SQL).
+    where, params = [], []
+    for col, val in (("user_id", user_id), ("merchant_id", merchant_id), ("ttype", ttype)):
+        if val:
+            where.append(f"{col} = ?"); params.append(val)
+    if since:
+        where.append("ts >= ?"); params.append(since)
+    if until:
+        where.append("ts < ?"); params.append(until)
+    if cursor is not None:
+        where.append("seq < ?" if order == "desc" else "seq > ?"); params.append(cursor)
+    sql = f"SELECT {TX_COLUMNS} FROM transactions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY seq {order.upper()}"
+    if limit is not None:
+        sql += " LIMIT ?"; params.append(limit)
+    return sql, params
+
+def tx_history_rows(user_id: Optional[str], merchant_id: Optional[str], ttype: Optional[str], since: Optional[str],
+                    until: Optional[str], cursor: Optional[int], order: str, limit: Optional[int]):
+    # Archived seqs are all below live ones: descending reads the live table then the archive,
+    # ascending the other way round, each continuing the keyset from where the other stopped.
+    # (A day archived mid-request can be skipped by a filtered page; re-reading the page fixes it.)
+    live_cursor = cursor
+    if order == "asc":
+        n = 0
+        for r in itertools.islice(ARCHIVE.query(user_id, merchant_id, ttype, since, until, cursor, order), limit):
+            n += 1
+            yield r
+        if limit is not None and n >= limit:
+            return
+        limit = None if limit is None else limit - n
+        live_cursor = max(cursor or 0, ARCHIVE.head()[0])
+    sql, params = tx_history_query(user_id, merchant_id, ttype, since, until, live_cursor, order, limit)
+    last = None
+    with POOL.stream() as cur:
+        cur.execute(sql, params)
+        for batch in iter(lambda: cur.fetchmany(TX_STREAM_BATCH), []):
+            last = batch[-1][1]
+            yield from batch
+            if limit is not None:
+                limit -= len(batch)
+    if order == "desc" and (limit is None or limit > 0) and ARCHIVE.head()[0]:
+        arch_cursor = min(c for c in (cursor, last) if c is not None) if (cursor or last) else None
+        yield from itertools.islice(ARCHIVE.query(user_id, merchant_id, ttype, since, until, arch_cursor, order), limit)
+
+def tx_ndjson_lines(rows):
+    for batch in iter(lambda: list(itertools.islice(rows, TX_STREAM_BATCH)), []):
+        yield "".join(json.dumps(tx_dict(row)) + "\n" for row in batch)
 
 @app.get("/transactions")
-def list_txs(limit: int = 50, authorization: Optional[str] = Header(None)):
+def list_txs(limit: Optional[int] = None, cursor: Optional[int] = None, order: str = "desc",
+             user_id: Optional[str] = None, merchant_id: Optional[str] = None, ttype: Optional[str] = None,
+             since: Optional[str] = None, until: Optional[str] = None, format: str = "json",
+             authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=None)
-    con = db(); cur = con.cursor()
-    rows = cur.execute("""
-        SELECT id, ts, ttype, user_id, merchant_id, amount, prev_hash, thash, note
-        FROM transactions ORDER BY ts DESC, ROWID DESC LIMIT ?
-    """, (limit,)).fetchall()
-    data = []
-    for row in rows:
-        data.append({
-            "id": row[0], "ts": row[1], "ttype": row[2], "user_id": row[3], "merchant_id": row[4],
-            "amount": row[5], "prev_hash": row[6], "thash": row[7], "note": row[8]
-        })
-    con.close()
-    return {"transactions": data}
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if format == "ndjson":
+        # full export: no page size unless the caller asks for one
+        rows = tx_history_rows(user_id, merchant_id, ttype, since, until, cursor, order, limit)
+        return StreamingResponse(tx_ndjson_lines(rows), media_type="application/x-ndjson")
+    limit = max(1, min(limit or 50, TX_PAGE_MAX))
+    data = [tx_dict(row) for row in tx_history_rows(user_id, merchant_id, ttype, since, until, cursor, order, limit)]
+    next_cursor = data[-1]["seq"] if len(data) == limit else None
+    return {"transactions": data, "next_cursor": next_cursor}
+
+# ---------- Live events (SSE) ----------
+# /events streams ledger activity instead of the dashboard re-polling /transactions and balances.
+# record_tx_rows hands committed rows to HUB (only while someone is subscribed), which formats
+# each event once and fans it out to the subscribers allowed to see it: admins get everything
+# plus alerts, merchants and users get their own transactions and balance. Every subscriber has
+# a bounded queue on its event loop; one that falls EVENTS_QUEUE_MAX behind gets a `reset` event
+# and is dropped. tx events carry the ledger seq as their id, so a reconnect with Last-Event-ID
+# resumes from the ledger itself. Rows committed by other worker processes are picked up by
+# polling the chain head every EVENTS_POLL_MS while anyone is subscribed.
+def sse(event: str, data, event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+class Subscriber:
+    def __init__(self, role: str, account: Optional[str], loop):
+        self.role, self.account, self.loop = role, account, loop
+        self.queue: "asyncio.Queue" = asyncio.Queue()
+        self.overflowed = False
+
+    def deliver(self, events: List[Tuple[Optional[int], str]]):
+        # runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        if self.queue.qsize() + len(events) > EVENTS_QUEUE_MAX:
+            self.overflowed = True
+            self.queue.put_nowait((None, None))
+            return
+        for ev in events:
+            self.queue.put_nowait(ev)
+
+class EventHub:
+    def __init__(self, poll_ms: float = EVENTS_POLL_MS):
+        self.poll_s = poll_ms / 1000
+        self.seq = 0  # highest ledger seq published
+        self._admins: set = set()
+        self._by_account: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.published = self.dropped_subscribers = 0
+
+    @property
+    def active(self) -> bool:
+        return bool(self._admins or self._by_account)
+
+    def subscribe(self, role: str, account: Optional[str], head: int) -> Subscriber:
+        # head: committed ledger seq read by the caller off the event loop (committed_head_seq)
+        sub = Subscriber(role, account, asyncio.get_running_loop())
+        with self._lock:
+            if not self.active:
+                # nothing was tracked while nobody listened; start from the committed head
+                self.seq = max(self.seq, head)
+            if role == "admin":
+                self._admins.add(sub)
+            else:
+                self._by_account.setdefault(account, set()).add(sub)
+            if self._thread is None and self.poll_s > 0:
+                self._thread = threading.Thread(target=self._poll, name="event-poll", daemon=True)
+                self._thread.start()
+        return sub
+
+    @staticmethod
+    def committed_head_seq() -> int:
+        with POOL.read() as cur:
+            head = cur.execute(SQL_CHAIN_HEAD).fetchone()
+        return head[0] if head else ARCHIVE.head()[0]
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            self._admins.discard(sub)
+            subs = self._by_account.get(sub.account)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._by_account[sub.account]
+
+    def _fan_out(self, events: List[Tuple[Optional[int], str, Tuple[str, ...]]]):
+        # events: (id, text, accounts it concerns); called with self._lock held
+        per_sub: Dict[Subscriber, list] = {}
+        for eid, text, accounts in events:
+            for sub in self._admins:
+                per_sub.setdefault(sub, []).append((eid, text))
+            for acc in accounts:
+                for sub in self._by_account.get(acc, ()):
+                    per_sub.setdefault(sub, []).append((eid, text))
+        for sub, evs in per_sub.items():
+            try:
+                sub.loop.call_soon_threadsafe(sub.deliver, evs)
+            except RuntimeError:  # loop closed under us
+                self.dropped_subscribers += 1
+        self.published += len(events)
+
+    def _tx_events(self, rows: List[tuple], balances: Dict[str, int]) -> list:
+        events = [(r[1], sse("tx", tx_dict(r), r[1]), tuple(a for a in (r[4], r[5]) if a)) for r in rows]
+        seq = rows[-1][1]
+        events += [(None, sse("balance", {"account": acc, "balance": b, "seq": seq}), (acc,))
+                   for acc, b in balances.items()]
+        return events
+
+    def _catch_up(self, cur, upto: Optional[int] = None):
+        # rows after self.seq committed by another process; self._lock held
+        cur.execute(SQL_LEDGER_AFTER, (self.seq,))
+        for rows in iter(lambda: cur.fetchmany(TX_STREAM_BATCH), []):
+            if upto is not None:
+                rows = [r for r in rows if r[1] <= upto]
+                if not rows:
+                    break
+            accs = sorted(balance_deltas(rows))
+            balances = dict(cur.execute(f"SELECT id, balance FROM accounts WHERE id IN ({','.join('?' * len(accs))})",
+                                        accs).fetchall()) if accs else {}
+            self._fan_out(self._tx_events(rows, balances))
+            self.seq = rows[-1][1]
+
+    def publish_rows(self, rows: List[tuple]):
+        # on_commit hook of record_tx_rows; rows are consecutive and already in BALANCES
+        with self._lock:
+            if not self.active:
+                return
+            if rows[0][1] > self.seq + 1:
+                with POOL.read() as cur:
+                    self._catch_up(cur, rows[0][1] - 1)
+            rows = [r for r in rows if r[1] > self.seq]
+            if rows:
+                self._fan_out(self._tx_events(rows, BALANCES.get_many(sorted(balance_deltas(rows)))))
+                self.seq = rows[-1][1]
+
+    def publish_alerts(self, alerts: List[dict]):
+        with self._lock:
+            if self._admins:
+                self._fan_out([(None, sse("alert", a), ()) for a in alerts])
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_s)
+            try:
+                with POOL.read() as cur:
+                    head = cur.execute(SQL_CHAIN_HEAD).fetchone()
+                    if head and head[0] > self.seq:
+                        with self._lock:
+                            if self.active:
+                                self._catch_up(cur)
+            except Exception:
+                logging.getLogger("boro.events").exception("event poll failed")
+
+    def stats(self) -> dict:
+        with self._lock:
+            subs = len(self._admins) + sum(len(v) for v in self._by_account.values())
+        return {"subscribers": subs, "seq": self.seq, "published": self.published,
+                "dropped_subscribers": self.dropped_subscribers}
+
+HUB = EventHub()
+
+def resume_events(sub: Subscriber, after_seq: int) -> Tuple[List[Tuple[int, str]], bool]:
+    # this subscriber's tx events after after_seq, from the ledger; False if more than EVENTS_RESUME_MAX
+    uid = sub.account if sub.role == "user" else None
+    mid = sub.account if sub.role == "merchant" else None
+    rows = list(tx_history_rows(uid, mid, None, None, None, after_seq, "asc", EVENTS_RESUME_MAX + 1))
+    return [(r[1], sse("tx", tx_dict(r), r[1])) for r in rows[:EVENTS_RESUME_MAX]], len(rows) <= EVENTS_RESUME_MAX
+
+async def event_stream(sub: Subscriber, payload: dict, last_id: Optional[int]):
+    sent = last_id or 0
+    try:
+        yield "retry: 3000\n\n"
+        if last_id is not None:
+            events, complete = await run_in_threadpool(resume_events, sub, last_id)
+            if not complete:
+                yield sse("reset", {"reason": "too far behind; reload history and reconnect"})
+                return
+            for eid, text in events:
+                sent = eid
+                yield text
+        if sub.account:
+            bal = await run_in_threadpool(read_balances, [sub.account])
+            if sub.account in bal:
+                yield sse("balance", {"account": sub.account, "balance": bal[sub.account], "seq": HUB.seq})
+        while True:
+            try:
+                eid, text = await asyncio.wait_for(sub.queue.get(), EVENTS_PING_S)
+            except asyncio.TimeoutError:
+                if payload.get("exp") and payload["exp"] < time.time():
+                    yield sse("reset", {"reason": "token expired"})
+                    return
+                yield ": ping\n\n"
+                continue
+            if text is None:
+                yield sse("reset", {"reason": "subscriber queue overflow; reconnect with Last-Event-ID"})
+                return
+            if eid is not None:
+                if eid <= sent:
+                    continue  # already sent during resume
+                sent = eid
+            yield text
+    finally:
+        HUB.unsubscribe(sub)
+
+@app.get("/events")
+async def events(token: Optional[str] = None, last_event_id: Optional[int] = None,
+                 authorization: Optional[str] = Header(None), last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    # EventSource cannot set headers, so the JWT may also come as ?token=. A browser reconnect
+    # sends Last-Event-ID; ?last_event_id= lets a fresh connection start after a loaded page.
+    payload = require_auth(authorization or (f"Bearer {token}" if token else None), roles=None)
+    if last_event_id_header:
+        last_event_id = parse_int(last_event_id_header, "Last-Event-ID")
+    role = payload.get("role")
+    head = await run_in_threadpool(HUB.committed_head_seq)
+    sub = HUB.subscribe(role, None if role == "admin" else payload.get("sub"), head)
+    return StreamingResponse(event_stream(sub, payload, last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ---------- Config cache ----------
+# Merchant limits and settings only change through the admin endpoints, which bump
+# config_version in the same transaction. Each process keeps a copy tagged with the version it
+# was read at. The write path re-reads the version only after another process has committed
+# (on_external_change); read paths re-check it with one primary-key probe (sync).
+DEFAULT_LIMITS = {"rate": 60, "earn_cap": 100000, "redeem_cap": 100000}
+SETTING_TYPES = {"expiry_days": int}  # settings parsed on write and read; others stay strings
+SQL_CONFIG_VERSION = "SELECT version FROM config_version WHERE id = 1"
+SQL_MERCHANT_LIMITS = "SELECT rate_limit_per_minute, daily_earn_cap, daily_redeem_cap FROM merchants WHERE id = ?"
+
+def parse_int(value, name: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer")
+
+class ConfigCache:
+    def __init__(self):
+        self.version: Optional[int] = None
+        self._limits: Dict[str, Dict[str, int]] = {}
+        self._settings: Optional[Dict[str, object]] = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.reloads = 0
+
+    def sync(self, cur):
+        v = cur.execute(SQL_CONFIG_VERSION).fetchone()[0]
+        if v != self.version:
+            with self._lock:
+                self.version, self._limits, self._settings = v, {}, None
+                self.reloads += 1
+
+    def bump(self, cur):
+        # inside the admin write that changed merchants or settings; every process drops its copy
+        cur.execute("UPDATE config_version SET version = version + 1 WHERE id = 1")
+        POOL.on_commit(self.invalidate)
+
+    def invalidate(self):
+        with self._lock:
+            self.version, self._limits, self._settings = None, {}, None
+
+    def merchant_limits(self, cur, merchant_id: str) -> Dict[str, int]:
+        if self.version is None:
+            self.sync(cur)
+        lim = self._limits.get(merchant_id)
+        if lim is not None:
+            self.hits += 1
+            return lim
+        self.misses += 1
+        version = self.version
+        r = cur.execute(SQL_MERCHANT_LIMITS, (merchant_id,)).fetchone()
+        if not r:
+            return DEFAULT_LIMITS  # not cached, so a merchant created later picks up its own row
+        lim = {"rate": r[0] or DEFAULT_LIMITS["rate"], "earn_cap": r[1] or DEFAULT_LIMITS["earn_cap"],
+               "redeem_cap": r[2] or DEFAULT_LIMITS["redeem_cap"]}
+        with self._lock:
+            if self.version == version:
+                self._limits[merchant_id] = lim
+        return lim
+
+    def settings(self, cur) -> Dict[str, object]:
+        if self.version is None:
+            self.sync(cur)
+        s = self._settings
+        if s is None:
+            version = self.version
+            s = {}
+            for k, v in cur.execute("SELECT key, value FROM settings").fetchall():
+                try:
+                    s[k] = SETTING_TYPES[k](v) if k in SETTING_TYPES else v
+                except ValueError:
+                    s[k] = v  # stored before it was validated; setting_int falls back to its default
+            with self._lock:
+                if self.version == version:
+                    self._settings = s
+        return s
+
+    def setting_int(self, cur, key: str, default: int = 0) -> int:
+        v = self.settings(cur).get(key, default)
+        return v if isinstance(v, int) else default
+
+    def stats(self) -> dict:
+        return {"version": self.version, "merchants": len(self._limits), "hits": self.hits,
+                "misses": self.misses, "reloads": self.reloads}
+
+CONFIG = ConfigCache()
+POOL.on_external_change(CONFIG.sync)
 
 # ---------- Limits & simple fraud ----------
 def merchant_limits(cur, merchant_id: str) -> Dict[str,int]:
-    r = cur.execute("""
-        SELECT rate_limit_per_minute, daily_earn_cap, daily_redeem_cap FROM merchants WHERE id=?
-    """, (merchant_id,)).fetchone()
-    if not r:
-        return {"rate": 60, "earn_cap": 100000, "redeem_cap": 100000}
-    return {"rate": r[0] or 60, "earn_cap": r[1] or 100000, "redeem_cap": r[2] or 100000}
+    return CONFIG.merchant_limits(cur, merchant_id)
+
+# ---------- In-memory policy counters ----------
+# Replace the per-write COUNT/SUM queries behind check_rate, check_daily_cap and fraud_checks.
+# Counts are kept per exact timestamp so decisions match the SQL ("ts >= since", "DATE(ts) = today")
+# row for row; backend/tests/test_limiter.py replays random traffic through both to prove it.
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICRO = datetime.timedelta(microseconds=1)
+WINDOW_SLOTS = 62  # one-second buckets; the 60s window since (now - 60s) touches at most 62 seconds
+
+def dt_micros(d: datetime.datetime) -> int:
+    return (d - _EPOCH) // _MICRO
+
+def ts_micros(ts: str) -> int:
+    return dt_micros(datetime.datetime.fromisoformat(ts))
+
+class SlidingWindow:
+    # Ring buffer of per-second buckets. Each bucket keeps its event timestamps (µs, sorted) so
+    # the partially covered oldest second is counted exactly rather than approximated.
+    __slots__ = ("secs", "stamps", "newest")
+
+    def __init__(self):
+        self.secs = [None] * WINDOW_SLOTS
+        self.stamps = [None] * WINDOW_SLOTS
+        self.newest = 0
+
+    def add(self, us: int):
+        sec = us // 1_000_000
+        i = sec % WINDOW_SLOTS
+        if self.secs[i] != sec:
+            if self.secs[i] is not None and self.secs[i] > sec:
+                return  # older than anything the window can still be asked about
+            self.secs[i], self.stamps[i] = sec, [us]
+        else:
+            bisect.insort(self.stamps[i], us)
+        self.newest = max(self.newest, sec)
+
+    def remove(self, us: int):
+        sec = us // 1_000_000
+        i = sec % WINDOW_SLOTS
+        if self.secs[i] == sec and us in self.stamps[i]:
+            self.stamps[i].remove(us)
+
+    def count_since(self, since_us: int) -> int:
+        since_sec = since_us // 1_000_000
+        total = 0
+        for sec, stamps in zip(self.secs, self.stamps):
+            if sec is None or sec < since_sec:
+                continue
+            total += len(stamps) - (bisect.bisect_left(stamps, since_us) if sec == since_sec else 0)
+        return total
+
+class PolicyLimiter:
+    # Per-merchant rate windows, per-merchant daily EARN/REDEEM totals (rolling over at UTC midnight)
+    # and per-(user, merchant) REDEEM windows. Mutated only under the write lock; every change made
+    # inside a write transaction is undone if that transaction (or savepoint) rolls back. Rebuilt
+    # from SQL once at startup; rows committed by another process are applied by catch_up.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._rate: Dict[str, SlidingWindow] = {}
+        self._daily: Dict[Tuple[str,str], List] = {}  # (merchant, ttype) -> [ymd, total]
+        self._redeems: Dict[Tuple[str,str], SlidingWindow] = {}
+        self._recorded = 0
+        self.seq = 0  # last ledger seq reflected in the counters
+
+    def rate_count(self, mid: str, since_us: int) -> int:
+        w = self._rate.get(mid)
+        return w.count_since(since_us) if w else 0
+
+    def redeem_count(self, uid: str, mid: str, since_us: int) -> int:
+        w = self._redeems.get((uid, mid))
+        return w.count_since(since_us) if w else 0
+
+    def day_total(self, mid: str, ttype: str, ymd: str) -> int:
+        d = self._daily.get((mid, ttype))
+        return d[1] if d and d[0] == ymd else 0
+
+    def _apply(self, us: int, ymd: str, ttype: str, uid: Optional[str], mid: str, amount: int, sign: int):
+        if sign > 0:
+            self._rate.setdefault(mid, SlidingWindow()).add(us)
+        elif mid in self._rate:
+            self._rate[mid].remove(us)
+        if ttype in CAP_RULES:
+            d = self._daily.get((mid, ttype))
+            if d is None or ymd > d[0]:
+                d = self._daily[(mid, ttype)] = [ymd, 0]
+            if d[0] == ymd:
+                d[1] += sign * amount
+        if ttype == "REDEEM" and uid:
+            if sign > 0:
+                self._redeems.setdefault((uid, mid), SlidingWindow()).add(us)
+            elif (uid, mid) in self._redeems:
+                self._redeems[(uid, mid)].remove(us)
+
+    def _ingest(self, rows: List[tuple]) -> list:
+        applied = []
+        for r in rows:
+            ts, ttype, uid, mid, amount = r[2], r[3], r[4], r[5], r[6]
+            if not mid:
+                continue
+            item = (ts_micros(ts), ts[:10], ttype, uid, mid, amount)
+            self._apply(*item, sign=1)
+            applied.append(item)
+        if applied:
+            self._recorded += len(applied)
+            if self._recorded >= 4096:
+                self._recorded = 0
+                self._sweep(applied[-1][0] // 1_000_000)
+        self.seq = max(self.seq, rows[-1][1])
+        return applied
+
+    def record_rows(self, rows: List[tuple]):
+        seq = self.seq
+        applied = self._ingest(rows)
+        POOL.on_rollback(lambda: self._unrecord(applied, seq))
+
+    def _unrecord(self, applied: list, seq: int):
+        for item in reversed(applied):
+            self._apply(*item, sign=-1)
+        self.seq = seq
+
+    def catch_up(self, cur):
+        # on_external_change: apply only the rows another process committed since self.seq. They
+        # stay committed even if the write that noticed them rolls back, so no undo is staged.
+        cur.execute(SQL_LEDGER_AFTER, (self.seq,))
+        for rows in iter(lambda: cur.fetchmany(TX_STREAM_BATCH), []):
+            self._ingest(rows)
+
+    def stats(self) -> dict:
+        return {"rate_windows": len(self._rate), "daily_totals": len(self._daily), "redeem_windows": len(self._redeems)}
+
+    def _sweep(self, now_sec: int):
+        stale = [k for k, w in self._redeems.items() if w.newest < now_sec - WINDOW_SLOTS]
+        for k in stale:
+            del self._redeems[k]
+
+    def rebuild(self, cur, now: Optional[datetime.datetime] = None):
+        now = now or datetime.datetime.utcnow()
+        self.reset()
+        since = (now - datetime.timedelta(seconds=WINDOW_SLOTS)).isoformat()
+        for ts, ttype, uid, mid in cur.execute(SQL_LIMITER_RECENT, (since,)).fetchall():
+            us = ts_micros(ts)
+            self._rate.setdefault(mid, SlidingWindow()).add(us)
+            if ttype == "REDEEM" and uid:
+                self._redeems.setdefault((uid, mid), SlidingWindow()).add(us)
+        day_start, day_end = day_bounds(now.strftime("%Y-%m-%d"))
+        for mid, ttype, total in cur.execute(SQL_LIMITER_DAY, (day_start, day_end)).fetchall():
+            self._daily[(mid, ttype)] = [day_start, total]
+        self.seq = CHAIN.seq  # CHAIN is loaded first in the same write
+
+SQL_LIMITER_RECENT = """
+    SELECT ts, ttype, user_id, merchant_id FROM transactions
+    WHERE ts >= ? AND merchant_id IS NOT NULL
+"""
+SQL_LIMITER_DAY = """
+    SELECT merchant_id, ttype, SUM(amount) FROM transactions
+    WHERE ts >= ? AND ts < ? AND merchant_id IS NOT NULL AND ttype IN ('EARN','REDEEM')
+    GROUP BY merchant_id, ttype
+"""
+
+LIMITER = PolicyLimiter()
+POOL.on_external_change(LIMITER.catch_up)
+
+class AlertSink:
+    # Alerts are queued in memory and written by a background thread every ALERT_FLUSH_MS, so a
+    # rejected request costs a dict update instead of an INSERT in the ledger transaction (and
+    # the alert survives that transaction's rollback). Occurrences of the same (type, merchant,
+    # user) within ALERT_DEDUP_WINDOW_S of the first one share one row: later flushes bump its
+    # count and last_ts. Beyond ALERT_MAX_PENDING distinct keys, new keys are dropped and counted.
+    def __init__(self, flush_ms: float = ALERT_FLUSH_MS, window_s: float = ALERT_DEDUP_WINDOW_S,
+                 max_pending: int = ALERT_MAX_PENDING):
+        self.flush_s = flush_ms / 1000
+        self.window_s = window_s
+        self.max_pending = max_pending
+        self._pending: Dict[tuple, list] = {}  # key -> [first ts, last ts, count, detail]
+        self._rows: Dict[tuple, Tuple[int, float]] = {}  # key -> (alerts.id, window end) of flushed windows
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.queued = self.collapsed = self.dropped = self.inserted = self.updated = self.flushes = 0
+
+    def add(self, atype: str, merchant_id: Optional[str], user_id: Optional[str], detail: str):
+        key = (atype, merchant_id, user_id)
+        ts = datetime.datetime.utcnow().isoformat()
+        with self._lock:
+            p = self._pending.get(key)
+            if p is not None:
+                p[1], p[3] = ts, detail
+                p[2] += 1
+                self.collapsed += 1
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            else:
+                self._pending[key] = [ts, ts, 1, detail]
+            self.queued += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="alert-sink", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger("boro.alerts").exception("alert flush failed")
+
+    def flush(self) -> int:
+        # Never call from inside a POOL.write() block: it takes the write lock itself.
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            now = time.time()
+            rows = {k: v for k, v in self._rows.items() if v[1] > now}
+            opened, inserted, updated = {}, 0, 0
+            try:
+                with POOL.write() as cur:
+                    for key, (first, last, n, detail) in batch.items():
+                        row = rows.get(key)
+                        if row:
+                            cur.execute("UPDATE alerts SET count = count + ?, last_ts = ?, detail = ? WHERE id = ?",
+                                        (n, last, detail, row[0]))
+                            updated += 1
+                        else:
+                            cur.execute("""INSERT INTO alerts(ts, atype, merchant_id, user_id, detail, count, last_ts)
+                                           VALUES(?,?,?,?,?,?,?)""", (first, *key, detail, n, last))
+                            opened[key] = (cur.lastrowid, now + self.window_s)
+                            inserted += 1
+                    # live feed: occurrences in this flush only, not the row's running count
+                    published = [{"ts": first, "type": key[0], "merchant_id": key[1], "user_id": key[2],
+                                  "detail": detail, "count": n, "last_ts": last}
+                                 for key, (first, last, n, detail) in batch.items()]
+                    POOL.on_commit(lambda: HUB.publish_alerts(published))
+            except Exception:
+                with self._lock:  # put the batch back so the next flush retries it
+                    for key, p in batch.items():
+                        q = self._pending.get(key)
+                        self._pending[key] = p if q is None else [p[0], q[1], p[2] + q[2], q[3]]
+                raise
+            rows.update(opened)
+            self._rows = rows
+            self.inserted += inserted
+            self.updated += updated
+            self.flushes += 1
+            return len(batch)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "queued": self.queued, "collapsed": self.collapsed, "dropped": self.dropped,
+                "inserted": self.inserted, "updated": self.updated, "flushes": self.flushes}
+
+ALERTS = AlertSink()
+
+def raise_alert(atype: str, merchant_id: Optional[str], detail: str, user_id: Optional[str] = None):
+    METRICS.inc("boro_alerts_total", (("type", atype),))
+    ALERTS.add(atype, merchant_id, user_id, detail)
+
+# ttype -> (limits key, alert type, error detail)
+CAP_RULES = {
+    "REDEEM": ("redeem_cap", "REDEEM_CAP", "Daily redeem cap exceeded"),
+    "EARN": ("earn_cap", "EARN_CAP", "Daily earn cap exceeded"),
+}
+
+def check_rate(mid: str, lim: Dict[str,int]):
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
+    if LIMITER.rate_count(mid, dt_micros(since)) >= lim["rate"]:
+        raise_alert("RATE_LIMIT", mid, f">= {lim['rate']} tx/min")
+        METRICS.inc("boro_rate_limited_total", (("reason", "RATE_LIMIT"),))
+        raise HTTPException(status_code=429, detail="Rate limit exceeded for merchant")
+
+def merchant_day_total(mid: str, ttype: str) -> int:
+    return LIMITER.day_total(mid, ttype, datetime.datetime.utcnow().strftime("%Y-%m-%d"))
+
+def check_daily_cap(mid: str, ttype: str, amount: int, lim: Dict[str,int]):
+    if ttype not in CAP_RULES:
+        return
+    cap_key, atype, detail = CAP_RULES[ttype]
+    s = merchant_day_total(mid, ttype)
+    if s + amount > lim[cap_key]:
+        raise_alert(atype, mid, f"cap {lim[cap_key]}")
+        METRICS.inc("boro_rate_limited_total", (("reason", atype),))
+        raise HTTPException(status_code=429, detail=detail)
 
 def check_rate_and_caps(cur, mid: Optional[str], ttype: str, amount: int):
     if not mid:
         return
     lim = merchant_limits(cur, mid)
-    # per-minute rate
-    since = (datetime.datetime.utcnow() - datetime.timedelta(seconds=60)).isoformat()
-    cnt = cur.execute("""
-        SELECT COUNT(*) FROM transactions
-        WHERE merchant_id = ? AND ts >= ?
-    """, (mid, since)).fetchone()[0]
-    if cnt >= lim["rate"]:
-        cur.execute("INSERT INTO alerts(ts, atype, merchant_id, detail) VALUES(?,?,?,?)",
-                    (datetime.datetime.utcnow().isoformat(), "RATE_LIMIT", mid, f">= {lim['rate']} tx/min"))
-        raise HTTPException(status_code=429, detail="Rate limit exceeded for merchant")
-    # Daily caps
-    today = datetime.datetime.utcnow().strftime("%Y-%m-%d")
-    if ttype == "REDEEM":
-        s = cur.execute("""
-            SELECT COALESCE(SUM(amount),0) FROM transactions
-            WHERE merchant_id=? AND ttype='REDEEM' AND DATE(ts)=?
-        """, (mid, today)).fetchone()[0]
-        if s + amount > lim["redeem_cap"]:
-            cur.execute("INSERT INTO alerts(ts, atype, merchant_id, detail) VALUES(?,?,?,?)",
-                        (datetime.datetime.utcnow().isoformat(), "REDEEM_CAP", mid, f"cap {lim['redeem_cap']}"))
-            raise HTTPException(status_code=429, detail="Daily redeem cap exceeded")
-    if ttype == "EARN":
-        s = cur.execute("""
-            SELECT COALESCE(SUM(amount),0) FROM transactions
-            WHERE merchant_id=? AND ttype='EARN' AND DATE(ts)=?
-        """, (mid, today)).fetchone()[0]
-        if s + amount > lim["earn_cap"]:
-            cur.execute("INSERT INTO alerts(ts, atype, merchant_id, detail) VALUES(?,?,?,?)",
-                        (datetime.datetime.utcnow().isoformat(), "EARN_CAP", mid, f"cap {lim['earn_cap']}"))
-            raise HTTPException(status_code=429, detail="Daily earn cap exceeded")
-
-def fraud_checks(cur, ttype: str, user_id: Optional[str], merchant_id: Optional[str]):
+    check_rate(mid, lim)
+    check_daily_cap(mid, ttype, amount, lim)
+
+def fraud_checks(ttype: str, user_id: Optional[str], merchant_id: Optional[str]):
     if ttype != "REDEEM" or not user_id or not merchant_id:
         return
-    since = (datetime.datetime.utcnow() - datetime.timedelta(seconds=60)).isoformat()
-    cnt = cur.execute("""
-        SELECT COUNT(*) FROM transactions
-        WHERE ttype='REDEEM' AND user_id=? AND merchant_id=? AND ts >= ?
-    """, (user_id, merchant_id, since)).fetchone()[0]
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
+    cnt = LIMITER.redeem_count(user_id, merchant_id, dt_micros(since))
     if cnt >= 5:
-        cur.execute("INSERT INTO alerts(ts, atype, merchant_id, user_id, detail) VALUES(?,?,?,?,?)",
-                    (datetime.datetime.utcnow().isoformat(), "RAPID_REDEEMS", merchant_id, user_id, f"{cnt} in 60s"))
+        raise_alert("RAPID_REDEEMS", merchant_id, f"{cnt} in 60s", user_id=user_id)
 
 # ---------- Core tx apply ----------
 def apply_tx(cur, ttype: Literal["EARN","REDEEM","ISSUE","ADJUST","EXPIRE"], user_id: Optional[str],
@@ -295,51 +1997,301 @@ def apply_tx(cur, ttype: Literal["EARN","REDEEM","ISSUE","ADJUST","EXPIRE"], use
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
 
-    # verify accounts exist
-    if user_id:
-        r = cur.execute("SELECT balance FROM accounts WHERE id=? AND kind='user'", (user_id,)).fetchone()
-        if not r: raise HTTPException(status_code=404, detail="Unknown user account")
+    t0 = time.perf_counter()
+    # verify accounts exist (in-transaction view from BALANCES, no queries)
+    user = BALANCES.peek(user_id) if user_id else None
+    if user_id and (user is None or user[0] != "user"):
+        raise HTTPException(status_code=404, detail="Unknown user account")
     if merchant_id:
-        r = cur.execute("SELECT balance FROM accounts WHERE id=? AND kind='merchant'", (merchant_id,)).fetchone()
-        if not r: raise HTTPException(status_code=404, detail="Unknown merchant account")
+        m = BALANCES.peek(merchant_id)
+        if m is None or m[0] != "merchant":
+            raise HTTPException(status_code=404, detail="Unknown merchant account")
+    t1 = time.perf_counter()
 
     check_rate_and_caps(cur, merchant_id, ttype, amount)
+    t2 = time.perf_counter()
 
-    ts = datetime.datetime.utcnow().isoformat()
-    prev = get_last_tx_hash(cur)
-    payload = {"ts": ts, "ttype": ttype, "user_id": user_id, "merchant_id": merchant_id, "amount": amount, "note": note}
-    th = hash_tx(payload, prev)
-    tid = th[:16]
-
-    if ttype == "EARN":
-        cur.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (amount, user_id))
-    elif ttype == "REDEEM":
-        bal = cur.execute("SELECT balance FROM accounts WHERE id=?", (user_id,)).fetchone()[0]
-        if bal < amount:
+    if ttype in ("REDEEM", "EXPIRE"):
+        bal = user[1]
+        if ttype == "REDEEM" and bal < amount:
             raise HTTPException(status_code=400, detail="Insufficient user balance")
-        cur.execute("UPDATE accounts SET balance = balance - ? WHERE id = ?", (amount, user_id))
-        cur.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (amount, merchant_id))
-    elif ttype == "ISSUE":
-        cur.execute("UPDATE accounts SET balance = balance + ? WHERE id = ?", (amount, user_id))
-    elif ttype == "EXPIRE":
-        bal = cur.execute("SELECT balance FROM accounts WHERE id=?", (user_id,)).fetchone()[0]
-        if bal < amount:
-            amount = bal
-        if amount > 0:
-            cur.execute("UPDATE accounts SET balance = balance - ? WHERE id = ?", (amount, user_id))
+        if ttype == "EXPIRE" and bal < amount:
+            amount = bal  # clip before hashing so the stored amount is the hashed amount
+
+    row = make_tx_row(CHAIN.seq + 1, datetime.datetime.utcnow().isoformat(), ttype, user_id, merchant_id, amount, note, CHAIN.thash)
+    if ttype == "EXPIRE" and amount <= 0:
+        return {"id": row[0], "hash": row[8], "note": "no-op"}
+    t3 = time.perf_counter()
+    record_tx_rows(cur, [row])
+    t4 = time.perf_counter()
+
+    fraud_checks(ttype, user_id, merchant_id)
+    t5 = time.perf_counter()
+    METRICS.observe_many("boro_apply_tx_phase_seconds", [
+        ((("phase", "accounts"),), t1 - t0), ((("phase", "rate_and_caps"),), t2 - t1), ((("phase", "hash"),), t3 - t2),
+        ((("phase", "write"),), t4 - t3), ((("phase", "fraud_checks"),), t5 - t4)])
+
+    return {"id": row[0], "hash": row[8]}
+
+TX_COLUMNS = ", ".join(TX_FIELDS)
+
+def make_tx_row(seq: int, ts: str, ttype: str, user_id: Optional[str], merchant_id: Optional[str],
+                amount: int, note: Optional[str], prev: Optional[str]) -> tuple:
+    # Row in TX_COLUMNS order; the hashed payload is unchanged from the original format.
+    th = tx_hash(ts, ttype, user_id, merchant_id, amount, note, prev)
+    return (th[:16], seq, ts, ttype, user_id, merchant_id, amount, prev, th, note)
+
+def balance_deltas(rows, deltas: Optional[Dict[str,int]] = None) -> Dict[str,int]:
+    # The balance effect of every ledger row type, used by the write path and by replay_balances.
+    # Only r[3:7] (ttype, user_id, merchant_id, amount) are read. Pass `deltas` to accumulate into it.
+    if deltas is None:
+        deltas = {}
+    get = deltas.get
+    for r in rows:
+        ttype, uid, mid, amount = r[3], r[4], r[5], r[6]
+        if ttype == "EARN" or ttype == "ISSUE":
+            if uid: deltas[uid] = get(uid, 0) + amount
+        elif ttype == "REDEEM":
+            if uid: deltas[uid] = get(uid, 0) - amount
+            if mid: deltas[mid] = get(mid, 0) + amount
+        elif ttype == "EXPIRE":
+            if uid: deltas[uid] = get(uid, 0) - amount
+    return deltas
+
+def record_tx_rows(cur, rows: List[tuple]):
+    # Single write path for ledger rows: insert, move balances, advance the chain head.
+    # Rows must be consecutive seqs chained off the current head.
+    cur.executemany(f"INSERT INTO transactions({TX_COLUMNS}) VALUES(?,?,?,?,?,?,?,?,?,?)", rows)
+    deltas = {acc: d for acc, d in balance_deltas(rows).items() if d}
+    cur.executemany("UPDATE accounts SET balance = balance + ? WHERE id = ?", [(d, acc) for acc, d in deltas.items()])
+    BALANCES.stage(deltas)
+    CHAIN.advance(rows[-1][1], rows[-1][8])
+    LIMITER.record_rows(rows)
+    MERKLE.append_rows(cur, rows)
+    apply_lots(cur, rows)
+    apply_rollups(cur, rows)
+    if SNAPSHOTS.due(rows[-1][1]):
+        POOL.on_commit(SNAPSHOTS.start)
+    if HUB.active:
+        POOL.on_commit(lambda: HUB.publish_rows(rows))
+
+def _batch_error(i: int, code: int, detail: str) -> dict:
+    return {"index": i, "status": "error", "code": code, "detail": detail}
+
+def apply_tx_batch(cur, ops: List[dict], merchant_id: Optional[str], scope: str) -> List[dict]:
+    # ops are parsed by parse_batch_op: {"ttype", "user_id", "amount", "note", "key"} or {"error": ...}.
+    # Everything is checked in one pass against running balances/cap totals, then written with
+    # executemany. Items with an idempotency key already recorded for this scope are not re-applied.
+    if merchant_id:
+        m = BALANCES.peek(merchant_id)
+        if m is None or m[0] != "merchant":
+            raise HTTPException(status_code=404, detail="Unknown merchant account")
+        lim = merchant_limits(cur, merchant_id)
+        check_rate(merchant_id, lim)
+        # every row lands in the same sliding window as a live /earn, so each op counts against
+        # the per-minute rate; items past it are rejected like a single request would be
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
+        rate_left = lim["rate"] - LIMITER.rate_count(merchant_id, dt_micros(since))
+        day_totals = {t: merchant_day_total(merchant_id, t) for t in CAP_RULES}
+    uids = sorted({op["user_id"] for op in ops if "error" not in op})
+    balances = {}
+    for uid in uids:
+        acct = BALANCES.peek(uid)
+        if acct and acct[0] == "user":
+            balances[uid] = acct[1]
+    keys = sorted({op["key"] for op in ops if op.get("key")})
+    done = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i+500]
+        for k, res in cur.execute(f"SELECT key, result FROM idempotency_keys WHERE scope=? AND key IN ({','.join('?'*len(chunk))})",
+                                  [scope] + chunk).fetchall():
+            done[k] = json.loads(res)
+
+    ts = datetime.datetime.utcnow().isoformat()
+    seq, prev = CHAIN.seq, CHAIN.thash
+    rows, keyed, results, alerted, redeemers = [], [], [], set(), set()
+    for i, op in enumerate(ops):
+        if "error" in op:
+            results.append(_batch_error(i, 400, op["error"])); continue
+        key = op.get("key")
+        if key and key in done:
+            results.append({"index": i, "status": "duplicate", "tx": done[key]}); continue
+        ttype, uid, amount = op["ttype"], op["user_id"], op["amount"]
+        if uid not in balances:
+            results.append(_batch_error(i, 404, "Unknown user account")); continue
+        if merchant_id and rate_left <= 0:
+            if "RATE_LIMIT" not in alerted:
+                raise_alert("RATE_LIMIT", merchant_id, f">= {lim['rate']} tx/min")
+                alerted.add("RATE_LIMIT")
+            METRICS.inc("boro_rate_limited_total", (("reason", "RATE_LIMIT"),))
+            results.append(_batch_error(i, 429, "Rate limit exceeded for merchant")); continue
+        if merchant_id and ttype in CAP_RULES:
+            cap_key, atype, detail = CAP_RULES[ttype]
+            if day_totals[ttype] + amount > lim[cap_key]:
+                if atype not in alerted:
+                    raise_alert(atype, merchant_id, f"cap {lim[cap_key]}")
+                    alerted.add(atype)
+                METRICS.inc("boro_rate_limited_total", (("reason", atype),))
+                results.append(_batch_error(i, 429, detail)); continue
+        if ttype == "REDEEM" and balances[uid] < amount:
+            results.append(_batch_error(i, 400, "Insufficient user balance")); continue
+        # accepted: only now does the item use up rate, cap and balance
+        if merchant_id:
+            rate_left -= 1
+            if ttype in CAP_RULES:
+                day_totals[ttype] += amount
+        if ttype == "REDEEM":
+            balances[uid] -= amount
+            redeemers.add(uid)
         else:
-            return {"id": tid, "hash": th, "note": "no-op"}
-    elif ttype == "ADJUST":
-        pass
+            balances[uid] += amount
+        seq += 1
+        row = make_tx_row(seq, ts, ttype, uid, merchant_id, amount, op.get("note"), prev)
+        prev = row[8]
+        rows.append(row)
+        tx = {"id": row[0], "hash": row[8]}
+        results.append({"index": i, "status": "ok", "tx": tx})
+        if key:
+            done[key] = tx
+            keyed.append((scope, key, tx["id"], json.dumps(tx), ts))
+    if rows:
+        record_tx_rows(cur, rows)
+        cur.executemany("INSERT INTO idempotency_keys(scope, key, tx_id, result, created_at) VALUES(?,?,?,?,?)", keyed)
+        for uid in sorted(redeemers):
+            fraud_checks("REDEEM", uid, merchant_id)
+    return results
 
-    cur.execute("""
-        INSERT INTO transactions(id, ts, ttype, user_id, merchant_id, amount, prev_hash, thash, note)
-        VALUES(?,?,?,?,?,?,?,?,?)
-    """, (tid, ts, ttype, user_id, merchant_id, amount, prev, th, note))
+def parse_batch_op(raw, allowed) -> dict:
+    if not isinstance(raw, dict):
+        return {"error": "Operation must be an object"}
+    ttype = str(raw.get("ttype") or raw.get("op") or "").upper()
+    if ttype not in allowed:
+        return {"error": f"Unsupported operation {ttype or '(missing)'}"}
+    try:
+        amount = int(raw.get("amount", 0))
+    except (TypeError, ValueError):
+        return {"error": "Amount must be an integer"}
+    if amount <= 0:
+        return {"error": "Amount must be positive"}
+    if not raw.get("user_id"):
+        return {"error": "Missing user_id"}
+    key = raw.get("idempotency_key")
+    return {"ttype": ttype, "user_id": str(raw["user_id"]), "amount": amount,
+            "note": raw.get("note"), "key": str(key) if key is not None else None}
+
+# ---------- Group-commit ledger writer ----------
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class LedgerWriter:
+    # Single writer thread: queued apply_tx calls are drained into batches of up to max_batch
+    # (waiting at most max_linger for stragglers), each applied in its own savepoint, and the
+    # whole batch is committed once. Callers' futures resolve only after that commit.
+    def __init__(self, max_batch: int = LEDGER_MAX_BATCH, max_linger_ms: float = LEDGER_MAX_LINGER_MS):
+        self.max_batch = max(1, max_batch)
+        self.max_linger_s = max(0.0, max_linger_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "txs": 0, "rejected": 0, "failed_batches": 0,
+                       "commit_s": 0.0, "commit_max_s": 0.0,
+                       "batch_size_hist": {str(b): 0 for b in BATCH_SIZE_BUCKETS + ("inf",)}}
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._start_lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, ttype: str, user_id: Optional[str], merchant_id: Optional[str],
+               amount: int, note: Optional[str]) -> concurrent.futures.Future:
+        self.start()
+        fut = concurrent.futures.Future()
+        self._queue.put((fut, (ttype, user_id, merchant_id, amount, note)))
+        return fut
+
+    def apply(self, ttype: str, user_id: Optional[str], merchant_id: Optional[str],
+              amount: int, note: Optional[str]) -> dict:
+        return self.submit(ttype, user_id, merchant_id, amount, note).result()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_linger_s
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._apply_batch(batch)
+            if stop:
+                return
+
+    def _apply_batch(self, batch):
+        outcomes = []
+        t0 = time.perf_counter()
+        try:
+            with POOL.write() as cur:
+                for fut, args in batch:
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with POOL.savepoint(cur):
+                            outcomes.append((fut, apply_tx(cur, *args), None))
+                    except Exception as e:
+                        outcomes.append((fut, None, e))
+        except Exception as e:
+            self._record(len(batch), 0, time.perf_counter() - t0, failed=True)
+            for fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self._record(len(batch), sum(1 for _, _, err in outcomes if err), time.perf_counter() - t0)
+        for fut, res, err in outcomes:
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+    def _record(self, size: int, rejected: int, elapsed: float, failed: bool = False):
+        bucket = next((str(b) for b in BATCH_SIZE_BUCKETS if size <= b), "inf")
+        with self._stats_lock:
+            st = self._stats
+            st["batches"] += 1
+            st["txs"] += size
+            st["rejected"] += rejected
+            st["failed_batches"] += 1 if failed else 0
+            st["commit_s"] += elapsed
+            st["commit_max_s"] = max(st["commit_max_s"], elapsed)
+            st["batch_size_hist"][bucket] += 1
 
-    fraud_checks(cur, ttype, user_id, merchant_id)
+    def stats(self) -> dict:
+        with self._stats_lock:
+            out = dict(self._stats, batch_size_hist=dict(self._stats["batch_size_hist"]))
+        n = out["batches"]
+        out["avg_batch_size"] = out["txs"] / n if n else 0.0
+        out["commit_avg_s"] = out["commit_s"] / n if n else 0.0
+        out["queue_depth"] = self._queue.qsize()
+        out["max_batch"] = self.max_batch
+        out["max_linger_ms"] = self.max_linger_s * 1000.0
+        return out
 
-    return {"id": tid, "hash": th}
+LEDGER = LedgerWriter()
 
 # ---------- Business endpoints ----------
 @app.post("/earn")
@@ -349,13 +2301,8 @@ def earn(body: dict, authorization: Optional[str] = Header(None)):
     amount = int(body.get("amount", 0))
     note = body.get("note")
     mid = auth.get("sub") if auth.get("role") == "merchant" else None
-    con = db(); cur = con.cursor()
-    try:
-        res = apply_tx(cur, "EARN", user_id=user_id, merchant_id=mid, amount=amount, note=note)
-        con.commit()
-        return {"status": "ok", "tx": res}
-    finally:
-        con.close()
+    res = LEDGER.apply("EARN", user_id=user_id, merchant_id=mid, amount=amount, note=note)
+    return {"status": "ok", "tx": res}
 
 @app.post("/redeem")
 def redeem(body: dict, authorization: Optional[str] = Header(None)):
@@ -364,13 +2311,56 @@ def redeem(body: dict, authorization: Optional[str] = Header(None)):
     amount = int(body.get("amount", 0))
     note = body.get("note")
     mid = auth.get("sub") if auth.get("role") == "merchant" else None
-    con = db(); cur = con.cursor()
-    try:
-        res = apply_tx(cur, "REDEEM", user_id=user_id, merchant_id=mid, amount=amount, note=note)
-        con.commit()
-        return {"status": "ok", "tx": res}
-    finally:
-        con.close()
+    res = LEDGER.apply("REDEEM", user_id=user_id, merchant_id=mid, amount=amount, note=note)
+    return {"status": "ok", "tx": res}
+
+async def read_batch_ops(request: Request) -> list:
+    # application/x-ndjson bodies are consumed as a stream, one operation per line;
+    # anything else is a JSON document: either a list of operations or {"ops": [...]}.
+    def too_many():
+        return HTTPException(status_code=413, detail=f"At most {TX_BATCH_MAX_OPS} operations per batch")
+    def parse_line(line: bytes):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None  # reported per item by parse_batch_op
+    if "ndjson" in request.headers.get("content-type", ""):
+        ops, buf = [], b""
+        async for chunk in request.stream():
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            ops.extend(parse_line(line) for line in lines if line.strip())
+            if len(ops) > TX_BATCH_MAX_OPS:
+                raise too_many()
+        if buf.strip():
+            ops.append(parse_line(buf))
+    else:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        ops = body.get("ops") if isinstance(body, dict) else body
+        if not isinstance(ops, list):
+            raise HTTPException(status_code=400, detail="Expected a list of operations")
+    if len(ops) > TX_BATCH_MAX_OPS:
+        raise too_many()
+    return ops
+
+@app.post("/tx/batch")
+async def tx_batch(request: Request, authorization: Optional[str] = Header(None)):
+    auth = require_auth(authorization, roles=["merchant","admin"])
+    mid = auth.get("sub") if auth.get("role") == "merchant" else None
+    allowed = ("EARN", "REDEEM") if mid else ("EARN", "REDEEM", "ISSUE")
+    ops = [parse_batch_op(raw, allowed) for raw in await read_batch_ops(request)]
+    def work():
+        with POOL.write() as cur:
+            return apply_tx_batch(cur, ops, mid, auth.get("sub"))
+    results = await run_in_threadpool(work)
+    counts = {"ok": 0, "duplicate": 0, "error": 0}
+    for r in results:
+        counts[r["status"]] += 1
+    return {"status": "ok", "applied": counts["ok"], "duplicates": counts["duplicate"],
+            "rejected": counts["error"], "results": results}
 
 @app.post("/admin/issue")
 def admin_issue(body: dict, authorization: Optional[str] = Header(None)):
@@ -378,13 +2368,8 @@ def admin_issue(body: dict, authorization: Optional[str] = Header(None)):
     user_id = body.get("user_id")
     amount = int(body.get("amount", 0))
     note = body.get("note")
-    con = db(); cur = con.cursor()
-    try:
-        res = apply_tx(cur, "ISSUE", user_id=user_id, merchant_id=None, amount=amount, note=note)
-        con.commit()
-        return {"status": "ok", "tx": res}
-    finally:
-        con.close()
+    res = LEDGER.apply("ISSUE", user_id=user_id, merchant_id=None, amount=amount, note=note)
+    return {"status": "ok", "tx": res}
 
 @app.get("/merchant/balance")
 def merchant_balance(authorization: Optional[str] = Header(None)):
@@ -392,37 +2377,323 @@ def merchant_balance(authorization: Optional[str] = Header(None)):
     mid = auth.get("sub") if auth.get("role") == "merchant" else None
     if not mid:
         raise HTTPException(status_code=400, detail="Merchant only")
-    con = db(); cur = con.cursor()
-    r = cur.execute("SELECT balance FROM accounts WHERE id=?", (mid,)).fetchone()
-    con.close()
-    if not r: raise HTTPException(status_code=404, detail="Unknown merchant account")
-    return {"merchant_id": mid, "balance": r[0]}
+    bal = read_balances([mid]).get(mid)
+    if bal is None: raise HTTPException(status_code=404, detail="Unknown merchant account")
+    return {"merchant_id": mid, "balance": bal}
+
+SQL_DAY_HASHES = """
+    SELECT id, thash FROM transactions
+    WHERE ts >= ? AND ts < ?
+    ORDER BY seq ASC
+"""
 
 @app.get("/anchor/daily")
 def anchor_daily(date: Optional[str] = None, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=["admin"])
-    ymd = date or datetime.datetime.utcnow().strftime("%Y-%m-%d")
-    con = db(); cur = con.cursor()
-    rows = cur.execute("""
-        SELECT thash FROM transactions
-        WHERE DATE(ts) = ?
-        ORDER BY ts ASC, ROWID ASC
-    """, (ymd,)).fetchall()
-    hashes = [r[0] for r in rows]
+    # keyed by the normalized day, so "20240301" and "2024-03-01" share one anchor row
+    ymd = day_bounds(date or datetime.datetime.utcnow().strftime("%Y-%m-%d"))[0]
+    with POOL.write() as cur:
+        acc = MERKLE.get(cur, ymd)
+        root = acc.root()
+        cur.execute("INSERT OR REPLACE INTO anchors(ymd, merkle_root, created_at) VALUES(?,?,?)",
+                    (ymd, root, datetime.datetime.utcnow().isoformat()))
+    return {"date": ymd, "merkle_root": root, "tx_count": acc.count}
+
+@app.get("/anchor/proof/{tx_id}")
+def anchor_proof(tx_id: str, authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=None)
+    with POOL.read() as cur:
+        r = cur.execute("SELECT ts, thash FROM transactions WHERE id=?", (tx_id,)).fetchone()
+        if r:
+            ymd = r[0][:10]
+            day_start, day_end = day_bounds(ymd)
+            rows = cur.execute(SQL_DAY_HASHES, (day_start, day_end)).fetchall()
+        else:
+            hit = ARCHIVE.find_id(tx_id)
+            if not hit: raise HTTPException(status_code=404, detail="Unknown transaction")
+            seg = hit[0]
+            ymd = seg.ymd
+            rows = [(row[0], row[8]) for row in seg.rows(range(seg.count))]
+            r = (None, rows[hit[1]][1])
+        anchored = cur.execute("SELECT merkle_root FROM anchors WHERE ymd=?", (ymd,)).fetchone()
+    ids = [row[0] for row in rows]
+    hashes = [row[1] for row in rows]
+    index = ids.index(tx_id)
+    path = merkle_proof(hashes, index)
     root = merkle_root(hashes)
-    cur.execute("INSERT OR REPLACE INTO anchors(ymd, merkle_root, created_at) VALUES(?,?,?)",
-                (ymd, root, datetime.datetime.utcnow().isoformat()))
-    con.commit(); con.close()
-    return {"date": ymd, "merkle_root": root, "tx_count": len(hashes)}
+    anchored_root = anchored[0] if anchored else None
+    return {"tx_id": tx_id, "date": ymd, "leaf": r[1], "index": index, "tx_count": len(hashes),
+            "path": path, "merkle_root": root, "anchored_root": anchored_root,
+            "verified": verify_merkle_proof(r[1], path, anchored_root or root)}
+
+# ---------- Archive segments ----------
+# Anchored days older than ARCHIVE_MIN_AGE_DAYS move out of `transactions` into one immutable
+# file per day. Only the oldest live day is ever archived, so archived seqs always form the
+# prefix 1..head and the live table holds everything after it. Segment layout:
+#   header   SEG_HEADER (magic, version, ymd, first/last seq, count, Merkle root, last thash,
+#            rows per block, index offset/length)
+#   blocks   zlib(JSON array of rows in TX_FIELDS order), ARCHIVE_BLOCK_ROWS rows each
+#   index    zlib(JSON {"blocks": [[offset, length]...], "id": {tx_id: n}, "user": {uid: [n...]},
+#            "merchant": {mid: [n...]}}) with n the row's position in the segment
+SEG_MAGIC = b"BOROSEG1"
+SEG_HEADER = struct.Struct("<8sH10sQQI32s32sIQQ")
+
+def archive_dir() -> str:
+    return ARCHIVE_DIR or os.path.splitext(DB_PATH)[0] + "-archive"
+
+def write_segment(path: str, ymd: str, rows: List[tuple], root: str, block_rows: int = ARCHIVE_BLOCK_ROWS) -> int:
+    idx = {"blocks": [], "id": {}, "user": {}, "merchant": {}}
+    for n, r in enumerate(rows):
+        idx["id"][r[0]] = n
+        if r[4]:
+            idx["user"].setdefault(r[4], []).append(n)
+        if r[5]:
+            idx["merchant"].setdefault(r[5], []).append(n)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * SEG_HEADER.size)
+        for i in range(0, len(rows), block_rows):
+            blob = zlib.compress(json.dumps(rows[i:i+block_rows], separators=(",", ":")).encode("utf-8"))
+            idx["blocks"].append([f.tell(), len(blob)])
+            f.write(blob)
+        index_offset = f.tell()
+        blob = zlib.compress(json.dumps(idx, separators=(",", ":")).encode("utf-8"))
+        f.write(blob)
+        f.seek(0)
+        f.write(SEG_HEADER.pack(SEG_MAGIC, 1, ymd.encode("ascii"), rows[0][1], rows[-1][1], len(rows),
+                                bytes.fromhex(root), bytes.fromhex(rows[-1][8]), block_rows, index_offset, len(blob)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+class Segment:
+    # Read side of one segment file, memory-mapped. The index and a few blocks are decompressed
+    # on demand; the mapping is released when the last reference goes away.
+    CACHED_BLOCKS = 4
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, _version, ymd, self.first_seq, self.last_seq, self.count, root, last,
+         self.block_rows, self._index_off, self._index_len) = SEG_HEADER.unpack_from(self._mm, 0)
+        if magic != SEG_MAGIC:
+            raise ValueError(f"{path} is not a ledger segment")
+        self.ymd, self.merkle_root, self.last_thash = ymd.decode("ascii"), root.hex(), last.hex()
+        self._index = None
+        self._blocks: "OrderedDict[int, List[tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index(self) -> dict:
+        if self._index is None:
+            self._index = json.loads(zlib.decompress(self._mm[self._index_off:self._index_off + self._index_len]))
+        return self._index
+
+    def _block(self, b: int) -> List[tuple]:
+        with self._lock:
+            rows = self._blocks.get(b)
+            if rows is not None:
+                self._blocks.move_to_end(b)
+                return rows
+        off, n = self.index()["blocks"][b]
+        rows = [tuple(r) for r in json.loads(zlib.decompress(self._mm[off:off + n]))]
+        with self._lock:
+            self._blocks[b] = rows
+            while len(self._blocks) > self.CACHED_BLOCKS:
+                self._blocks.popitem(last=False)
+        return rows
+
+    def row(self, n: int) -> tuple:
+        return self._block(n // self.block_rows)[n % self.block_rows]
+
+    def rows(self, positions):
+        return (self.row(n) for n in positions)
+
+class ArchiveStore:
+    # Which days are archived (mirrors archive_segments) plus an LRU of open segments.
+    OPEN_SEGMENTS = 32
+
+    def __init__(self):
+        self._meta: List[tuple] = []  # (first_seq, last_seq, ymd, file, last_thash), ascending
+        self._open: "OrderedDict[str, Segment]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, cur):
+        self._meta = cur.execute("SELECT first_seq, last_seq, ymd, file, last_thash FROM archive_segments ORDER BY first_seq").fetchall()
+
+    def _add(self, meta: tuple):
+        self._meta = self._meta + [meta]
+
+    def head(self) -> Tuple[int, Optional[str]]:
+        meta = self._meta
+        return (meta[-1][1], meta[-1][4]) if meta else (0, None)
+
+    def days(self) -> List[tuple]:
+        return list(self._meta)
+
+    def segment(self, meta: tuple) -> Segment:
+        with self._lock:
+            seg = self._open.get(meta[2])
+            if seg is not None:
+                self._open.move_to_end(meta[2])
+                return seg
+        seg = Segment(os.path.join(archive_dir(), meta[3]))
+        with self._lock:
+            self._open[meta[2]] = seg
+            while len(self._open) > self.OPEN_SEGMENTS:
+                self._open.popitem(last=False)
+        return seg
+
+    def iter_rows(self, after_seq: int = 0, before_seq: Optional[int] = None):
+        # Archived rows with after_seq < seq < before_seq, ascending.
+        for meta in self._meta:
+            if meta[1] <= after_seq or (before_seq is not None and meta[0] >= before_seq):
+                continue
+            seg = self.segment(meta)
+            lo = max(0, after_seq + 1 - seg.first_seq)
+            hi = seg.count if before_seq is None else min(seg.count, before_seq - seg.first_seq)
+            yield from seg.rows(range(lo, hi))
+
+    def get_seq(self, seq: int) -> Optional[tuple]:
+        for meta in self._meta:
+            if meta[0] <= seq <= meta[1]:
+                return self.segment(meta).row(seq - meta[0])
+        return None
+
+    def find_id(self, tx_id: str) -> Optional[Tuple[Segment, int]]:
+        for meta in reversed(self._meta):
+            seg = self.segment(meta)
+            n = seg.index()["id"].get(tx_id)
+            if n is not None:
+                return seg, n
+        return None
+
+    def query(self, user_id: Optional[str], merchant_id: Optional[str], ttype: Optional[str], since: Optional[str],
+              until: Optional[str], cursor: Optional[int], order: str):
+        # Same filters and keyset semantics as tx_history_query, over the archived days.
+        metas = self._meta if order == "asc" else list(reversed(self._meta))
+        for meta in metas:
+            if (since and meta[2] < since[:10]) or (until and meta[2] > until[:10]):
+                continue
+            if cursor is not None and (meta[0] >= cursor if order == "desc" else meta[1] <= cursor):
+                continue
+            seg = self.segment(meta)
+            if user_id or merchant_id:
+                idx = seg.index()
+                pos = None
+                for key, val in (("user", user_id), ("merchant", merchant_id)):
+                    if val:
+                        hits = idx[key].get(val, [])
+                        pos = hits if pos is None else sorted(set(pos) & set(hits))
+            else:
+                pos = range(seg.count)
+            if order == "desc":
+                pos = reversed(pos)
+            for r in seg.rows(pos):
+                if cursor is not None and (r[1] >= cursor if order == "desc" else r[1] <= cursor):
+                    continue
+                if (ttype and r[3] != ttype) or (since and r[2] < since) or (until and r[2] >= until):
+                    continue
+                yield r
+
+    def stats(self) -> dict:
+        with self._lock:
+            opened = len(self._open)
+        return {"days": len(self._meta), "archived_seq": self.head()[0], "open_segments": opened}
+
+ARCHIVE = ArchiveStore()
+POOL.on_external_change(ARCHIVE.load)
+
+SQL_OLDEST_LIVE = "SELECT seq, ts FROM transactions ORDER BY seq ASC LIMIT 1"
+SQL_LEDGER_AFTER = f"SELECT {TX_COLUMNS} FROM transactions WHERE seq > ? ORDER BY seq"
+
+def iter_ledger(cur, after_seq: int = 0):
+    # Every ledger row with seq > after_seq in TX_FIELDS order: archived segments, then the live
+    # table. If a day is archived between the two reads, the gap is filled from the archive.
+    last = after_seq
+    for r in ARCHIVE.iter_rows(after_seq):
+        last = r[1]
+        yield r
+    cur.execute(SQL_LEDGER_AFTER, (last,))
+    first = True
+    for rows in iter(lambda: cur.fetchmany(TX_STREAM_BATCH), []):
+        if first and rows[0][1] > last + 1:
+            with POOL.read() as rc:
+                ARCHIVE.load(rc)
+            yield from ARCHIVE.iter_rows(last, rows[0][1])
+        first = False
+        yield from rows
+
+def archive_days(max_days: Optional[int] = None, min_age_days: int = ARCHIVE_MIN_AGE_DAYS) -> dict:
+    # Moves the oldest live day into a segment while it is anchored (with a root matching its
+    # rows) and at least min_age_days old; repeats up to max_days times.
+    os.makedirs(archive_dir(), exist_ok=True)
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=min_age_days)).strftime("%Y-%m-%d")
+    archived, stopped = [], None
+    while max_days is None or len(archived) < max_days:
+        with POOL.read() as cur:
+            oldest = cur.execute(SQL_OLDEST_LIVE).fetchone()
+            if not oldest:
+                stopped = "no live transactions"; break
+            ymd = oldest[1][:10]
+            if ymd > cutoff:
+                stopped = f"{ymd} is newer than {min_age_days} days"; break
+            anchored = cur.execute("SELECT merkle_root FROM anchors WHERE ymd=?", (ymd,)).fetchone()
+            if not anchored:
+                stopped = f"{ymd} is not anchored"; break
+            rows = cur.execute(f"SELECT {TX_COLUMNS} FROM transactions WHERE ts >= ? AND ts < ? ORDER BY seq",
+                               day_bounds(ymd)).fetchall()
+        first, last = rows[0][1], rows[-1][1]
+        if first != oldest[0] or last - first + 1 != len(rows):
+            stopped = f"{ymd} does not cover a contiguous seq range"; break
+        if rows[0][7] != ARCHIVE.head()[1]:
+            stopped = f"{ymd} does not chain onto the archive head"; break
+        root = merkle_root([r[8] for r in rows])
+        if root != anchored[0]:
+            stopped = f"{ymd} anchor does not match its rows; re-run /anchor/daily"; break
+        fname = f"{ymd}.seg"
+        size = write_segment(os.path.join(archive_dir(), fname), ymd, rows, root)
+        meta = (first, last, ymd, fname, rows[-1][8])
+        with POOL.write() as cur:
+            cur.execute("""INSERT OR REPLACE INTO archive_segments(ymd, file, first_seq, last_seq, tx_count, merkle_root,
+                           last_thash, bytes, created_at) VALUES(?,?,?,?,?,?,?,?,?)""",
+                        (ymd, fname, first, last, len(rows), root, rows[-1][8], size, datetime.datetime.utcnow().isoformat()))
+            cur.execute("DELETE FROM transactions WHERE seq BETWEEN ? AND ?", (first, last))
+            POOL.on_commit(lambda meta=meta: ARCHIVE._add(meta))
+        archived.append({"date": ymd, "tx_count": len(rows), "bytes": size})
+    return {"archived": archived, "stopped": stopped, "archive": ARCHIVE.stats()}
+
+@app.post("/admin/archive/run")
+def admin_archive_run(max_days: Optional[int] = None, authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    return archive_days(max_days=max_days)
+
+@app.get("/admin/archive")
+def admin_archive(authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    with POOL.read() as cur:
+        cur.execute("SELECT ymd, file, first_seq, last_seq, tx_count, merkle_root, bytes, created_at FROM archive_segments ORDER BY ymd")
+        cols = [d[0] for d in cur.description]
+        days = [dict(zip(cols, r)) for r in cur.fetchall()]
+    return {"dir": archive_dir(), "segments": days, **ARCHIVE.stats()}
 
 # ---------- QR support ----------
+_qr_key = (None, b"")
+
+def qr_key() -> bytes:
+    # HMAC key bytes, re-derived only when JWT_SECRET changes
+    global _qr_key
+    if _qr_key[0] is not JWT_SECRET:
+        _qr_key = (JWT_SECRET, JWT_SECRET.encode("utf-8"))
+    return _qr_key[1]
+
 def make_user_qr_payload(uid: str, ttl_seconds: int = 300) -> dict:
     now = int(time.time())
     exp = now + ttl_seconds
     nonce = os.urandom(8).hex()
     data = {"uid": uid, "exp": exp, "nonce": nonce}
     msg = canonical(data).encode("utf-8")
-    sig = hmac.new(JWT_SECRET.encode("utf-8"), msg, hashlib.sha256).hexdigest()
+    sig = hmac.new(qr_key(), msg, hashlib.sha256).hexdigest()
     data["sig"] = sig
     return data
 
@@ -432,29 +2703,150 @@ def verify_user_qr_payload(data: dict) -> bool:
         check = data.copy(); check.pop("sig", None)
         msg = canonical(check).encode("utf-8")
         exp_ok = int(check.get("exp", 0)) >= int(time.time())
-        good_sig = hmac.new(JWT_SECRET.encode("utf-8"), msg, hashlib.sha256).hexdigest() == sig
+        good_sig = hmac.compare_digest(hmac.new(qr_key(), msg, hashlib.sha256).hexdigest(), str(sig))
         return exp_ok and good_sig
     except Exception:
         return False
 
+QR_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml", "txt": "text/plain; charset=utf-8"}
+
+def qr_ttl(value) -> int:
+    # 400 on anything that is not a positive integer; longer lifetimes are capped at QR_TTL_MAX_S
+    ttl = parse_int(value, "ttl")
+    if ttl <= 0:
+        raise HTTPException(status_code=400, detail="ttl must be positive")
+    return min(ttl, QR_TTL_MAX_S)
+
+def render_qr(text: str, fmt: str) -> bytes:
+    # Runs in a QR worker process. svg and txt skip PIL entirely.
+    if fmt == "png":
+        buf = io.BytesIO()
+        qrcode.make(text).save(buf, format="PNG")
+        return buf.getvalue()
+    if fmt == "svg":
+        from qrcode.image.svg import SvgPathImage
+        return qrcode.make(text, image_factory=SvgPathImage).to_string()
+    qr = qrcode.QRCode(border=2)
+    qr.add_data(text)
+    return "\n".join("".join("\u2588\u2588" if on else "  " for on in row) for row in qr.get_matrix()).encode("utf-8") + b"\n"
+
+def render_qr_many(jobs: List[Tuple[str, str]]) -> List[bytes]:
+    return [render_qr(text, fmt) for text, fmt in jobs]
+
+class QrRenderer:
+    # QR encoding is the most CPU-heavy thing the service does, so it runs in a small process
+    # pool (QR_WORKERS, 0 = threadpool) instead of on a request thread. Rendered codes are
+    # reused per (uid, ttl, format) until half their TTL has passed, so a kiosk that keeps
+    # refreshing the same users still hands out codes with at least ttl/2 of validity left.
+    def __init__(self, workers: int = QR_WORKERS, cache_size: int = QR_CACHE_SIZE):
+        self.workers = max(0, workers)
+        self.cache_size = cache_size
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[tuple, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None and self.workers:
+                self._executor = process_pool(self.workers)
+            return self._executor
+
+    def _cached(self, key) -> Optional[bytes]:
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None and hit[0] > time.time():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+        return None
+
+    def _store(self, key, ttl: int, body: bytes):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = (time.time() + ttl / 2, body)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def _run(self, fn, *args):
+        pool = self._pool()
+        if pool is None:
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+    async def render_user(self, uid: str, ttl: int, fmt: str) -> bytes:
+        key = (uid, ttl, fmt, JWT_SECRET)
+        body = self._cached(key)
+        if body is None:
+            text = "boro://user?d=" + canonical(make_user_qr_payload(uid, ttl_seconds=ttl))
+            body = await self._run(render_qr, text, fmt)
+            self._store(key, ttl, body)
+        return body
+
+    async def render_sheet(self, uids: List[str], ttl: int) -> List[bytes]:
+        # One pass: split the sheet into one slice per worker so each process renders its share
+        # in a single round trip; parallelism is bounded by the pool size.
+        jobs = [("boro://user?d=" + canonical(make_user_qr_payload(u, ttl_seconds=ttl)), "svg") for u in uids]
+        n = max(1, self.workers)
+        step = -(-len(jobs) // n) or 1
+        parts = await asyncio.gather(*(self._run(render_qr_many, jobs[i:i + step]) for i in range(0, len(jobs), step)))
+        return [b for part in parts for b in part]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+QR = QrRenderer()
+
+def user_qr_image_route(fmt: str):
+    # One literal route per format, declared before /qr/user/{uid}: "user1.png" is an image,
+    # while a dotted uid such as "john.doe" still reaches the JSON route.
+    async def user_qr_image(uid: str, ttl: int = 300, authorization: Optional[str] = Header(None)):
+        require_auth(authorization, roles=None)
+        if qrcode is None:
+            raise HTTPException(status_code=500, detail="qrcode library not installed")
+        body = await QR.render_user(uid, qr_ttl(ttl), fmt)
+        return Response(body, media_type=QR_MEDIA_TYPES[fmt], headers={"Cache-Control": "no-store"})
+    app.get("/qr/user/{uid}." + fmt, name=f"user_qr_{fmt}")(user_qr_image)
+
+for _fmt in QR_MEDIA_TYPES:
+    user_qr_image_route(_fmt)
+
 @app.get("/qr/user/{uid}")
 def user_qr_json(uid: str, ttl: int = 300, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=None)
-    payload = make_user_qr_payload(uid, ttl_seconds=ttl)
+    payload = make_user_qr_payload(uid, ttl_seconds=qr_ttl(ttl))
     return {"payload": payload, "canonical": canonical(payload)}
 
-@app.get("/qr/user/{uid}.png")
-def user_qr_png(uid: str, ttl: int = 300, authorization: Optional[str] = Header(None)):
-    require_auth(authorization, roles=None)
+@app.post("/qr/sheet", response_class=HTMLResponse)
+async def qr_sheet(body: dict, authorization: Optional[str] = Header(None)):
+    # Printable HTML page of user QR codes (inline SVG), e.g. for onboarding drives.
+    require_auth(authorization, roles=["admin"])
     if qrcode is None:
         raise HTTPException(status_code=500, detail="qrcode library not installed")
-    payload = make_user_qr_payload(uid, ttl_seconds=ttl)
-    text = "boro://user?d=" + canonical(payload)
-    img = qrcode.make(text)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return StreamingResponse(buf, media_type="image/png")
+    uids = [str(u) for u in body.get("user_ids") or []]
+    if not uids:
+        raise HTTPException(status_code=400, detail="user_ids required")
+    if len(uids) > QR_SHEET_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {QR_SHEET_MAX} user_ids per sheet")
+    ttl = qr_ttl(body.get("ttl", 86400))
+    svgs = await QR.render_sheet(uids, ttl)
+    # drop each SVG's XML declaration so it can be inlined
+    cells = "".join(f'<figure>{svg.decode("utf-8").split("?>", 1)[-1]}<figcaption>{html.escape(u)}</figcaption></figure>'
+                    for u, svg in zip(uids, svgs))
+    return ("<!doctype html><html><head><meta charset='utf-8'><title>QR sheet</title><style>"
+            "body{font-family:sans-serif;display:grid;grid-template-columns:repeat(4,1fr);gap:12px}"
+            "figure{margin:0;text-align:center;break-inside:avoid}svg{width:100%;height:auto}"
+            f"</style></head><body>{cells}</body></html>")
 
 @app.post("/qr/verify")
 def qr_verify(body: dict, authorization: Optional[str] = Header(None)):
@@ -471,102 +2863,930 @@ def qr_verify(body: dict, authorization: Optional[str] = Header(None)):
 @app.get("/admin/settings")
 def get_settings(authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=["admin"])
-    con = db(); cur = con.cursor()
-    rows = cur.execute("SELECT key, value FROM settings").fetchall()
-    con.close()
-    return {k:v for k,v in rows}
+    with POOL.read() as cur:
+        CONFIG.sync(cur)
+        return {k: str(v) for k, v in CONFIG.settings(cur).items()}
 
 @app.post("/admin/settings")
 def set_settings(body: dict, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=["admin"])
-    con = db(); cur = con.cursor()
-    for k, v in body.items():
-        cur.execute("INSERT INTO settings(key, value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (k, str(v)))
-    con.commit(); con.close()
+    values = {k: parse_int(v, k) if SETTING_TYPES.get(k) is int else v for k, v in body.items()}
+    with POOL.write() as cur:
+        for k, v in values.items():
+            cur.execute("INSERT INTO settings(key, value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (k, str(v)))
+        CONFIG.bump(cur)
     return {"status": "ok"}
 
 @app.post("/admin/merchant/config")
 def set_merchant_config(body: dict, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=["admin"])
     mid = body.get("merchant_id")
-    rate = int(body.get("rate_limit_per_minute", 60))
-    ecap = int(body.get("daily_earn_cap", 100000))
-    rcap = int(body.get("daily_redeem_cap", 100000))
-    con = db(); cur = con.cursor()
-    r = cur.execute("SELECT 1 FROM merchants WHERE id=?", (mid,)).fetchone()
-    if not r: raise HTTPException(status_code=404, detail="Unknown merchant")
-    cur.execute("""UPDATE merchants SET rate_limit_per_minute=?, daily_earn_cap=?, daily_redeem_cap=? WHERE id=?""",
-                (rate, ecap, rcap, mid))
-    con.commit(); con.close()
+    rate = parse_int(body.get("rate_limit_per_minute", DEFAULT_LIMITS["rate"]), "rate_limit_per_minute")
+    ecap = parse_int(body.get("daily_earn_cap", DEFAULT_LIMITS["earn_cap"]), "daily_earn_cap")
+    rcap = parse_int(body.get("daily_redeem_cap", DEFAULT_LIMITS["redeem_cap"]), "daily_redeem_cap")
+    with POOL.write() as cur:
+        r = cur.execute("SELECT 1 FROM merchants WHERE id=?", (mid,)).fetchone()
+        if not r: raise HTTPException(status_code=404, detail="Unknown merchant")
+        cur.execute("""UPDATE merchants SET rate_limit_per_minute=?, daily_earn_cap=?, daily_redeem_cap=? WHERE id=?""",
+                    (rate, ecap, rcap, mid))
+        CONFIG.bump(cur)
     return {"status":"ok"}
 
+# ---------- Merchant rollups & settlement ----------
+SQL_ROLLUP_UPSERT = """
+    INSERT INTO merchant_daily_rollup(merchant_id, ymd, earn_total, earn_count, redeem_total, redeem_count)
+    VALUES(?,?,?,?,?,?)
+    ON CONFLICT(merchant_id, ymd) DO UPDATE SET
+        earn_total = earn_total + excluded.earn_total, earn_count = earn_count + excluded.earn_count,
+        redeem_total = redeem_total + excluded.redeem_total, redeem_count = redeem_count + excluded.redeem_count
+"""
+
+def apply_rollups(cur, rows: List[tuple]):
+    agg: Dict[Tuple[str,str], List[int]] = {}
+    for r in rows:
+        ttype, mid = r[3], r[5]
+        if mid and ttype in ("EARN", "REDEEM"):
+            a = agg.setdefault((mid, r[2][:10]), [0, 0, 0, 0])
+            k = 0 if ttype == "EARN" else 2
+            a[k] += r[6]; a[k+1] += 1
+    if agg:
+        cur.executemany(SQL_ROLLUP_UPSERT, [(mid, ymd, *a) for (mid, ymd), a in agg.items()])
+
+def rebuild_rollups(cur) -> int:
+    cur.execute("DELETE FROM merchant_daily_rollup")
+    cur.execute("""
+        INSERT INTO merchant_daily_rollup(merchant_id, ymd, earn_total, earn_count, redeem_total, redeem_count)
+        SELECT merchant_id, substr(ts, 1, 10),
+               SUM(CASE WHEN ttype='EARN' THEN amount ELSE 0 END), COUNT(CASE WHEN ttype='EARN' THEN 1 END),
+               SUM(CASE WHEN ttype='REDEEM' THEN amount ELSE 0 END), COUNT(CASE WHEN ttype='REDEEM' THEN 1 END)
+        FROM transactions
+        WHERE merchant_id IS NOT NULL AND ttype IN ('EARN','REDEEM')
+        GROUP BY merchant_id, substr(ts, 1, 10)
+    """)
+    # archived days are disjoint from live ones, so their upserts never meet an existing row
+    rows = ARCHIVE.iter_rows()
+    for chunk in iter(lambda: list(itertools.islice(rows, TX_STREAM_BATCH)), []):
+        apply_rollups(cur, chunk)
+    return cur.execute("SELECT COUNT(*) FROM merchant_daily_rollup").fetchone()[0]
+
+SQL_SETTLEMENT = """
+    SELECT merchants.id, merchants.display_name,
+           COALESCE(SUM(merchant_daily_rollup.redeem_total),0) as redeemed_total,
+           COALESCE(SUM(merchant_daily_rollup.redeem_count),0) as redeem_count
+    FROM merchants
+    LEFT JOIN merchant_daily_rollup ON merchant_daily_rollup.merchant_id = merchants.id
+         AND merchant_daily_rollup.ymd >= ? AND merchant_daily_rollup.ymd <= ?
+    GROUP BY merchants.id, merchants.display_name
+    ORDER BY redeemed_total DESC
+"""
+SQL_SETTLEMENT_DAYS = """
+    SELECT merchant_id, ymd, redeem_total FROM merchant_daily_rollup
+    WHERE ymd >= ? AND ymd <= ? AND redeem_count > 0
+"""
+SETTLEMENT_MAX_DAY_COLUMNS = 366
+
+def settlement_lines(date_from: str, date_to: str, by_day: bool):
+    with POOL.stream() as cur:
+        header = "merchant_id,merchant_name,redeemed_total,redeem_count"
+        days, per_day = [], {}
+        if by_day:
+            d, last = datetime.date.fromisoformat(date_from), datetime.date.fromisoformat(date_to)
+            while d <= last:
+                days.append(d.isoformat()); d += datetime.timedelta(days=1)
+            header += "".join(f",redeem_{ymd}" for ymd in days)
+            for mid, ymd, total in cur.execute(SQL_SETTLEMENT_DAYS, (date_from, date_to)).fetchall():
+                per_day[(mid, ymd)] = total
+        yield header + "\n"
+        cur.execute(SQL_SETTLEMENT, (date_from, date_to))
+        while True:
+            batch = cur.fetchmany(500)
+            if not batch:
+                return
+            for r in batch:
+                line = f"{r[0]},{str(r[1]).replace(',',' ')},{r[2]},{r[3]}"
+                if by_day:
+                    line += "".join(f",{per_day.get((r[0], ymd), 0)}" for ymd in days)
+                yield line + "\n"
+
 @app.get("/admin/settlement.csv")
-def settlement_csv(date_from: str, date_to: str, authorization: Optional[str] = Header(None)):
+def settlement_csv(date_from: str, date_to: str, by_day: bool = False, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=["admin"])
-    con = db(); cur = con.cursor()
-    rows = cur.execute("""
-        SELECT m.id, m.display_name,
-               COALESCE(SUM(CASE WHEN t.ttype='REDEEM' THEN t.amount ELSE 0 END),0) as redeemed_total,
-               COUNT(CASE WHEN t.ttype='REDEEM' THEN 1 END) as redeem_count
-        FROM merchants m
-        LEFT JOIN transactions t ON m.id = t.merchant_id AND DATE(t.ts) BETWEEN ? AND ?
-        GROUP BY m.id, m.display_name
-        ORDER BY redeemed_total DESC
-    """, (date_from, date_to)).fetchall()
-    con.close()
-    lines = ["merchant_id,merchant_name,redeemed_total,redeem_count"]
+    start, end = span_bounds(date_from, date_to)
+    date_from, date_to = start, (datetime.date.fromisoformat(end) - datetime.timedelta(days=1)).isoformat()
+    if by_day and (datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start)).days > SETTLEMENT_MAX_DAY_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Per-day breakdown is limited to {SETTLEMENT_MAX_DAY_COLUMNS} days")
+    return StreamingResponse(settlement_lines(date_from, date_to, by_day), media_type="text/csv")
+
+# ---------- FIFO lots ----------
+# Every EARN/ISSUE opens a lot; REDEEM and EXPIRE consume the user's oldest open lots first.
+# Expirable points are then just the open remainder of lots older than the cutoff.
+SQL_OPEN_LOTS = """
+    SELECT seq, remaining FROM lots
+    WHERE user_id = ? AND remaining > 0 ORDER BY seq LIMIT 32
+"""
+SQL_USER_EXPIRABLE = """
+    SELECT COALESCE(SUM(remaining),0) FROM lots
+    WHERE user_id = ? AND remaining > 0 AND ts <= ?
+"""
+SQL_EXPIRABLE_BY_USER = """
+    SELECT user_id, SUM(remaining) FROM lots INDEXED BY idx_lots_open_ts
+    WHERE remaining > 0 AND ts <= ?
+    GROUP BY user_id
+"""
+
+def consume_lots(cur, uid: str, amount: int):
+    need = amount
+    while need > 0:
+        open_lots = cur.execute(SQL_OPEN_LOTS, (uid,)).fetchall()
+        if not open_lots:
+            return  # nothing left to consume (history predating lots tracking)
+        updates = []
+        for seq, remaining in open_lots:
+            take = min(remaining, need)
+            updates.append((remaining - take, seq))
+            need -= take
+            if need == 0:
+                break
+        cur.executemany("UPDATE lots SET remaining = ? WHERE seq = ?", updates)
+
+SQL_OPEN_LOT = "INSERT INTO lots(seq, user_id, ts, amount, remaining) VALUES(?,?,?,?,?)"
+
+def apply_lots(cur, rows: List[tuple]):
+    # Opens are buffered for executemany but flushed before any consume, so a REDEEM in the same
+    # batch can draw on points earned just before it.
+    opens = []
     for r in rows:
-        lines.append(f"{r[0]},{str(r[1]).replace(',',' ')},{r[2]},{r[3]}")
-    csv = "\n".join(lines)
-    return PlainTextResponse(csv, media_type="text/csv")
+        ttype, uid = r[3], r[4]
+        if not uid:
+            continue
+        if ttype in ("EARN", "ISSUE"):
+            opens.append((r[1], uid, r[2], r[6], r[6]))
+        elif ttype in ("REDEEM", "EXPIRE"):
+            if opens:
+                cur.executemany(SQL_OPEN_LOT, opens)
+                opens = []
+            consume_lots(cur, uid, r[6])
+    if opens:
+        cur.executemany(SQL_OPEN_LOT, opens)
 
-def fifo_expirable_amount_for_user(cur, uid: str, cutoff_iso: str) -> int:
-    earns = cur.execute("""
-        SELECT ts, amount FROM transactions
-        WHERE user_id=? AND ttype IN ('EARN','ISSUE') ORDER BY ts ASC, ROWID ASC
-    """, (uid,)).fetchall()
-    redeems = cur.execute("""
-        SELECT ts, amount FROM transactions
-        WHERE user_id=? AND ttype='REDEEM' ORDER BY ts ASC, ROWID ASC
-    """, (uid,)).fetchall()
-    lots = [{"ts": e[0], "remaining": e[1]} for e in earns]
-    for ts_r, amt_r in redeems:
-        need = amt_r
-        for lot in lots:
-            if need == 0: break
-            take = min(lot["remaining"], need)
-            lot["remaining"] -= take
+def rebuild_lots(cur) -> int:
+    # Derive lots from the full ledger history (same rules as apply_lots, replayed in seq order).
+    cur.execute("DELETE FROM lots")
+    lots: Dict[str, List[list]] = {}
+    heads: Dict[str, int] = {}
+    for _, seq, ts, ttype, uid, _, amount, _, _, _ in iter_ledger(cur):
+        if not uid or ttype not in ("EARN", "ISSUE", "REDEEM", "EXPIRE"):
+            continue
+        if ttype in ("EARN", "ISSUE"):
+            lots.setdefault(uid, []).append([seq, uid, ts, amount, amount])
+            continue
+        user_lots, i, need = lots.get(uid, []), heads.get(uid, 0), amount
+        while need > 0 and i < len(user_lots):
+            take = min(user_lots[i][4], need)
+            user_lots[i][4] -= take
             need -= take
-    expirable = 0
-    for lot in lots:
-        if lot["ts"] <= cutoff_iso:
-            expirable += max(lot["remaining"], 0)
-    return expirable
+            if user_lots[i][4] == 0:
+                i += 1
+        heads[uid] = i
+    rows = [tuple(lot) for user_lots in lots.values() for lot in user_lots]
+    cur.executemany(SQL_OPEN_LOT, rows)
+    return len(rows)
+
+def fifo_expirable_amount_for_user(cur, uid: str, cutoff_iso: str) -> int:
+    return cur.execute(SQL_USER_EXPIRABLE, (uid, cutoff_iso)).fetchone()[0]
+
+# ---------- Expiry job ----------
+SQL_USER_PAGE = "SELECT id FROM accounts WHERE kind='user' AND id > ? ORDER BY id LIMIT ?"
+
+def _job_dict(cur, job_id: Optional[int] = None) -> Optional[dict]:
+    if job_id is None:
+        cur.execute("SELECT * FROM expiry_jobs ORDER BY id DESC LIMIT 1")
+    else:
+        cur.execute("SELECT * FROM expiry_jobs WHERE id=?", (job_id,))
+    r = cur.fetchone()
+    return dict(zip([d[0] for d in cur.description], r)) if r else None
+
+class ExpiryJobRunner:
+    # Runs the expiry sweep in the background: users are paged by id (keyset), expirable amounts
+    # are computed on a small thread pool of read connections, and each page is written and
+    # checkpointed in its own short write transaction so merchant traffic interleaves with it.
+    # A job left "running" (crash, restart) resumes from its checkpoint at the next startup.
+    def __init__(self, chunk_size: int = EXPIRY_CHUNK_SIZE, workers: int = EXPIRY_WORKERS):
+        self.chunk_size = max(1, chunk_size)
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._progress = {}  # job id -> (monotonic start, users scanned at start) for this process
+
+    def start(self, days: int) -> dict:
+        with self._lock:
+            with POOL.write() as cur:
+                job = _job_dict(cur)
+                if job and job["status"] == "running":
+                    self._launch(job["id"])
+                    return job
+                now = datetime.datetime.utcnow()
+                total = cur.execute("SELECT COUNT(*) FROM accounts WHERE kind='user'").fetchone()[0]
+                cur.execute("""INSERT INTO expiry_jobs(status, days, cutoff, last_user_id, users_total, started_at, updated_at)
+                               VALUES('running',?,?,'',?,?,?)""",
+                            (days, (now - datetime.timedelta(days=days)).isoformat(), total, now.isoformat(), now.isoformat()))
+                job_id = cur.lastrowid
+            self._launch(job_id)
+        with POOL.read() as cur:
+            return _job_dict(cur, job_id)
+
+    def resume(self):
+        with POOL.read() as cur:
+            job = _job_dict(cur)
+        if job and job["status"] == "running":
+            with self._lock:
+                self._launch(job["id"])
+
+    def _launch(self, job_id: int):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(job_id,), name=f"expiry-job-{job_id}", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None):
+        t = self._thread
+        if t is not None:
+            t.join(timeout)
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+    def _run(self, job_id: int):
+        with POOL.read() as cur:
+            job = _job_dict(cur, job_id)
+        self._progress[job_id] = (time.monotonic(), job["users_scanned"])
+        cutoff, last = job["cutoff"], job["last_user_id"] or ""
+        note = f"expiry>{job['days']}d"
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="expiry") as pool:
+                while not self._stop.is_set():
+                    with POOL.read() as cur:
+                        users = [r[0] for r in cur.execute(SQL_USER_PAGE, (last, self.chunk_size)).fetchall()]
+                    if not users:
+                        break
+                    slices = [users[i::self.workers] for i in range(self.workers)]
+                    candidates = [uid for part in pool.map(lambda part: self._expirable(part, cutoff), slices)
+                                  for uid in part]
+                    self._write_chunk(job_id, users, sorted(candidates), cutoff, note)
+                    last = users[-1]
+            if not self._stop.is_set():
+                with POOL.write() as cur:
+                    now = datetime.datetime.utcnow().isoformat()
+                    cur.execute("UPDATE expiry_jobs SET status='done', updated_at=?, finished_at=? WHERE id=?", (now, now, job_id))
+        except Exception as e:
+            with POOL.write() as cur:
+                cur.execute("UPDATE expiry_jobs SET status='failed', error=?, updated_at=? WHERE id=?",
+                            (repr(e), datetime.datetime.utcnow().isoformat(), job_id))
+
+    @staticmethod
+    def _expirable(uids: List[str], cutoff: str) -> List[str]:
+        with POOL.read() as cur:
+            return [uid for uid in uids if fifo_expirable_amount_for_user(cur, uid, cutoff) > 0]
+
+    @staticmethod
+    def _write_chunk(job_id: int, users: List[str], candidates: List[str], cutoff: str, note: str):
+        # The amount is re-read under the write lock: a REDEEM since the parallel scan may have
+        # consumed some of those lots already. apply_tx clips EXPIRE to the balance, so the job
+        # counts the clipped amount, the one the ledger row records.
+        with POOL.write() as cur:
+            expired_users = expired_points = 0
+            for uid in candidates:
+                amt = min(fifo_expirable_amount_for_user(cur, uid, cutoff), BALANCES.peek(uid)[1])
+                if amt > 0:
+                    apply_tx(cur, "EXPIRE", user_id=uid, merchant_id=None, amount=amt, note=note)
+                    expired_users += 1
+                    expired_points += amt
+            cur.execute("""UPDATE expiry_jobs SET last_user_id=?, users_scanned=users_scanned+?,
+                           users_expired=users_expired+?, points_expired=points_expired+?, updated_at=?
+                           WHERE id=?""",
+                        (users[-1], len(users), expired_users, expired_points,
+                         datetime.datetime.utcnow().isoformat(), job_id))
+
+    def status(self, job: dict) -> dict:
+        out = dict(job)
+        total, scanned = job["users_total"], job["users_scanned"]
+        out["progress"] = min(1.0, scanned / total) if total else 1.0
+        started = self._progress.get(job["id"])
+        rate = None
+        if started and job["status"] == "running":
+            elapsed = time.monotonic() - started[0]
+            rate = (scanned - started[1]) / elapsed if elapsed > 0 else None
+        out["users_per_s"] = rate
+        out["eta_s"] = max(0, total - scanned) / rate if rate else None
+        return out
+
+EXPIRY = ExpiryJobRunner()
 
 @app.post("/admin/expire/run")
-def run_expiry(authorization: Optional[str] = Header(None)):
+def run_expiry(wait: bool = False, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=["admin"])
-    con = db(); cur = con.cursor()
-    days = int(cur.execute("SELECT value FROM settings WHERE key='expiry_days'").fetchone()[0])
+    with POOL.read() as cur:
+        CONFIG.sync(cur)
+        days = CONFIG.setting_int(cur, "expiry_days")
     if days <= 0:
-        con.close()
         return {"status":"disabled"}
-    cutoff_dt = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-    cutoff_iso = cutoff_dt.isoformat()
-    users = cur.execute("SELECT id FROM accounts WHERE kind='user'").fetchall()
-    summary = {}
-    for (uid,) in users:
-        amt = fifo_expirable_amount_for_user(cur, uid, cutoff_iso)
-        if amt > 0:
-            res = apply_tx(cur, "EXPIRE", user_id=uid, merchant_id=None, amount=amt, note=f"expiry>{days}d")
-            summary[uid] = amt
-    con.commit(); con.close()
-    return {"status":"ok", "cutoff": cutoff_iso, "expired": summary}
+    job = EXPIRY.start(days)
+    if wait:
+        EXPIRY.wait()
+        with POOL.read() as cur:
+            job = _job_dict(cur, job["id"])
+    return {"status": job["status"], "job": EXPIRY.status(job)}
 
-@app.get("/admin/alerts")
-def list_alerts(limit: int = 50, authorization: Optional[str] = Header(None)):
+@app.get("/admin/expire/status")
+def expiry_status(job_id: Optional[int] = None, authorization: Optional[str] = Header(None)):
     require_auth(authorization, roles=["admin"])
-    con = db(); cur = con.cursor()
-    rows = cur.execute("SELECT ts, atype, merchant_id, user_id, detail FROM alerts ORDER BY ts DESC LIMIT ?", (limit,)).fetchall()
+    with POOL.read() as cur:
+        job = _job_dict(cur, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No expiry job")
+    return {"job": EXPIRY.status(job)}
+
+# ---------- Balance snapshots and replay ----------
+# balance_snapshots hold every non-zero balance as of a ledger seq. replay_balances rebuilds all
+# balances from the newest snapshot that still matches the chain plus one pass over the rows
+# after it, through the same balance_deltas the write path uses. Snapshots are produced by
+# replay, never copied from `accounts`, so a drifted accounts table cannot leak into them.
+SQL_REPLAY_COLUMNS = "NULL, seq, NULL, ttype, user_id, merchant_id, amount"  # the TX_FIELDS slots balance_deltas reads
+SQL_REPLAY_TAIL = f"SELECT {SQL_REPLAY_COLUMNS} FROM transactions WHERE seq > ?"
+# a long tail is cheaper as one table scan than as an index walk with a row lookup per entry
+SQL_REPLAY_SCAN = f"SELECT {SQL_REPLAY_COLUMNS} FROM transactions NOT INDEXED WHERE seq > ?"
+SQL_SNAPSHOT_ROWS = "SELECT account_id, balance FROM balance_snapshot_rows WHERE snapshot_id = ?"
+BALANCE_LOG = logging.getLogger("boro.balances")
+
+def ledger_thash(cur, seq: int) -> Optional[str]:
+    r = cur.execute("SELECT thash FROM transactions WHERE seq = ?", (seq,)).fetchone()
+    if r:
+        return r[0]
+    r = ARCHIVE.get_seq(seq)
+    return r[8] if r else None
+
+def latest_snapshot(cur) -> Tuple[Optional[int], int, Dict[str, int]]:
+    # (id, seq, balances) of the newest snapshot whose row still carries the recorded thash
+    for sid, seq, thash in cur.execute("SELECT id, seq, thash FROM balance_snapshots ORDER BY seq DESC").fetchall():
+        if ledger_thash(cur, seq) == thash:
+            return sid, seq, dict(cur.execute(SQL_SNAPSHOT_ROWS, (sid,)).fetchall())
+    return None, 0, {}
+
+def replay_balances(cur, full: bool = False) -> dict:
+    # Call inside one transaction (a POOL.write() block, or BEGIN on a stream cursor) so the
+    # snapshot, the archive and the live tail all describe the same ledger.
+    t0 = time.perf_counter()
+    sid, start, balances = (None, 0, {}) if full else latest_snapshot(cur)
+    head, rows = start, 0
+    archived = ARCHIVE.iter_rows(start)
+    for chunk in iter(lambda: list(itertools.islice(archived, TX_STREAM_BATCH)), []):
+        balance_deltas(chunk, balances)
+        rows += len(chunk)
+        head = chunk[-1][1]
+    oldest = cur.execute(SQL_OLDEST_LIVE).fetchone()
+    newest = cur.execute("SELECT MAX(seq) FROM transactions").fetchone()[0]
+    if oldest:
+        scan = newest - head > (newest - oldest[0]) // 4
+        cur.execute(SQL_REPLAY_SCAN if scan else SQL_REPLAY_TAIL, (head,))
+        for chunk in iter(lambda: cur.fetchmany(TX_STREAM_BATCH), []):
+            balance_deltas(chunk, balances)
+            rows += len(chunk)
+            head = max(head, max(r[1] for r in chunk))  # scan order is not seq order
+    if rows != head - start:
+        raise RuntimeError(f"ledger replay read {rows} rows for seqs {start + 1}..{head}")
+    return {"balances": balances, "seq": head, "thash": ledger_thash(cur, head) if head else None,
+            "snapshot_id": sid, "from_seq": start, "rows": rows, "elapsed_s": time.perf_counter() - t0}
+
+def _replay_summary(rep: dict) -> dict:
+    return {"seq": rep["seq"], "from_snapshot_id": rep["snapshot_id"], "replayed_from_seq": rep["from_seq"],
+            "replayed_rows": rep["rows"], "replay_s": rep["elapsed_s"]}
+
+def check_balances(full: bool = False, limit: int = 100) -> dict:
+    # Compares the in-process cache, the accounts table and a replay (from the newest snapshot,
+    # or from seq 1 with full=True). Holds the write lock so all three describe the same state.
+    with POOL.write() as cur:
+        table = {i: b for i, b in cur.execute("SELECT id, balance FROM accounts").fetchall()}
+        cached = {i: kb[1] for i, kb in BALANCES.snapshot().items()}
+        rep = replay_balances(cur, full=full)
+    replay = dict.fromkeys(table, 0)
+    replay.update(rep["balances"])
+    mismatches = []
+    for acc in sorted(set(table) | set(cached) | set(replay)):
+        vals = (cached.get(acc), table.get(acc), replay.get(acc))
+        if len(set(vals)) > 1:
+            mismatches.append({"account": acc, "cache": vals[0], "accounts": vals[1], "replay": vals[2]})
+    return {"ok": not mismatches, "accounts": len(table), **_replay_summary(rep),
+            "mismatch_count": len(mismatches), "mismatches": mismatches[:limit]}
+
+def repair_balances(full: bool = False, limit: int = 100) -> dict:
+    # Resets accounts.balance and the cache to the replayed values. Ledger rows that name an
+    # account with no accounts row are reported, not created.
+    with POOL.write() as cur:
+        table = {i: b for i, b in cur.execute("SELECT id, balance FROM accounts").fetchall()}
+        cached = {i: kb[1] for i, kb in BALANCES.snapshot().items()}
+        rep = replay_balances(cur, full=full)
+        fixes = []
+        for acc in sorted(table):
+            want = rep["balances"].get(acc, 0)
+            if table[acc] != want or cached.get(acc, want) != want:
+                fixes.append({"account": acc, "cache": cached.get(acc), "accounts": table[acc], "replay": want})
+        cur.executemany("UPDATE accounts SET balance = ? WHERE id = ?",
+                        [(f["replay"], f["account"]) for f in fixes if f["accounts"] != f["replay"]])
+        if fixes:
+            raise_alert("BALANCE_REPAIR", None, f"{len(fixes)} balances reset from ledger replay at seq {rep['seq']}")
+            BALANCES.bump(cur)
+        BALANCES.overwrite({f["account"]: f["replay"] for f in fixes})
+    unknown = sorted(acc for acc, b in rep["balances"].items() if acc not in table and b)
+    return {"repaired": len(fixes), **_replay_summary(rep), "fixes": fixes[:limit], "unknown_accounts": unknown[:limit]}
+
+class BalanceSnapshots:
+    # Takes a snapshot every BALANCE_SNAPSHOT_EVERY ledger rows on a background thread. The
+    # replay runs in a read transaction; only the insert takes the write lock. The newest
+    # BALANCE_SNAPSHOT_KEEP snapshots are kept.
+    def __init__(self, every: int = BALANCE_SNAPSHOT_EVERY, keep: int = BALANCE_SNAPSHOT_KEEP):
+        self.every = every
+        self.keep = max(1, keep)
+        self.seq = 0  # seq of the newest snapshot
+        self._lock = threading.Lock()
+        self._take_lock = threading.Lock()
+        self._thread = None
+        self.taken = 0
+        self.last_elapsed_s = None
+
+    def load(self, cur):
+        self.seq = cur.execute("SELECT COALESCE(MAX(seq), 0) FROM balance_snapshots").fetchone()[0]
+
+    def due(self, head: int) -> bool:
+        return self.every > 0 and head - self.seq >= self.every
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="balance-snapshot", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.take()
+        except Exception:
+            BALANCE_LOG.exception("balance snapshot failed")
+
+    def _replay(self) -> dict:
+        for attempt in (0, 1):
+            with POOL.stream() as cur:
+                cur.execute("BEGIN")
+                try:
+                    return replay_balances(cur)
+                except RuntimeError:
+                    # a day archived between reading the archive index and the live table
+                    if attempt:
+                        raise
+                    ARCHIVE.load(cur)
+                finally:
+                    cur.execute("COMMIT")
+
+    def take(self) -> dict:
+        with self._take_lock:
+            t0 = time.perf_counter()
+            rep = self._replay()
+            if rep["seq"] <= self.seq:
+                return {"status": "current", "seq": self.seq}
+            nonzero = [(acc, b) for acc, b in rep["balances"].items() if b]
+            with POOL.write() as cur:
+                if cur.execute("SELECT 1 FROM balance_snapshots WHERE seq >= ?", (rep["seq"],)).fetchone():
+                    return {"status": "current", "seq": rep["seq"]}
+                elapsed = time.perf_counter() - t0
+                cur.execute("""INSERT INTO balance_snapshots(seq, thash, accounts, total, created_at, elapsed_s)
+                               VALUES(?,?,?,?,?,?)""",
+                            (rep["seq"], rep["thash"], len(nonzero), sum(b for _, b in nonzero),
+                             datetime.datetime.utcnow().isoformat(), elapsed))
+                sid = cur.lastrowid
+                cur.executemany("INSERT INTO balance_snapshot_rows(snapshot_id, account_id, balance) VALUES(?,?,?)",
+                                [(sid, acc, b) for acc, b in nonzero])
+                old = [r[0] for r in cur.execute("SELECT id FROM balance_snapshots ORDER BY seq DESC LIMIT -1 OFFSET ?",
+                                                 (self.keep,)).fetchall()]
+                cur.executemany("DELETE FROM balance_snapshot_rows WHERE snapshot_id = ?", [(o,) for o in old])
+                cur.executemany("DELETE FROM balance_snapshots WHERE id = ?", [(o,) for o in old])
+                POOL.on_commit(lambda: setattr(self, "seq", max(self.seq, rep["seq"])))
+            self.taken += 1
+            self.last_elapsed_s = elapsed
+            return {"status": "created", "snapshot_id": sid, "accounts": len(nonzero), "pruned": len(old),
+                    **_replay_summary(rep), "elapsed_s": elapsed}
+
+    def stats(self) -> dict:
+        return {"seq": self.seq, "taken": self.taken, "last_elapsed_s": self.last_elapsed_s,
+                "running": self._thread is not None and self._thread.is_alive()}
+
+SNAPSHOTS = BalanceSnapshots()
+POOL.on_external_change(SNAPSHOTS.load)
+
+def startup_balance_check(mode: str = BALANCE_CHECK_ON_STARTUP) -> Optional[dict]:
+    # off | warn (log mismatches) | repair (reset balances from the replay) | fail (refuse to start)
+    if mode == "off":
+        return None
+    report = repair_balances() if mode == "repair" else check_balances()
+    bad = report.get("repaired") or report.get("mismatch_count")
+    if bad and mode == "fail":
+        raise RuntimeError(f"{bad} account balances disagree with the ledger; run `python app.py repair-balances`")
+    log = BALANCE_LOG.warning if bad else BALANCE_LOG.info
+    log("startup balance check (%s): %s accounts off, replayed %d rows from seq %d in %.2fs",
+        mode, bad or 0, report["replayed_rows"], report["replayed_from_seq"], report["replay_s"])
+    if SNAPSHOTS.due(CHAIN.seq):
+        SNAPSHOTS.start()
+    return report
+
+@app.get("/admin/balances/check")
+def admin_check_balances(full: bool = False, authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    return check_balances(full=full)
+
+@app.post("/admin/balances/repair")
+def admin_repair_balances(full: bool = False, authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    return repair_balances(full=full)
+
+@app.post("/admin/balances/snapshot")
+def admin_balance_snapshot(authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    return SNAPSHOTS.take()
+
+@app.get("/admin/balances/snapshots")
+def admin_balance_snapshots(authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    with POOL.read() as cur:
+        cur.execute("SELECT id, seq, thash, accounts, total, created_at, elapsed_s FROM balance_snapshots ORDER BY seq DESC")
+        cols = [d[0] for d in cur.description]
+        snaps = [dict(zip(cols, r)) for r in cur.fetchall()]
+    return {"snapshots": snaps, **SNAPSHOTS.stats()}
+
+# ---------- Compact ledger format ----------
+# Offline, converted copy of a ledger: integer µs timestamps, 32-byte BLOB hashes, small-int
+# ttypes and integer surrogate keys for accounts. The text id and prev_hash are dropped (id is the
+# thash prefix, prev_hash is the previous row's thash), so conversion refuses a broken chain.
+TTYPE_CODES = {"EARN": 1, "REDEEM": 2, "ISSUE": 3, "ADJUST": 4, "EXPIRE": 5}
+TTYPE_NAMES = {v: k for k, v in TTYPE_CODES.items()}
+COMPACT_SCHEMA = """
+CREATE TABLE ledger_keys (
+    key INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE ctransactions (
+    seq INTEGER PRIMARY KEY,
+    ts_us INTEGER NOT NULL,
+    ttype INTEGER NOT NULL,
+    user_key INTEGER,
+    merchant_key INTEGER,
+    amount INTEGER NOT NULL,
+    thash BLOB NOT NULL,
+    note TEXT,
+    ts_text TEXT  -- only set when ts does not round-trip through ts_us
+);
+CREATE INDEX idx_ctx_user_seq ON ctransactions(user_key, seq);
+CREATE INDEX idx_ctx_merchant_seq ON ctransactions(merchant_key, seq);
+CREATE INDEX idx_ctx_ts ON ctransactions(ts_us);
+"""
+
+def micros_ts(us: int) -> str:
+    return (_EPOCH + datetime.timedelta(microseconds=us)).isoformat()
+
+def _compact_ts(ts: str) -> Tuple[int, Optional[str]]:
+    try:
+        us = ts_micros(ts)
+    except (ValueError, TypeError):
+        return 0, ts
+    return (us, None) if micros_ts(us) == ts else (us, ts)
+
+def _time_queries(con, sql_by_user: str, sql_by_day: str, users: list, days: list) -> dict:
+    t0 = time.perf_counter()
+    for u in users:
+        con.execute(sql_by_user, (u,)).fetchall()
+    t1 = time.perf_counter()
+    for d in days:
+        con.execute(sql_by_day, d).fetchone()
+    t2 = time.perf_counter()
+    return {"user_history_ms": (t1 - t0) / max(1, len(users)) * 1000, "day_count_ms": (t2 - t1) / max(1, len(days)) * 1000}
+
+def compact_ledger(dst: str, samples: int = 200) -> dict:
+    # Copies DB_PATH to dst (VACUUM INTO, so the live DB is only read), converts the copy's
+    # transactions table in place, verifies the converted chain and reports size and speed
+    # against the freshly packed text copy.
+    if os.path.exists(dst):
+        raise FileExistsError(dst)
+    src = db(readonly=True)
+    src.execute("VACUUM INTO ?", (dst,))
+    src.close()
+    text_bytes = os.path.getsize(dst)
+    con = sqlite3.connect(dst, isolation_level=None)
+    rng = random.Random(5)
+    names = [r[0] for r in con.execute("SELECT id FROM accounts UNION SELECT user_id FROM transactions WHERE user_id IS NOT NULL "
+                                       "UNION SELECT merchant_id FROM transactions WHERE merchant_id IS NOT NULL ORDER BY 1")]
+    archived = set()
+    for meta in ARCHIVE.days():
+        idx = ARCHIVE.segment(meta).index()
+        archived.update(idx["user"], idx["merchant"])
+    names = sorted(archived.union(names))
+    users = rng.sample([r[0] for r in con.execute("SELECT id FROM accounts WHERE kind='user'")],
+                       min(samples, con.execute("SELECT COUNT(*) FROM accounts WHERE kind='user'").fetchone()[0]))
+    ymds = [r[0] for r in con.execute("SELECT ymd FROM merkle_frontier ORDER BY ymd")]
+    ymds = rng.sample(ymds, min(samples, len(ymds)))
+    text_q = _time_queries(con, "SELECT * FROM transactions WHERE user_id=? ORDER BY seq DESC LIMIT 50",
+                           "SELECT COUNT(*) FROM transactions WHERE ts >= ? AND ts < ?", users,
+                           [day_bounds(d) for d in ymds])
+    def ledger_rows(cur):
+        # archived days live outside the copy; read them from the segments first
+        yield from ARCHIVE.iter_rows()
+        cur.execute(SQL_LEDGER_AFTER, (ARCHIVE.head()[0],))
+        for rows in iter(lambda: cur.fetchmany(TX_STREAM_BATCH), []):
+            yield from rows
+    t0 = time.perf_counter()
+    text_rows = 0
+    for tid, seq, ts, ttype, uid, mid, amount, prev_hash, thash, note in ledger_rows(con.cursor()):
+        hash_tx({"ts": ts, "ttype": ttype, "user_id": uid, "merchant_id": mid, "amount": amount, "note": note}, prev_hash)
+        text_rows += 1
+    text_scan_s = time.perf_counter() - t0
+
+    con.execute("BEGIN")
+    for stmt in COMPACT_SCHEMA.split(";"):
+        if stmt.strip():
+            con.execute(stmt)
+    con.executemany("INSERT INTO ledger_keys(name) VALUES(?)", [(n,) for n in names])
+    keys = dict(con.execute("SELECT name, key FROM ledger_keys").fetchall())
+    read = con.cursor()
+    source = ledger_rows(read)
+    prev, fallback_ts = None, 0
+    for rows in iter(lambda: list(itertools.islice(source, TX_STREAM_BATCH)), []):
+        out = []
+        for tid, seq, ts, ttype, uid, mid, amount, prev_hash, thash, note in rows:
+            if prev_hash != prev or tid != thash[:16]:
+                con.execute("ROLLBACK")
+                con.close()
+                os.remove(dst)
+                raise ValueError(f"chain link broken at seq {seq}; run 'verify --full' first")
+            us, ts_text = _compact_ts(ts)
+            fallback_ts += ts_text is not None
+            out.append((seq, us, TTYPE_CODES[ttype], keys.get(uid), keys.get(mid), amount, bytes.fromhex(thash), note, ts_text))
+            prev = thash
+        con.executemany("INSERT INTO ctransactions VALUES(?,?,?,?,?,?,?,?,?)", out)
+    read.close()
+    con.execute("DROP TABLE transactions")
+    con.execute("COMMIT")
+    con.execute("VACUUM")
+    compact_bytes = os.path.getsize(dst)
+
+    names_by_key = {v: k for k, v in keys.items()}
+    t0 = time.perf_counter()
+    prev, rows_ok, first_break = None, 0, None
+    for seq, us, tt, uk, mk, amount, th, note, ts_text in con.execute("SELECT * FROM ctransactions ORDER BY seq"):
+        thash = th.hex()
+        if tx_hash(ts_text or micros_ts(us), TTYPE_NAMES[tt], names_by_key.get(uk), names_by_key.get(mk), amount, note, prev) != thash:
+            first_break = seq
+            break
+        prev = thash
+        rows_ok += 1
+    compact_scan_s = time.perf_counter() - t0
+    ukeys = [keys[u] for u in users]
+    compact_q = _time_queries(con, "SELECT * FROM ctransactions WHERE user_key=? ORDER BY seq DESC LIMIT 50",
+                              "SELECT COUNT(*) FROM ctransactions WHERE ts_us >= ? AND ts_us < ?", ukeys,
+                              [tuple(ts_micros(b) for b in day_bounds(d)) for d in ymds])
     con.close()
-    return {"alerts": [{"ts":r[0],"type":r[1],"merchant_id":r[2],"user_id":r[3],"detail":r[4]} for r in rows]}
+    return {"ok": first_break is None and rows_ok == text_rows,
+            "dst": os.path.abspath(dst), "rows": text_rows, "verified_rows": rows_ok, "first_break_seq": first_break,
+            "ts_kept_as_text": fallback_ts,
+            "size": {"text_bytes": text_bytes, "compact_bytes": compact_bytes,
+                     "ratio": compact_bytes / text_bytes if text_bytes else None},
+            "speed": {"text": dict(text_q, scan_and_hash_rows_per_s=text_rows / text_scan_s if text_scan_s else None),
+                      "compact": dict(compact_q, scan_and_hash_rows_per_s=rows_ok / compact_scan_s if compact_scan_s else None)}}
+
+# ---------- Ledger verification ----------
+def verify_chunk(rows: List[tuple]) -> Optional[dict]:
+    # Runs in a worker process: recompute every hash and check the links inside the chunk.
+    # The link into the chunk's first row is checked by the caller, which knows the previous chunk.
+    prev = None
+    for tid, seq, ts, ttype, uid, mid, amount, prev_hash, thash, note in rows:
+        if prev is not None:
+            if seq != prev[0] + 1:
+                return {"seq": seq, "id": tid, "reason": f"seq gap after {prev[0]}"}
+            if prev_hash != prev[1]:
+                return {"seq": seq, "id": tid, "reason": "prev_hash does not match previous thash"}
+        if tx_hash(ts, ttype, uid, mid, amount, note, prev_hash) != thash:
+            return {"seq": seq, "id": tid, "reason": "thash does not match payload"}
+        if tid != thash[:16]:
+            return {"seq": seq, "id": tid, "reason": "id is not the thash prefix"}
+        prev = (seq, thash)
+    return None
+
+class LedgerVerifier:
+    # Streams the ledger in seq order from the last verified checkpoint, fans fixed-size chunks out
+    # to a process pool (at most 2 chunks per worker in flight, so memory stays bounded), and
+    # checks each chunk boundary here. The checkpoint advances to the last row known good.
+    def __init__(self, chunk_size: int = VERIFY_CHUNK_SIZE, workers: int = VERIFY_WORKERS):
+        self.chunk_size = max(1, chunk_size)
+        self.workers = max(0, workers)
+        self._lock = threading.Lock()
+
+    def run(self, full: bool = False) -> dict:
+        if not self._lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="Verification already running")
+        try:
+            return self._run(full)
+        finally:
+            self._lock.release()
+
+    def _run(self, full: bool) -> dict:
+        t0 = time.perf_counter()
+        with POOL.read() as cur:
+            cp = None if full else cur.execute(
+                "SELECT seq, thash FROM verify_checkpoints ORDER BY seq DESC LIMIT 1").fetchone()
+        start_seq, start_hash = cp if cp else (0, None)
+        good_seq, good_hash = start_seq, start_hash
+        rows_checked, first_break = 0, None
+        executor = process_pool(self.workers) if self.workers else None
+        try:
+            pending = []  # (future-or-result, first row, last row) in chunk order
+            def settle(entry):
+                nonlocal good_seq, good_hash, rows_checked, first_break
+                res, first, last, n = entry
+                res = res.result() if isinstance(res, concurrent.futures.Future) else res
+                if first_break is not None:
+                    return
+                if first[1] != good_seq + 1:
+                    first_break = {"seq": first[1], "id": first[0], "reason": f"seq gap after {good_seq}"}
+                elif first[7] != good_hash:
+                    first_break = {"seq": first[1], "id": first[0], "reason": "prev_hash does not match previous thash"}
+                elif res is not None:
+                    first_break = res
+                if first_break is None:
+                    good_seq, good_hash = last[1], last[8]
+                    rows_checked += n
+            with POOL.stream() as cur:
+                source = iter_ledger(cur, start_seq)  # archived segments first, then the live table
+                while first_break is None:
+                    rows = list(itertools.islice(source, self.chunk_size))
+                    if not rows:
+                        break
+                    res = executor.submit(verify_chunk, rows) if executor else verify_chunk(rows)
+                    pending.append((res, rows[0], rows[-1], len(rows)))
+                    while len(pending) > max(1, 2 * self.workers):
+                        settle(pending.pop(0))
+            for entry in pending:
+                settle(entry)
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+        if first_break is not None:
+            # rows before the break that were verified in the broken chunk still count as good
+            with POOL.read() as cur:
+                r = cur.execute("SELECT seq, thash FROM transactions WHERE seq = ?", (first_break["seq"] - 1,)).fetchone()
+            if not r:
+                r = ARCHIVE.get_seq(first_break["seq"] - 1)
+                r = r and (r[1], r[8])
+            if r and r[0] > good_seq:
+                rows_checked += r[0] - good_seq
+                good_seq, good_hash = r
+        elapsed = time.perf_counter() - t0
+        if good_seq > start_seq:
+            with POOL.write() as cur:
+                cur.execute("INSERT OR REPLACE INTO verify_checkpoints(seq, thash, verified_at, rows, elapsed_s) VALUES(?,?,?,?,?)",
+                            (good_seq, good_hash, datetime.datetime.utcnow().isoformat(), rows_checked, elapsed))
+        return {"ok": first_break is None, "from_seq": start_seq + 1, "verified_to_seq": good_seq,
+                "rows": rows_checked, "elapsed_s": elapsed,
+                "rows_per_s": rows_checked / elapsed if elapsed > 0 else None,
+                "first_break": first_break}
+
+VERIFIER = LedgerVerifier()
+
+@app.post("/admin/verify")
+def admin_verify(full: bool = False, authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    return VERIFIER.run(full=full)
+
+def alerts_query(atype: Optional[str], merchant_id: Optional[str], since: Optional[str], until: Optional[str],
+                 limit: int) -> Tuple[str, list]:
+    # newest first; ts is when an alert's dedup window opened
+    where, args = [], []
+    for clause, val in (("atype = ?", atype), ("merchant_id = ?", merchant_id), ("ts >= ?", since), ("ts < ?", until)):
+        if val:
+            where.append(clause); args.append(val)
+    sql = ("SELECT ts, atype, merchant_id, user_id, detail, count, last_ts FROM alerts"
+           + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY ts DESC LIMIT ?")
+    return sql, args + [limit]
+
+@app.get("/admin/alerts")
+def list_alerts(limit: int = 50, atype: Optional[str] = Query(None, alias="type"), merchant_id: Optional[str] = None,
+                since: Optional[str] = None, until: Optional[str] = None, authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    ALERTS.flush()  # include what this process still has queued
+    sql, args = alerts_query(atype, merchant_id, since, until, max(1, min(limit, TX_PAGE_MAX)))
+    with POOL.read() as cur:
+        rows = cur.execute(sql, args).fetchall()
+    return {"alerts": [{"ts":r[0],"type":r[1],"merchant_id":r[2],"user_id":r[3],"detail":r[4],"count":r[5],
+                        "last_ts":r[6] or r[0]} for r in rows]}
+
+@app.get("/admin/db/stats")
+def db_stats(authorization: Optional[str] = Header(None)):
+    require_auth(authorization, roles=["admin"])
+    return {"pool": POOL.stats(), "ledger_writer": LEDGER.stats(), "auth_cache": TOKENS.stats(), "qr": QR.stats(),
+            "balance_cache": BALANCES.stats(), "archive": ARCHIVE.stats(), "balance_snapshots": SNAPSHOTS.stats(),
+            "config": CONFIG.stats(), "alerts": ALERTS.stats(), "events": HUB.stats()}
+
+def metrics_gauges() -> Dict[str, Dict[tuple, float]]:
+    # Existing component stats, flattened: numeric fields become boro_<component>_<field>, and a
+    # dict of numbers (e.g. the batch size histogram) becomes one series per key.
+    comps = {"pool": POOL.stats(), "ledger_writer": LEDGER.stats(), "limiter": LIMITER.stats(),
+             "auth_cache": TOKENS.stats(), "balance_cache": BALANCES.stats(), "qr": QR.stats(),
+             "archive": ARCHIVE.stats(), "balance_snapshots": SNAPSHOTS.stats(), "config": CONFIG.stats(),
+             "alerts": ALERTS.stats(), "events": HUB.stats()}
+    gauges: Dict[str, Dict[tuple, float]] = {}
+    for comp, st in comps.items():
+        for k, v in st.items():
+            name = f"boro_{comp}_{k}"
+            if isinstance(v, bool) or v is None:
+                continue
+            if isinstance(v, (int, float)):
+                gauges[name] = {(): v}
+            elif isinstance(v, dict):
+                gauges[name] = {(("key", kk),): vv for kk, vv in v.items() if isinstance(vv, (int, float))}
+    gauges["boro_chain_head_seq"] = {(): CHAIN.seq}
+    return gauges
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(authorization: Optional[str] = Header(None)):
+    # Open by default for scrapers; set METRICS_TOKEN to require "Authorization: Bearer <token>".
+    if METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(METRICS.render(metrics_gauges()), media_type="text/plain; version=0.0.4")
+
+if __name__ == "__main__":
+    import sys
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "migrate":
+        con = db(); print({"applied": migrate(con), "version": schema_version(con.cursor())}); con.close()
+    elif cmd == "rebuild-lots":
+        init_db()
+        with POOL.write() as cur:
+            n = rebuild_lots(cur)
+        POOL.close_all()
+        print(f"rebuilt {n} lots")
+    elif cmd == "rebuild-rollups":
+        init_db()
+        with POOL.write() as cur:
+            n = rebuild_rollups(cur)
+        POOL.close_all()
+        print(f"rebuilt {n} merchant-day rollups")
+    elif cmd == "check-balances":
+        init_db()
+        report = check_balances(full="--full" in sys.argv[2:])
+        POOL.close_all()
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] else 1)
+    elif cmd == "repair-balances":
+        init_db()
+        report = repair_balances(full="--full" in sys.argv[2:])
+        ALERTS.flush()
+        POOL.close_all()
+        print(json.dumps(report, indent=2))
+    elif cmd == "snapshot-balances":
+        init_db()
+        report = SNAPSHOTS.take()
+        POOL.close_all()
+        print(json.dumps(report, indent=2))
+    elif cmd == "compact":
+        # python app.py compact <dst.db>: converted copy of DB_PATH plus a size/speed report
+        if len(sys.argv) < 3:
+            print("usage: python app.py compact <dst.db>"); sys.exit(2)
+        init_db()  # loads the archive index, archived days are part of the converted ledger
+        report = compact_ledger(sys.argv[2])
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] else 1)
+    elif cmd == "archive":
+        # python app.py archive [max_days]: move old anchored days into segment files
+        init_db()
+        report = archive_days(max_days=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        POOL.close_all()
+        print(json.dumps(report, indent=2))
+    elif cmd == "verify":
+        init_db()
+        report = VERIFIER.run(full="--full" in sys.argv[2:])
+        POOL.close_all()
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] else 1)
+    elif cmd == "bench-auth":
+        # per-request auth overhead: full HMAC verification vs a warm token cache
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+        header = "Bearer " + issue_token("merchant1", "merchant", "Bench Merchant")
+        results = {}
+        for label, size in (("uncached", 0), ("cached", AUTH_CACHE_SIZE)):
+            TOKENS = TokenCache(size=size)
+            t0 = time.perf_counter()
+            for _ in range(n):
+                require_auth(header, roles=["merchant"])
+            results[label] = {"us_per_request": (time.perf_counter() - t0) / n * 1e6, "cache": TOKENS.stats()}
+        results["speedup"] = results["uncached"]["us_per_request"] / results["cached"]["us_per_request"]
+        print(json.dumps(results, indent=2))
+    else:
+        print("usage: python app.py [migrate|rebuild-lots|rebuild-rollups|verify [--full]|check-balances [--full]|repair-balances [--full]|snapshot-balances|compact <dst>|archive [max_days]|bench-auth [n]]")
+        sys.exit(2)
@@ -0,0 +1,37 @@
+"""Synthetic-ledger generator and load drivers for the rewards API.
+
+Run from the backend/ directory:
+
+    python -m bench generate --db /tmp/bench-1m.db --transactions 1m
+    python -m bench run --db /tmp/bench-1m.db --mode both --out results.json
+    python -m bench compare old.json new.json
+
+`run` writes to the ledger (earn/redeem/expire), so benchmark a freshly generated file.
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+def parse_count(value: str) -> int:
+    v = value.strip().lower()
+    if v in SIZES:
+        return SIZES[v]
+    if v[-1:] in ("k", "m"):
+        return int(float(v[:-1]) * (1_000 if v[-1] == "k" else 1_000_000))
+    return int(v)
+
+def load_app(db_path: str, **env):
+    # app reads DB_PATH and its tuning knobs at import time, so they are set first;
+    # one process can only ever host one benchmark database.
+    os.environ["DB_PATH"] = os.path.abspath(db_path)
+    for k, v in env.items():
+        os.environ[k] = str(v)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import app
+    if os.path.abspath(app.DB_PATH) != os.path.abspath(db_path):
+        raise RuntimeError(f"app already loaded against {app.DB_PATH}")
+    return app
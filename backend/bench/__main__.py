@@ -0,0 +1,107 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+from . import parse_count
+from .drivers import InProcessClient, ledger_profile, run_all, uvicorn_server
+from .synth import generate
+
+def cmd_generate(args):
+    if args.force:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    def progress(done, total, rate):
+        if done == total or done % (args.batch * 20) == 0:
+            print(f"  {done}/{total} rows, {rate:.0f} rows/s", file=sys.stderr)
+    summary = generate(args.db, parse_count(args.transactions), users=args.users, merchants=args.merchants,
+                       days=args.days, redeem_ratio=args.redeem_ratio, issue_ratio=args.issue_ratio,
+                       expiry_days=args.expiry_days, seed=args.seed, batch=args.batch, progress=progress)
+    print(json.dumps(summary, indent=2))
+
+def cmd_run(args):
+    profile = ledger_profile(args.db)
+    only = args.endpoints.split(",") if args.endpoints else None
+    report = {"meta": {"started_at": datetime.datetime.utcnow().isoformat(), "db": os.path.abspath(args.db),
+                       "transactions": profile["transactions"], "users": profile["users"],
+                       "merchants": profile["merchants"], "requests": args.requests, "heavy_requests": args.heavy,
+                       "concurrency": args.concurrency, "python": platform.python_version(),
+                       "platform": platform.platform(), "cpus": os.cpu_count()},
+              "results": {}}
+    modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        print(f"{mode}:", file=sys.stderr)
+        log = lambda line: print(line, file=sys.stderr)
+        if mode == "inprocess":
+            with InProcessClient(args.db) as client:
+                report["results"][mode] = run_all(client, profile, args.requests, args.concurrency, args.heavy, only, log)
+        else:
+            with uvicorn_server(args.db, args.port, args.workers) as client:
+                report["results"][mode] = run_all(client, profile, args.requests, args.concurrency, args.heavy, only, log)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+def cmd_compare(args):
+    # Flags every endpoint whose p95 grew by more than --threshold between two result files.
+    old, new = (json.load(open(p)) for p in (args.old, args.new))
+    regressions = 0
+    for mode, results in new["results"].items():
+        for name, res in results.items():
+            base = old["results"].get(mode, {}).get(name)
+            if not base or not base.get("p95_ms") or res.get("p95_ms") is None:
+                continue
+            ratio = res["p95_ms"] / base["p95_ms"]
+            flag = "REGRESSION" if ratio > args.threshold else ""
+            regressions += bool(flag)
+            print(f"{mode:<10} {name:<15} p95 {base['p95_ms']:8.1f} -> {res['p95_ms']:8.1f} ms  x{ratio:4.2f}  "
+                  f"rps {base['throughput_rps']:7.0f} -> {res['throughput_rps']:7.0f}  {flag}")
+    sys.exit(1 if regressions else 0)
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="python -m bench")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("generate", help="write a synthetic ledger into a new DB file")
+    g.add_argument("--db", required=True)
+    g.add_argument("--transactions", default="10k", help="row count, or 10k / 1m / 10m")
+    g.add_argument("--users", type=int, default=10_000)
+    g.add_argument("--merchants", type=int, default=50)
+    g.add_argument("--days", type=int, default=90)
+    g.add_argument("--redeem-ratio", type=float, default=0.3)
+    g.add_argument("--issue-ratio", type=float, default=0.01)
+    g.add_argument("--expiry-days", type=int, default=60, help="expiry_days setting used by expire_run")
+    g.add_argument("--seed", type=int, default=1)
+    g.add_argument("--batch", type=int, default=5000)
+    g.add_argument("--force", action="store_true", help="replace an existing DB file")
+    g.set_defaults(fn=cmd_generate)
+
+    r = sub.add_parser("run", help="drive the API against a generated DB and report latency percentiles")
+    r.add_argument("--db", required=True)
+    r.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="inprocess")
+    r.add_argument("--requests", type=int, default=2000, help="requests per light endpoint")
+    r.add_argument("--heavy", type=int, default=5, help="requests for settlement_csv and expire_run")
+    r.add_argument("--concurrency", type=int, default=16)
+    r.add_argument("--endpoints", help="comma-separated subset, e.g. earn,balance")
+    r.add_argument("--port", type=int, default=8765)
+    r.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    r.add_argument("--out", help="write the JSON report here instead of stdout")
+    r.set_defaults(fn=cmd_run)
+
+    c = sub.add_parser("compare", help="compare two run reports")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=1.2, help="p95 ratio that counts as a regression")
+    c.set_defaults(fn=cmd_compare)
+
+    args = p.parse_args(argv)
+    args.fn(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import http.client
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from . import BACKEND_DIR, load_app
+
+# ---------- Clients ----------
+class InProcessClient:
+    # Drives the ASGI app through Starlette's TestClient (needs httpx), startup hooks included.
+    def __init__(self, db_path: str):
+        try:
+            from fastapi.testclient import TestClient
+        except Exception as e:
+            raise RuntimeError("in-process mode needs httpx installed") from e
+        self._client = TestClient(load_app(db_path).app)
+
+    def __enter__(self):
+        self._client.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._client.__exit__(*exc)
+
+    def request(self, method: str, path: str, body: Optional[dict] = None, headers: Optional[dict] = None) -> Tuple[int, bytes]:
+        r = self._client.request(method, path, json=body, headers=headers)
+        return r.status_code, r.content
+
+class HttpClient:
+    # One keep-alive connection per client thread against a real server.
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def request(self, method: str, path: str, body: Optional[dict] = None, headers: Optional[dict] = None) -> Tuple[int, bytes]:
+        hdrs = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            hdrs["Content-Type"] = "application/json"
+        for attempt in (0, 1):
+            con = getattr(self._local, "con", None)
+            if con is None:
+                con = self._local.con = http.client.HTTPConnection(self.host, self.port, timeout=600)
+            try:
+                con.request(method, path, body=data, headers=hdrs)
+                r = con.getresponse()
+                return r.status, r.read()
+            except (http.client.HTTPException, ConnectionError):
+                con.close()
+                self._local.con = None
+                if attempt:
+                    raise
+
+@contextmanager
+def uvicorn_server(db_path: str, port: int, workers: int = 1):
+    env = dict(os.environ, DB_PATH=os.path.abspath(db_path))
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"], cwd=BACKEND_DIR, env=env)
+    try:
+        deadline = time.time() + 120
+        while True:
+            try:
+                con = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+                con.request("GET", "/")
+                con.getresponse().read()
+                con.close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("uvicorn did not start")
+                time.sleep(0.2)
+        yield HttpClient("127.0.0.1", port)
+    finally:
+        proc.terminate()
+        proc.wait(30)
+
+# ---------- Scenarios ----------
+def percentile(sorted_ms: List[float], p: float) -> Optional[float]:
+    # nearest-rank
+    if not sorted_ms:
+        return None
+    k = max(0, min(len(sorted_ms) - 1, int(round(p / 100 * len(sorted_ms) + 0.5)) - 1))
+    return sorted_ms[k]
+
+def ledger_profile(db_path: str, sample: int = 2000, seed: int = 1) -> dict:
+    con = sqlite3.connect(db_path)
+    try:
+        rng = random.Random(seed)
+        users = [r[0] for r in con.execute("SELECT id FROM accounts WHERE kind='user'")]
+        merchants = [r[0] for r in con.execute("SELECT id FROM merchants ORDER BY id")]
+        head = con.execute("SELECT seq FROM transactions ORDER BY seq DESC LIMIT 1").fetchone()
+        first = con.execute("SELECT ts FROM transactions ORDER BY seq LIMIT 1").fetchone()
+        last = con.execute("SELECT ts FROM transactions ORDER BY seq DESC LIMIT 1").fetchone()
+        days = [r[0] for r in con.execute("SELECT ymd FROM merkle_frontier ORDER BY ymd")]
+    finally:
+        con.close()
+    return {"transactions": head[0] if head else 0, "users": len(users), "merchants": len(merchants),
+            "user_sample": rng.sample(users, min(sample, len(users))), "merchant_ids": merchants[:16],
+            "first_day": first[0][:10] if first else None, "last_day": last[0][:10] if last else None, "days": days}
+
+def scenarios(profile: dict, admin: dict, merchant_tokens: List[dict], heavy: int) -> List[tuple]:
+    # (name, request count or None for the default, concurrency cap, request factory); read-only
+    # scenarios first, expiry last because it rewrites most balances.
+    users, days = profile["user_sample"], profile["days"] or [None]
+    rng = random.Random(7)
+    def earn(i):
+        return "POST", "/earn", {"user_id": rng.choice(users), "amount": rng.randint(1, 20), "note": "bench"}, rng.choice(merchant_tokens)
+    def redeem(i):
+        return "POST", "/redeem", {"user_id": rng.choice(users), "amount": rng.randint(1, 5), "note": "bench"}, rng.choice(merchant_tokens)
+    def balance(i):
+        return "GET", f"/balance/{rng.choice(users)}", None, admin
+    def transactions(i):
+        return "GET", f"/transactions?user_id={rng.choice(users)}&limit=50", None, admin
+    def anchor(i):
+        day = rng.choice(days)
+        return "GET", "/anchor/daily" + (f"?date={day}" if day else ""), None, admin
+    def settlement(i):
+        return "GET", f"/admin/settlement.csv?date_from={profile['first_day']}&date_to={profile['last_day']}", None, admin
+    def expire(i):
+        return "POST", "/admin/expire/run?wait=true", None, admin
+    return [
+        ("balance", None, None, balance),
+        ("transactions", None, None, transactions),
+        ("anchor_daily", None, None, anchor),
+        ("settlement_csv", heavy, None, settlement),
+        ("earn", None, None, earn),
+        ("redeem", None, None, redeem),
+        ("expire_run", heavy, 1, expire),
+    ]
+
+def run_scenario(client, factory, requests: int, concurrency: int) -> dict:
+    jobs = [factory(i) for i in range(requests)]
+    lat, statuses = [0.0] * requests, {}
+    lock = threading.Lock()
+    def one(i):
+        method, path, body, headers = jobs[i]
+        t0 = time.perf_counter()
+        status, _ = client.request(method, path, body, headers)
+        lat[i] = (time.perf_counter() - t0) * 1000
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        list(ex.map(one, range(requests)))
+    wall = time.perf_counter() - t0
+    lat.sort()
+    return {"requests": requests, "concurrency": concurrency, "statuses": statuses,
+            "errors": sum(n for s, n in statuses.items() if not s.startswith("2")),
+            "wall_s": wall, "throughput_rps": requests / wall if wall else None,
+            "p50_ms": percentile(lat, 50), "p95_ms": percentile(lat, 95), "p99_ms": percentile(lat, 99),
+            "max_ms": lat[-1] if lat else None}
+
+def login(client, identity: str) -> dict:
+    status, body = client.request("POST", "/auth/login", {"identity": identity})
+    if status != 200:
+        raise RuntimeError(f"login {identity} failed: {status} {body[:200]!r}")
+    return {"Authorization": "Bearer " + json.loads(body)["token"]}
+
+def run_all(client, profile: dict, requests: int, concurrency: int, heavy: int,
+            only: Optional[List[str]] = None, log=print) -> Dict[str, dict]:
+    admin = login(client, "admin")
+    merchants = [login(client, m) for m in profile["merchant_ids"]]
+    out = {}
+    for name, n, cap, factory in scenarios(profile, admin, merchants, heavy):
+        if only and name not in only:
+            continue
+        res = run_scenario(client, factory, n or requests, min(concurrency, cap or concurrency))
+        log(f"  {name:<15} p50={res['p50_ms']:.1f}ms p95={res['p95_ms']:.1f}ms p99={res['p99_ms']:.1f}ms "
+            f"{res['throughput_rps']:.0f} req/s statuses={res['statuses']}")
+        out[name] = res
+    return out
@@ -0,0 +1,90 @@
+import datetime
+import os
+import random
+import sqlite3
+import time
+from typing import Callable, Optional
+
+from . import load_app
+
+def user_id(i: int) -> str:
+    return f"u{i:07d}"
+
+def merchant_id(i: int) -> str:
+    return f"m{i:04d}"
+
+def generate(db_path: str, transactions: int, users: int = 10_000, merchants: int = 50, days: int = 90,
+             redeem_ratio: float = 0.3, issue_ratio: float = 0.01, expiry_days: int = 60,
+             seed: int = 1, batch: int = 5000, progress: Optional[Callable] = None) -> dict:
+    # Writes a complete ledger through app.record_tx_rows, so the hash chain, balances, lots,
+    # rollups and Merkle frontiers are exactly what live traffic would have produced.
+    # Users are picked with a long-tailed weight (a few very active, most occasional) and
+    # timestamps are spread evenly over `days` of history ending now.
+    if os.path.exists(db_path):
+        raise FileExistsError(db_path)
+    # snapshots are taken once at the end rather than on a background thread mid-run
+    app = load_app(db_path, DB_SYNCHRONOUS="OFF", BALANCE_SNAPSHOT_EVERY=0)
+    app.init_db()
+    uids = [user_id(i) for i in range(users)]
+    mids = [merchant_id(i) for i in range(merchants)]
+    with app.POOL.write() as cur:
+        cur.execute("INSERT INTO users(id, role, display_name) VALUES('admin', 'admin', 'Program Admin')")
+        cur.executemany("INSERT INTO users(id, role, display_name) VALUES(?, 'user', ?)",
+                        [(u, f"User {u}") for u in uids])
+        # limits high enough that the benchmark measures the service, not the rate limiter
+        cur.executemany("""INSERT INTO merchants(id, display_name, rate_limit_per_minute, daily_earn_cap, daily_redeem_cap)
+                           VALUES(?, ?, 1000000000, 1000000000000, 1000000000000)""",
+                        [(m, f"Merchant {m}") for m in mids])
+        accounts = [(u, "user") for u in uids] + [(m, "merchant") for m in mids] + [("system", "system")]
+        cur.executemany("INSERT INTO accounts(id, kind, balance) VALUES(?, ?, 0)", accounts)
+        app.BALANCES.open_accounts(accounts)
+        cur.execute("UPDATE settings SET value=? WHERE key='expiry_days'", (str(expiry_days),))
+        app.CONFIG.bump(cur)
+
+    rng = random.Random(seed)
+    cum, total = [], 0.0
+    for i in range(users):
+        total += 1.0 / (i + 1) ** 0.8
+        cum.append(total)
+    order = uids[:]
+    rng.shuffle(order)  # activity rank is independent of id order
+    balances = dict.fromkeys(uids, 0)
+    start = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    step_us = days * 86_400_000_000 / max(1, transactions)
+    counts = {"EARN": 0, "REDEEM": 0, "ISSUE": 0}
+    t0 = time.perf_counter()
+    done = 0
+    while done < transactions:
+        n = min(batch, transactions - done)
+        who = rng.choices(order, cum_weights=cum, k=n)
+        rows, seq, prev = [], app.CHAIN.seq, app.CHAIN.thash
+        for k in range(n):
+            i = done + k
+            ts = (start + datetime.timedelta(microseconds=int(i * step_us + rng.random() * step_us * 0.9))).isoformat()
+            uid, r = who[k], rng.random()
+            if r < issue_ratio:
+                ttype, mid, amount = "ISSUE", None, rng.randint(50, 500)
+            elif r < issue_ratio + redeem_ratio and balances[uid] > 0:
+                ttype, mid, amount = "REDEEM", rng.choice(mids), min(balances[uid], rng.randint(5, 100))
+            else:
+                ttype, mid, amount = "EARN", rng.choice(mids), rng.randint(1, 50)
+            balances[uid] += -amount if ttype == "REDEEM" else amount
+            counts[ttype] += 1
+            seq += 1
+            row = app.make_tx_row(seq, ts, ttype, uid, mid, amount, None, prev)
+            prev = row[8]
+            rows.append(row)
+        with app.POOL.write() as cur:
+            app.record_tx_rows(cur, rows)
+        done += n
+        if progress:
+            progress(done, transactions, done / (time.perf_counter() - t0))
+    elapsed = time.perf_counter() - t0
+    app.SNAPSHOTS.take()
+    app.POOL.close_all()
+    con = sqlite3.connect(db_path)
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    con.close()
+    return {"db": os.path.abspath(db_path), "transactions": transactions, "users": users, "merchants": merchants,
+            "days": days, "counts": counts, "elapsed_s": elapsed, "rows_per_s": transactions / elapsed if elapsed else None,
+            "db_bytes": os.path.getsize(db_path)}
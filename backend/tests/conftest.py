@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app reads DB_PATH and its tuning knobs at import time, so the whole session shares one
+# throwaway database chosen before the import.
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="rewards-tests-"), "rewards.db")
+os.environ.setdefault("BALANCE_SNAPSHOT_EVERY", "0")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+def run_other_worker(body: str):
+    # Another worker process: its own pool and caches, same DB file. body runs inside a write.
+    code = "import app\napp.init_db()\nwith app.POOL.write() as cur:\n" + \
+           "".join(f"    {line}\n" for line in body.strip().splitlines()) + "app.ALERTS.stop()\n"
+    subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=dict(os.environ), check=True)
+
+@pytest.fixture(scope="session")
+def app():
+    import app as module
+    module.init_db()
+    module.seed_demo()
+    yield module
+    module.ALERTS.stop()
+    module.QR.close()
+    module.POOL.close_all()
+
+@pytest.fixture
+def cur(app):
+    with app.POOL.read() as c:
+        yield c
@@ -0,0 +1,56 @@
+from conftest import run_other_worker
+
+def other_worker_issue():
+    run_other_worker('app.apply_tx(cur, "ISSUE", "user1", None, 7, "other worker")')
+
+def table_balance(cur, acc):
+    return cur.execute("SELECT balance FROM accounts WHERE id = ?", (acc,)).fetchone()[0]
+
+def test_read_sees_commit_from_another_process(app, cur):
+    before = app.read_balances(["user1"])["user1"]
+    other_worker_issue()
+    assert app.read_balances(["user1"])["user1"] == before + 7
+    assert app.read_balances(["user1"])["user1"] == table_balance(cur, "user1")
+
+def test_own_and_external_writes_interleaved(app, cur):
+    for i in range(3):
+        with app.POOL.write() as w:
+            app.apply_tx(w, "ISSUE", "user1", None, 1, f"local {i}")
+        app.read_balances(["user1"])
+        other_worker_issue()
+    with app.POOL.write() as w:
+        app.apply_tx(w, "ISSUE", "user1", None, 1, "local last")
+    assert app.read_balances(["user1"])["user1"] == table_balance(cur, "user1")
+    assert app.check_balances()["ok"]
+
+def test_foreign_commits_are_applied_incrementally(app, cur):
+    app.read_balances(["user1"])
+    reloads = app.BALANCES.reloads
+    other_worker_issue()
+    assert app.read_balances(["user1"])["user1"] == table_balance(cur, "user1")  # read path
+    other_worker_issue()
+    with app.POOL.write() as w:  # write path, through on_external_change
+        assert app.BALANCES.peek("user1")[1] == w.execute("SELECT balance FROM accounts WHERE id = 'user1'").fetchone()[0]
+    assert app.BALANCES.reloads == reloads
+
+def test_account_opened_by_another_process(app):
+    run_other_worker("""
+cur.execute("INSERT INTO accounts(id, kind, balance) VALUES('bal-new', 'user', 0)")
+app.record_tx_rows(cur, [app.make_tx_row(app.CHAIN.seq + 1, app.datetime.datetime.utcnow().isoformat(), "ISSUE", "bal-new", None, 5, None, app.CHAIN.thash)])
+cur.execute("INSERT INTO accounts(id, kind, balance) VALUES('bal-empty', 'user', 0)")
+""")
+    with app.POOL.write() as w:
+        app.apply_tx(w, "ISSUE", "bal-empty", None, 3, None)  # known to this process's write path
+    assert app.BALANCES.get_many(["bal-new", "bal-empty"]) == {"bal-new": 5, "bal-empty": 3}
+
+def test_repair_in_another_process_reloads(app, cur):
+    app.read_balances(["user1"])
+    reloads = app.BALANCES.reloads
+    run_other_worker("""
+cur.execute("UPDATE accounts SET balance = balance + 1000 WHERE id = 'user2'")
+app.BALANCES.bump(cur)
+""")
+    assert app.read_balances(["user2"])["user2"] == table_balance(cur, "user2")
+    assert app.BALANCES.reloads == reloads + 1
+    assert app.repair_balances()["repaired"] == 1
+    assert app.read_balances(["user2"])["user2"] == table_balance(cur, "user2")
@@ -0,0 +1,109 @@
+import itertools
+
+import pytest
+
+_ids = itertools.count(1)
+
+def new_merchant(app, rate=1000, earn_cap=10**9, redeem_cap=10**9) -> str:
+    mid = f"bm{next(_ids)}"
+    with app.POOL.write() as cur:
+        cur.execute("""INSERT INTO merchants(id, display_name, rate_limit_per_minute, daily_earn_cap, daily_redeem_cap)
+                       VALUES(?,?,?,?,?)""", (mid, f"Batch {mid}", rate, earn_cap, redeem_cap))
+        cur.execute("INSERT INTO accounts(id, kind, balance) VALUES(?, 'merchant', 0)", (mid,))
+        app.BALANCES.open_accounts([(mid, "merchant")])
+        app.CONFIG.bump(cur)
+    return mid
+
+def new_user(app, balance=0) -> str:
+    uid = f"bu{next(_ids)}"
+    with app.POOL.write() as cur:
+        cur.execute("INSERT INTO users(id, role, display_name) VALUES(?, 'user', ?)", (uid, uid))
+        cur.execute("INSERT INTO accounts(id, kind, balance) VALUES(?, 'user', 0)", (uid,))
+        app.BALANCES.open_accounts([(uid, "user")])
+    if balance:
+        with app.POOL.write() as cur:
+            app.apply_tx(cur, "ISSUE", uid, None, balance, "seed")
+    return uid
+
+def batch(app, mid, ops):
+    parsed = [app.parse_batch_op(op, ("EARN", "REDEEM")) for op in ops]
+    with app.POOL.write() as cur:
+        return app.apply_tx_batch(cur, parsed, mid, mid)
+
+def statuses(results):
+    return [r.get("code", r["status"]) for r in results]
+
+def ledger_rows(cur, uid):
+    return cur.execute("SELECT COUNT(*) FROM transactions WHERE user_id = ?", (uid,)).fetchone()[0]
+
+def test_rejected_redeem_does_not_use_cap(app):
+    mid = new_merchant(app, redeem_cap=100)
+    rich, poor = new_user(app, 50), new_user(app, 10)
+    res = batch(app, mid, [{"ttype": "REDEEM", "user_id": poor, "amount": 90},
+                           {"ttype": "REDEEM", "user_id": rich, "amount": 20}])
+    assert statuses(res) == [400, "ok"]
+
+def test_each_op_counts_against_rate(app):
+    mid = new_merchant(app, rate=5)
+    uid = new_user(app)
+    res = batch(app, mid, [{"ttype": "EARN", "user_id": uid, "amount": 1}] * 7)
+    assert statuses(res) == ["ok"] * 5 + [429, 429]
+    with pytest.raises(app.HTTPException) as e:
+        with app.POOL.write() as cur:
+            app.apply_tx(cur, "EARN", uid, mid, 1, None)
+    assert e.value.status_code == 429
+    with pytest.raises(app.HTTPException) as e:
+        batch(app, mid, [{"ttype": "EARN", "user_id": uid, "amount": 1}])
+    assert e.value.status_code == 429
+
+def test_rate_limited_items_use_no_cap(app):
+    mid = new_merchant(app, rate=2, earn_cap=10)
+    uid = new_user(app)
+    res = batch(app, mid, [{"ttype": "EARN", "user_id": uid, "amount": 4}] * 3)
+    assert statuses(res) == ["ok", "ok", 429]
+    assert res[2]["detail"] == "Rate limit exceeded for merchant"
+
+def test_replayed_upload_is_not_applied_twice(app, cur):
+    mid = new_merchant(app)
+    uid = new_user(app, 100)
+    ops = [{"ttype": "EARN", "user_id": uid, "amount": 5, "idempotency_key": "pos-1"},
+           {"ttype": "REDEEM", "user_id": uid, "amount": 30, "idempotency_key": "pos-2"}]
+    first = batch(app, mid, ops)
+    rows, balance = ledger_rows(cur, uid), app.read_balances([uid])[uid]
+    again = batch(app, mid, ops)
+    assert statuses(first) == ["ok", "ok"]
+    assert statuses(again) == ["duplicate", "duplicate"]
+    assert [r["tx"] for r in again] == [r["tx"] for r in first]
+    assert (ledger_rows(cur, uid), app.read_balances([uid])[uid]) == (rows, balance) == (3, 75)
+
+def test_bad_item_in_the_middle(app, cur):
+    mid = new_merchant(app)
+    uid = new_user(app)
+    res = batch(app, mid, [{"ttype": "EARN", "user_id": uid, "amount": 3},
+                           {"ttype": "EARN", "user_id": uid, "amount": "lots"},
+                           {"ttype": "EARN", "user_id": "nobody", "amount": 1},
+                           {"ttype": "EARN", "user_id": uid, "amount": 4}])
+    assert statuses(res) == ["ok", 400, 404, "ok"]
+    assert [r["index"] for r in res] == [0, 1, 2, 3]
+    assert app.read_balances([uid])[uid] == 7
+    seqs = [r[0] for r in cur.execute("SELECT seq FROM transactions WHERE user_id = ? ORDER BY seq", (uid,))]
+    assert seqs == [seqs[0], seqs[0] + 1]  # accepted items are consecutive ledger rows
+
+def test_failed_upload_writes_nothing(app, cur, monkeypatch):
+    mid = new_merchant(app)
+    uid = new_user(app, 10)
+    head = app.CHAIN.seq
+    record = app.record_tx_rows
+    def record_then_fail(c, rows):
+        record(c, rows)
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(app, "record_tx_rows", record_then_fail)
+    with pytest.raises(RuntimeError):
+        batch(app, mid, [{"ttype": "EARN", "user_id": uid, "amount": 5, "idempotency_key": "k1"},
+                         {"ttype": "REDEEM", "user_id": uid, "amount": 5, "idempotency_key": "k2"}])
+    monkeypatch.undo()
+    assert app.CHAIN.seq == head
+    assert ledger_rows(cur, uid) == 1
+    assert app.read_balances([uid])[uid] == 10
+    assert cur.execute("SELECT COUNT(*) FROM idempotency_keys WHERE scope = ?", (mid,)).fetchone()[0] == 0
+    assert statuses(batch(app, mid, [{"ttype": "EARN", "user_id": uid, "amount": 5, "idempotency_key": "k1"}])) == ["ok"]
@@ -0,0 +1,36 @@
+import datetime
+
+SQL_JOB_EXPIRES = "SELECT COUNT(DISTINCT user_id), COALESCE(SUM(amount),0) FROM transactions WHERE ttype='EXPIRE' AND seq > ?"
+
+def new_user(app, uid, issued, ts):
+    with app.POOL.write() as cur:
+        cur.execute("INSERT INTO accounts(id, kind, balance) VALUES(?, 'user', 0)", (uid,))
+        app.BALANCES.open_accounts([(uid, "user")])
+    with app.POOL.write() as cur:
+        app.record_tx_rows(cur, [app.make_tx_row(app.CHAIN.seq + 1, ts, "ISSUE", uid, None, issued, None, app.CHAIN.thash)])
+
+def run_job(app, days):
+    job = app.EXPIRY.start(days)
+    app.EXPIRY.wait()
+    with app.POOL.read() as cur:
+        return app._job_dict(cur, job["id"])
+
+def test_job_counters_match_expire_rows(app):
+    old = (datetime.datetime.utcnow() - datetime.timedelta(days=90)).isoformat()
+    new_user(app, "ex1", 100, old)
+    new_user(app, "ex2", 40, old)
+    with app.POOL.write() as cur:
+        # a balance below the open lots (drifted, as repair_balances would find it): apply_tx clips
+        cur.execute("UPDATE accounts SET balance = 30 WHERE id = 'ex1'")
+        app.BALANCES.bump(cur)
+        app.BALANCES.overwrite({"ex1": 30})
+    head = app.CHAIN.seq
+    job = run_job(app, 30)
+    assert job["status"] == "done"
+    with app.POOL.read() as cur:
+        users, points = cur.execute(SQL_JOB_EXPIRES, (head,)).fetchone()
+        amounts = dict(cur.execute("SELECT user_id, amount FROM transactions WHERE ttype='EXPIRE' AND seq > ?", (head,)))
+    assert amounts["ex1"] == 30 and amounts["ex2"] == 40
+    assert (job["users_expired"], job["points_expired"]) == (users, points)
+    assert app.read_balances(["ex1", "ex2"]) == {"ex1": 0, "ex2": 0}
+    assert app.repair_balances()["repaired"] == 1  # put ex1 back in line with its ledger
@@ -0,0 +1,83 @@
+import datetime
+import json
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+
+USER, OTHER, MERCHANT = "hu1", "hu2", "hm1"
+
+@pytest.fixture(scope="module")
+def client(app):
+    with app.POOL.write() as cur:
+        accounts = [(USER, "user"), (OTHER, "user"), (MERCHANT, "merchant")]
+        cur.executemany("INSERT OR IGNORE INTO accounts(id, kind, balance) VALUES(?,?,0)", accounts)
+        app.BALANCES.open_accounts(accounts)
+    # Several rows per commit share one ts (as batch uploads do), so ts never orders them.
+    rng = random.Random(11)
+    ts = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+    for _ in range(40):
+        ts += datetime.timedelta(seconds=rng.choice([0, 1, 30]))
+        rows, seq, prev = [], app.CHAIN.seq, app.CHAIN.thash
+        for _ in range(rng.choice([1, 3, 6])):
+            seq += 1
+            row = app.make_tx_row(seq, ts.isoformat(), rng.choice(["EARN", "REDEEM", "ISSUE"]), rng.choice([USER, OTHER]),
+                                  MERCHANT, rng.randrange(1, 20), None, prev)
+            rows.append(row)
+            prev = row[8]
+        with app.POOL.write() as cur:
+            app.record_tx_rows(cur, rows)
+    c = TestClient(app.app)
+    c.headers["Authorization"] = "Bearer " + app.issue_token("admin", "admin", "Admin")
+    return c
+
+def full_query(cur, app, order, user_id=None, merchant_id=None, ttype=None, since=None, until=None):
+    sql = f"SELECT {app.TX_COLUMNS} FROM transactions WHERE merchant_id = ?"
+    params = [merchant_id or MERCHANT]
+    for col, val in (("user_id", user_id), ("ttype", ttype)):
+        if val:
+            sql += f" AND {col} = ?"; params.append(val)
+    if since:
+        sql += " AND ts >= ?"; params.append(since)
+    if until:
+        sql += " AND ts < ?"; params.append(until)
+    return [app.tx_dict(r) for r in cur.execute(sql + f" ORDER BY seq {order.upper()}", params)]
+
+def tied_ts(cur):
+    # a ts shared by several rows, so since/until fall inside a run of equal timestamps
+    ties = cur.execute("SELECT ts FROM transactions WHERE merchant_id = ? GROUP BY ts HAVING COUNT(*) > 2 ORDER BY ts",
+                       (MERCHANT,)).fetchall()
+    return ties[len(ties) // 2][0]
+
+def filter_sets(cur):
+    tie = tied_ts(cur)
+    return [{}, {"user_id": USER}, {"ttype": "REDEEM"}, {"user_id": OTHER, "ttype": "EARN"},
+            {"since": tie}, {"until": tie}, {"since": tie, "until": tie + "1"}]
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_pages_match_full_query(app, client, cur, order):
+    for filters in filter_sets(cur):
+        params = {"merchant_id": MERCHANT, "order": order, "limit": 7, **filters}
+        want = full_query(cur, app, order, **filters)
+        got, cursor = [], None
+        while True:
+            body = client.get("/transactions", params={**params, **({"cursor": cursor} if cursor else {})}).json()
+            got += body["transactions"]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        assert got == want, filters
+        assert want
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_ndjson_matches_full_query(app, client, cur, order):
+    for filters in filter_sets(cur):
+        want = full_query(cur, app, order, **filters)
+        res = client.get("/transactions", params={"merchant_id": MERCHANT, "order": order, "format": "ndjson", **filters})
+        assert res.headers["content-type"] == "application/x-ndjson"
+        assert [json.loads(line) for line in res.text.splitlines()] == want, filters
+        # resuming an export from a cursor in the middle of a run of equal ts
+        mid = want[len(want) // 2]["seq"]
+        res = client.get("/transactions", params={"merchant_id": MERCHANT, "order": order, "format": "ndjson",
+                                                  "cursor": mid, **filters})
+        assert [json.loads(line) for line in res.text.splitlines()] == want[len(want) // 2 + 1:], filters
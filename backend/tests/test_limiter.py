@@ -0,0 +1,103 @@
+import datetime
+import random
+
+import pytest
+
+from conftest import run_other_worker
+
+# The queries LIMITER replaced on the write path; they stay here as the reference it must match.
+SQL_MERCHANT_RATE = "SELECT COUNT(*) FROM transactions WHERE merchant_id = ? AND ts >= ?"
+SQL_MERCHANT_DAY_SUM = """
+    SELECT COALESCE(SUM(amount),0) FROM transactions
+    WHERE merchant_id = ? AND ttype = ? AND ts >= ? AND ts < ?
+"""
+SQL_RAPID_REDEEMS = """
+    SELECT COUNT(*) FROM transactions
+    WHERE ttype='REDEEM' AND user_id=? AND merchant_id=? AND ts >= ?
+"""
+
+MERCHANTS, USERS = ["lm1", "lm2", "lm3"], ["lu1", "lu2", "lu3", "lu4"]
+
+@pytest.fixture
+def limiter_accounts(app):
+    # ids of their own, so the rows the rest of the session writes never land in these windows
+    with app.POOL.write() as cur:
+        accounts = [(m, "merchant") for m in MERCHANTS] + [(u, "user") for u in USERS]
+        cur.executemany("INSERT OR IGNORE INTO accounts(id, kind, balance) VALUES(?,?,0)", accounts)
+        app.BALANCES.open_accounts(accounts)
+    yield
+    with app.POOL.write() as cur:
+        app.LIMITER.rebuild(cur)  # back to wall-clock windows for later tests
+
+def test_limiter_matches_sql(app, limiter_accounts):
+    # Random EARN/REDEEM traffic (bursts, gaps, a UTC midnight, rollbacks) is recorded through
+    # record_tx_rows while the reference SQL queries run against the same ledger.
+    rng = random.Random(7)
+    now = datetime.datetime(2024, 3, 1, 23, 58, 30)
+    with app.POOL.write() as cur:
+        app.LIMITER.rebuild(cur, now)
+    mismatches = []
+    for step in range(2000):
+        now += datetime.timedelta(microseconds=rng.choice([0, 1, 999_999, 1_000_000]) + rng.randrange(0, 3_000_000))
+        rows, seq, prev = [], app.CHAIN.seq, app.CHAIN.thash
+        for _ in range(rng.choice([1, 1, 1, 2, 5])):
+            seq += 1
+            row = app.make_tx_row(seq, now.isoformat(), rng.choice(["EARN", "REDEEM", "REDEEM"]), rng.choice(USERS),
+                                  rng.choice(MERCHANTS), rng.randrange(1, 50), None, prev)
+            rows.append(row)
+            prev = row[8]
+        try:
+            with app.POOL.write() as cur:
+                app.record_tx_rows(cur, rows)
+                if rng.random() < 0.1:
+                    raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+        probe = now + datetime.timedelta(microseconds=rng.randrange(0, 2_000_000))
+        since_dt = probe - datetime.timedelta(seconds=60)
+        since, since_us, ymd = since_dt.isoformat(), app.dt_micros(since_dt), probe.strftime("%Y-%m-%d")
+        day_start, day_end = app.day_bounds(ymd)
+        with app.POOL.read() as cur:
+            for mid in MERCHANTS:
+                want = cur.execute(SQL_MERCHANT_RATE, (mid, since)).fetchone()[0]
+                got = app.LIMITER.rate_count(mid, since_us)
+                if want != got:
+                    mismatches.append(f"step {step} rate {mid}: sql={want} mem={got}")
+                for ttype in app.CAP_RULES:
+                    want = cur.execute(SQL_MERCHANT_DAY_SUM, (mid, ttype, day_start, day_end)).fetchone()[0]
+                    got = app.LIMITER.day_total(mid, ttype, ymd)
+                    if want != got:
+                        mismatches.append(f"step {step} daily {mid}/{ttype}: sql={want} mem={got}")
+                for uid in USERS:
+                    want = cur.execute(SQL_RAPID_REDEEMS, (uid, mid, since)).fetchone()[0]
+                    got = app.LIMITER.redeem_count(uid, mid, since_us)
+                    if want != got:
+                        mismatches.append(f"step {step} redeems {uid}/{mid}: sql={want} mem={got}")
+    assert not mismatches, mismatches[:20]
+
+def test_foreign_commits_are_applied_incrementally(app, limiter_accounts, monkeypatch):
+    with app.POOL.write() as cur:
+        app.LIMITER.rebuild(cur)
+        app.apply_tx(cur, "ISSUE", "user2", None, 100, None)
+    run_other_worker("""
+for i in range(3):
+    app.apply_tx(cur, "EARN", "user2", "lm1", 5, None)
+app.apply_tx(cur, "REDEEM", "user2", "lm1", 7, None)
+""")
+    def no_rebuild(*a, **k):
+        raise AssertionError("full limiter rebuild after a foreign commit")
+    monkeypatch.setattr(app.LIMITER, "rebuild", no_rebuild)
+    with app.POOL.write() as cur:
+        app.apply_tx(cur, "EARN", "user1", "lm1", 1, None)  # this write notices the other process
+    now = datetime.datetime.utcnow()
+    since = now - datetime.timedelta(seconds=60)
+    ymd = now.strftime("%Y-%m-%d")
+    day_start, day_end = app.day_bounds(ymd)
+    with app.POOL.read() as cur:
+        assert app.LIMITER.rate_count("lm1", app.dt_micros(since)) == \
+            cur.execute(SQL_MERCHANT_RATE, ("lm1", since.isoformat())).fetchone()[0] == 5
+        for ttype, want in (("EARN", 16), ("REDEEM", 7)):
+            assert app.LIMITER.day_total("lm1", ttype, ymd) == \
+                cur.execute(SQL_MERCHANT_DAY_SUM, ("lm1", ttype, day_start, day_end)).fetchone()[0] == want
+        assert app.LIMITER.redeem_count("user2", "lm1", app.dt_micros(since)) == 1
+    assert app.LIMITER.seq == app.CHAIN.seq
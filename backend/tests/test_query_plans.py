@@ -0,0 +1,53 @@
+# Every query on the EARN/REDEEM/anchor/settlement/expiry paths, with representative params.
+# A plan step like "SCAN transactions" / "SCAN lots" walks the whole table; SEARCH ... USING INDEX
+# is fine, and so is an ordered index walk cut short by LIMIT (the chain head lookup).
+GUARDED_TABLES = ("transactions", "lots", "merchant_daily_rollup", "alerts")
+
+def hot_queries(app) -> dict:
+    return {
+        "chain_head": (app.SQL_CHAIN_HEAD, ()),
+        "login": (app.SQL_LOGIN_IDENTITY, ("user1", "user1")),
+        "limiter.rebuild_recent": (app.SQL_LIMITER_RECENT, ("2000-01-01T00:00:00",)),
+        "limiter.rebuild_day": (app.SQL_LIMITER_DAY, ("2000-01-01", "2000-01-02")),
+        "anchor_proof.day_hashes": (app.SQL_DAY_HASHES, ("2000-01-01", "2000-01-02")),
+        "transactions.user_page": app.tx_history_query("user1", None, None, None, None, 100, "desc", 50),
+        "transactions.merchant_page": app.tx_history_query(None, "merchant1", "REDEEM", None, None, 100, "desc", 50),
+        "ledger.after_seq": (app.SQL_LEDGER_AFTER, (100,)),
+        "archive.oldest_live": (app.SQL_OLDEST_LIVE, ()),
+        "balances.replay_tail": (app.SQL_REPLAY_TAIL, (100,)),
+        "config.version": (app.SQL_CONFIG_VERSION, ()),
+        "balances.version": (app.SQL_BALANCE_VERSION, ()),
+        "alerts.recent": app.alerts_query(None, None, None, None, 50),
+        "alerts.by_type": app.alerts_query("RATE_LIMIT", None, "2000-01-01", None, 50),
+        "alerts.by_merchant": app.alerts_query(None, "merchant1", None, None, 50),
+        "config.merchant_limits": (app.SQL_MERCHANT_LIMITS, ("merchant1",)),
+        "balances.snapshot_rows": (app.SQL_SNAPSHOT_ROWS, (1,)),
+        "archive.day_rows": (f"SELECT {app.TX_COLUMNS} FROM transactions WHERE ts >= ? AND ts < ? ORDER BY seq", ("2000-01-01", "2000-01-02")),
+        "transactions.latest": app.tx_history_query(None, None, None, None, None, None, "desc", 50),
+        "settlement_csv": (app.SQL_SETTLEMENT, ("2000-01-01", "2000-01-02")),
+        "settlement_csv.by_day": (app.SQL_SETTLEMENT_DAYS, ("2000-01-01", "2000-01-02")),
+        "lots.open_for_user": (app.SQL_OPEN_LOTS, ("user1",)),
+        "lots.user_expirable": (app.SQL_USER_EXPIRABLE, ("user1", "2000-01-01T00:00:00")),
+        "lots.expirable_by_user": (app.SQL_EXPIRABLE_BY_USER, ("2000-01-01T00:00:00",)),
+    }
+
+def explain(cur, sql: str, params=()) -> list:
+    return [r[3] for r in cur.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+def full_scans(plan: list, sql: str) -> list:
+    limited = " LIMIT " in " ".join(sql.upper().split())
+    return [step for step in plan
+            if step.split(" ")[0] == "SCAN" and step.split(" ")[1] in GUARDED_TABLES
+            and not (limited and "USING" in step)]
+
+def test_hot_queries_use_indexes(app, cur):
+    bad = {}
+    for name, (sql, params) in hot_queries(app).items():
+        plan = explain(cur, sql, params)
+        if full_scans(plan, sql):
+            bad[name] = plan
+    assert not bad, f"hot queries scan a ledger table: {bad}"
+
+def test_guard_flags_a_full_scan(app, cur):
+    sql = "SELECT COUNT(*) FROM transactions WHERE note = ?"
+    assert full_scans(explain(cur, sql, ("x",)), sql)
@@ -0,0 +1,50 @@
+import random
+
+USERS, MERCHANT = ["su1", "su2", "su3"], "sm1"
+
+def accounts_table(cur):
+    return dict(cur.execute("SELECT id, balance FROM accounts").fetchall())
+
+def replayed(app, full=False):
+    with app.POOL.write() as cur:
+        rep = app.replay_balances(cur, full=full)
+        table = accounts_table(cur)
+    balances = dict.fromkeys(table, 0)
+    balances.update(rep["balances"])
+    return rep, balances, table
+
+def traffic(app, rng, n):
+    for _ in range(n):
+        uid = rng.choice(USERS)
+        with app.POOL.write() as cur:
+            bal = app.BALANCES.peek(uid)[1]
+            ttype = rng.choice(["ISSUE", "EARN", "REDEEM", "EXPIRE"]) if bal > 0 else "ISSUE"
+            amount = rng.randrange(1, bal + 1) if ttype in ("REDEEM", "EXPIRE") else rng.randrange(1, 50)
+            app.apply_tx(cur, ttype, uid, MERCHANT if ttype in ("EARN", "REDEEM") else None, amount, None)
+
+def test_snapshot_plus_tail_equals_accounts(app):
+    with app.POOL.write() as cur:
+        accounts = [(MERCHANT, "merchant")] + [(u, "user") for u in USERS]
+        cur.executemany("INSERT OR IGNORE INTO accounts(id, kind, balance) VALUES(?,?,0)", accounts)
+        app.BALANCES.open_accounts(accounts)
+    rng = random.Random(20)
+    traffic(app, rng, 40)
+    taken = app.SNAPSHOTS.take()
+    with app.POOL.read() as cur:
+        sid, seq = cur.execute("SELECT id, seq FROM balance_snapshots ORDER BY seq DESC LIMIT 1").fetchone()
+        stored = dict(cur.execute("SELECT account_id, balance FROM balance_snapshot_rows WHERE snapshot_id = ?", (sid,)))
+        table = accounts_table(cur)
+    assert seq == taken["seq"] == app.CHAIN.seq
+    assert stored == {acc: b for acc, b in table.items() if b}
+
+    rep, balances, table = replayed(app)
+    assert (rep["snapshot_id"], rep["rows"]) == (sid, 0)
+    assert balances == table
+
+    traffic(app, rng, 40)
+    rep, balances, table = replayed(app)
+    assert (rep["snapshot_id"], rep["from_seq"], rep["seq"]) == (sid, seq, app.CHAIN.seq)
+    assert rep["rows"] == app.CHAIN.seq - seq
+    assert balances == table
+    assert replayed(app, full=True)[1] == balances
+    assert app.check_balances()["ok"]
@@ -0,0 +1,24 @@
+import hashlib
+import random
+
+STRINGS = ["", "plain", 'q"uote', "back\\slash", "tab\tnl\n", "\x00\x1f\x7f", "café", "☃", "\U0001f600",
+           "\ud800", "</script>", "2024-03-01T23:59:59.999999"]
+VALUES = STRINGS + [None, 0, -1, 2**63, 7, 1.5, True, [1, "a"], {"b": 1, "a": [None]}]
+
+def test_tx_hash_matches_reference(app):
+    # tx_hash must produce the same bytes as hash_tx (canonical JSON) for any field values.
+    rng = random.Random(11)
+    bad = []
+    for i in range(20000):
+        f = [rng.choice(VALUES) for _ in range(6)]
+        prev = rng.choice([None, "", hashlib.sha256(str(i).encode()).hexdigest()])
+        ref = app.hash_tx({"ts": f[0], "ttype": f[1], "user_id": f[2], "merchant_id": f[3], "amount": f[4], "note": f[5]}, prev)
+        if app.tx_hash(f[0], f[1], f[2], f[3], f[4], f[5], prev) != ref:
+            bad.append((f, prev))
+    assert not bad, bad[:20]
+
+def test_make_tx_row_hash(app):
+    row = app.make_tx_row(1, "2024-03-01T00:00:00", "EARN", "user1", "merchant1", 5, None, None)
+    assert row[8] == app.hash_tx({"ts": "2024-03-01T00:00:00", "ttype": "EARN", "user_id": "user1",
+                                  "merchant_id": "merchant1", "amount": 5, "note": None}, None)
+    assert row[0] == row[8][:16]